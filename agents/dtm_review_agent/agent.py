@@ -1,8 +1,13 @@
-from google.adk.agents import LlmAgent, SequentialAgent
+from google.adk.agents import LlmAgent, SequentialAgent, ParallelAgent, BaseAgent
 from google.adk.agents import Agent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event, EventActions
+import asyncio
+import json
+import xml.etree.ElementTree as ET
 from google.adk.models.lite_llm import LiteLlm
 from pydantic import BaseModel, Field
-from typing import List
+from typing import AsyncGenerator, List, Optional
 from config.settings import Settings
 from google.adk.tools import agent_tool
 from google.cloud import storage
@@ -17,8 +22,13 @@ from google.adk.auth.auth_credential import HttpAuth, HttpCredentials
 from google.adk.planners import BuiltInPlanner
 from google.oauth2 import credentials
 import os
-from agents.shared_libraries.utils import proxyModel, customAFC
-from agents.sub_agents.standardizing_agent import StandardizationReport
+from agents.shared_libraries.utils import proxyModel, rateLimitedModel, customAFC
+from agents.sub_agents.standardizing_agent import StandardizationReport, StandardizingAgent, EntityCompliance, apply_rule_findings
+from agents.shared_libraries.gdm_rules import RuleFinding, evaluate_rules
+from agents.shared_libraries.guideline_cache import CompiledGuidelines, get_compiled_guidelines
+from agents.shared_libraries.structured_output import repair_output_callback
+from agents.shared_libraries.dtm_xml import EntityChunk, analyze_model, format_model_outline, split_entities
+from agents.shared_libraries.review_cache import ReviewCache, review_cache_key
 from google.adk.tools.agent_tool import AgentTool
 from google.genai import types
 import logging
@@ -46,17 +56,8 @@ class DtmReviewReport(BaseModel):
 
 
 # --- Pydantic Models for Agent Sequence Flow ---
-
-class InitialAnalysisOutput(BaseModel):
-    """Output of the initial analysis agent."""
-    xml_content: str = Field(description="The original DTM XML content that was analyzed.")
-    identified_entities: List[str] = Field(description="A list of names of the main entities identified within the XML.")
-
-class StandardizationStepOutput(BaseModel):
-    """Output of the standardization step, passing through data for the next step."""
-    xml_content: str = Field(description="The original DTM XML content, passed through from the previous step.")
-    identified_entities: List[str] = Field(description="List of entity names, passed through from the previous step.")
-    standardization_report: StandardizationReport = Field(description="The generated GDM standardization compliance report.")
+# The DTM XML itself is seeded into session state as `xml_content` by the caller
+# and read by each agent's instruction; no agent echoes it back in its output.
 
 class FinalCombinedReport(BaseModel):
     """The final combined report containing both general and standardization reviews."""
@@ -64,70 +65,290 @@ class FinalCombinedReport(BaseModel):
     standardization_report: StandardizationReport = Field(description="The detailed GDM standardization compliance report.")
 
 
-# --- Prompts for New Agents ---
-# These are defined here for clarity, but would ideally be in prompt_master.
+# --- Sub-Agent Definitions ---
 
-STANDARDIZATION_WRAPPER_PROMPT = f"""
-You are an expert Data Model Governance Analyst. Your first task is to analyze the provided DTM XML model and assess its compliance with the GDM Standardization Guidelines.
-Your second task is to pass through the original XML content and the list of identified entities for the next step in the process.
+def _guideline_state(guidelines: CompiledGuidelines) -> dict:
+    return {
+        "custom_guidelines": guidelines.text or "(None defined.)",
+        "guidelines_version": guidelines.version,
+    }
+
+
+class LocalAnalysisAgent(BaseAgent):
+    """Parses the DTM XML locally into entities, attributes, types, keys and descriptions, without a model call."""
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        try:
+            entities = analyze_model(ctx.session.state["xml_content"])
+            state_delta = {
+                "identified_entities": [entity.name for entity in entities],
+                "model_outline": format_model_outline(entities) or "(No complexType entities found in the XML.)",
+                "rule_findings": [finding.model_dump() for finding in evaluate_rules(entities)],
+            }
+        except ET.ParseError as e:
+            logging.warning("Could not parse DTM XML locally: %s", e)
+            state_delta = {
+                "identified_entities": [],
+                "model_outline": f"(The XML could not be parsed locally: {e}. Identify the entities from the XML content.)",
+                "rule_findings": [],
+            }
+        # Served from the in-process cache; BigQuery is only read after a guideline edit
+        state_delta.update(_guideline_state(await asyncio.to_thread(get_compiled_guidelines)))
+        yield Event(
+            invocation_id=ctx.invocation_id,
+            author=self.name,
+            branch=ctx.branch,
+            actions=EventActions(state_delta=state_delta),
+        )
+
+
+# Sub-agent 1: Identifies entities and their structure
+InitialAnalysisAgent = LocalAnalysisAgent(
+    name="initial_analysis_agent",
+    description="Parses DTM XML locally to identify entities and their attributes for detailed review.",
+)
 
-**XML Content to Analyze:**
-{{{{xml_content}}}}
+# Sub-agent 2a: GDM standardization check (see sub_agents/standardizing_agent.py)
+
+# Sub-agent 2b: Detailed best-practices review of each entity
+GeneralReviewAgent = LlmAgent(
+    model=rateLimitedModel,
+    name="general_review_agent",
+    description="Performs a detailed best-practices review of each DTM entity.",
+    instruction=prompt_master.DTM_DETAILED_REVIEW_PROMPT,
+    output_schema=DtmReviewReport,
+    output_key="general_review",
+    include_contents='none',
+    after_model_callback=repair_output_callback(DtmReviewReport, "entity_reviews"),
+)
 
-**Guidelines to enforce:**
-{prompt_master.DTM_STANDARDIZATION_GUIDELINES}
+# Both reviews only depend on the XML and the entity list, so they run concurrently
+ParallelReviewAgent = ParallelAgent(
+    name="parallel_review_agent",
+    description="Runs the GDM standardization check and the general review concurrently.",
+    sub_agents=[
+        StandardizingAgent,
+        GeneralReviewAgent,
+    ],
+)
 
-Based on your analysis, generate a standardization report. Then, structure your entire output to include that report along with the original `xml_content` and `identified_entities`.
-"""
 
-FINAL_REPORT_PROMPT = """
-You are a senior data architect acting as the final step in an analysis pipeline. You have been given a DTM XML model, a list of entities to review, and a pre-generated GDM standardization report.
+def _report_event(agent: BaseAgent, ctx: InvocationContext, report: FinalCombinedReport) -> Event:
+    return Event(
+        invocation_id=ctx.invocation_id,
+        author=agent.name,
+        branch=ctx.branch,
+        content=types.Content(role="model", parts=[types.Part(text=report.model_dump_json())]),
+    )
 
-Your tasks are:
-1.  Perform an in-depth general review of EACH entity from the provided list, based on architectural best practices. For each entity, provide a summary and actionable suggestions.
-2.  Compile your findings into a general review report with an overall summary.
-3.  Combine your general review report with the provided standardization report into a single, final output.
 
-**Full DTM XML Content:**
-{{{{xml_content}}}}
+class ReportMergeAgent(BaseAgent):
+    """Combines the two review reports and the rule findings from session state into the final report, without a model call."""
 
-**Entities to Review:**
-{{{{identified_entities}}}}
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        rule_findings = [RuleFinding.model_validate(finding) for finding in ctx.session.state.get("rule_findings", [])]
+        report = FinalCombinedReport(
+            general_review=ctx.session.state["general_review"],
+            standardization_report=apply_rule_findings(
+                StandardizationReport.model_validate(ctx.session.state["standardization_report"]),
+                rule_findings,
+            ),
+        )
+        yield _report_event(self, ctx, report)
 
-**Pre-generated Standardization Report:**
-{{{{standardization_report}}}}
 
-Produce the final combined report.
-"""
+# Sub-agent 3: Merges both reports
+FinalReportAgent = ReportMergeAgent(
+    name="final_report_agent",
+    description="Combines the general review and the standardization report into a final combined report.",
+)
 
-# --- Sub-Agent Definitions ---
 
-# Sub-agent 1: Identifies entities and passes along the XML
-InitialAnalysisAgent = LlmAgent(
-    model=proxyModel,
-    name="initial_analysis_agent",
-    description="Analyzes DTM XML to identify main entities and prepares for detailed review.",
-    instruction=prompt_master.DTM_INITIAL_ANALYSIS_PROMPT,
-    output_schema=InitialAnalysisOutput,
+# --- Per-Entity Map-Reduce Review for Large Models ---
+# Each entity is reviewed in its own small session holding only that entity's
+# XML, so review time depends on the largest entity rather than the model size.
+
+EntityStandardizingAgent = LlmAgent(
+    model=rateLimitedModel,
+    name="entity_standardizing_agent",
+    description="Checks a single DTM entity against the GDM standardization guidelines.",
+    instruction=prompt_master.DTM_ENTITY_STANDARDIZATION_PROMPT,
+    output_schema=EntityCompliance,
+    output_key="entity_compliance",
+    include_contents='none',
+    after_model_callback=repair_output_callback(EntityCompliance, "attributes"),
 )
 
-# Sub-agent 2: Performs standardization and passes data through
-StandardizationWrapperAgent = LlmAgent(
-    model=proxyModel,
-    name="standardization_wrapper_agent",
-    description="Performs GDM standardization check and passes all data to the final reporting step.",
-    instruction=STANDARDIZATION_WRAPPER_PROMPT,
-    input_schema=InitialAnalysisOutput,
-    output_schema=StandardizationStepOutput,
+EntityReviewAgent = LlmAgent(
+    model=rateLimitedModel,
+    name="entity_review_agent",
+    description="Performs a detailed best-practices review of a single DTM entity.",
+    instruction=prompt_master.DTM_ENTITY_REVIEW_PROMPT,
+    output_schema=EntityReview,
+    output_key="entity_review",
+    include_contents='none',
+    after_model_callback=repair_output_callback(EntityReview, "suggestions"),
 )
 
-# Sub-agent 3: Performs detailed review and combines with standardization report
-FinalReportAgent = LlmAgent(
-    model=proxyModel,
-    name="final_report_agent",
-    description="Performs a detailed review of each DTM entity and generates a final combined report.",
-    instruction=FINAL_REPORT_PROMPT,
-    output_schema=FinalCombinedReport,
+EntityParallelReviewAgent = ParallelAgent(
+    name="entity_parallel_review_agent",
+    description="Runs the standardization check and the general review of one entity concurrently.",
+    sub_agents=[
+        EntityStandardizingAgent,
+        EntityReviewAgent,
+    ],
+)
+
+ENTITY_REVIEW_APP = "dtm_entity_review_app"
+ENTITY_REVIEW_USER = "dtm_entity_review_user"
+
+entity_review_runner = Runner(
+    agent=EntityParallelReviewAgent,
+    app_name=ENTITY_REVIEW_APP,
+    session_service=InMemorySessionService(),
+)
+
+
+async def review_entity(chunk: EntityChunk, guidelines: CompiledGuidelines) -> tuple[EntityReview, EntityCompliance]:
+    """Runs both reviews for one entity chunk in a throwaway session."""
+    session_service = entity_review_runner.session_service
+    session = await session_service.create_session(
+        app_name=ENTITY_REVIEW_APP,
+        user_id=ENTITY_REVIEW_USER,
+        state={"xml_content": chunk.xml, "entity_name": chunk.name, **_guideline_state(guidelines)},
+    )
+    try:
+        async for _ in entity_review_runner.run_async(
+            user_id=ENTITY_REVIEW_USER,
+            session_id=session.id,
+            new_message=types.Content(role="user", parts=[types.Part(text=f"Review the entity {chunk.name}.")]),
+        ):
+            pass
+        session = await session_service.get_session(
+            app_name=ENTITY_REVIEW_APP, user_id=ENTITY_REVIEW_USER, session_id=session.id
+        )
+        return (
+            EntityReview.model_validate(session.state["entity_review"]),
+            EntityCompliance.model_validate(session.state["entity_compliance"]),
+        )
+    finally:
+        await session_service.delete_session(
+            app_name=ENTITY_REVIEW_APP, user_id=ENTITY_REVIEW_USER, session_id=session.id
+        )
+
+
+# --- Per-Entity Result Cache ---
+# Modellers resubmit the same model with small edits. The map-reduce path caches
+# each entity's results by the entity's canonical XML (plus guideline version and
+# model), so only entities that changed are reviewed again. Whole-model reviews
+# are not split into this cache: they are written with cross-entity context and
+# would not match what the per-entity review produces. Rule findings are not
+# cached: they are cheap and some depend on the rest of the model.
+
+def _entity_cache_key(chunk: EntityChunk, guidelines_version: str) -> str:
+    return review_cache_key(chunk.xml, guidelines_version, str(proxyModel))
+
+
+def get_cached_entity_review(chunk: EntityChunk, guidelines_version: str) -> Optional[tuple[EntityReview, EntityCompliance]]:
+    cached = entity_review_cache.get(_entity_cache_key(chunk, guidelines_version))
+    if cached is None:
+        return None
+    result = json.loads(cached)
+    return (
+        EntityReview.model_validate(result["entity_review"]),
+        EntityCompliance.model_validate(result["entity_compliance"]),
+    )
+
+
+def cache_entity_review(chunk: EntityChunk, guidelines_version: str, review: EntityReview, compliance: EntityCompliance):
+    """Stores the model's results for one entity, before rule findings are applied."""
+    entity_review_cache.set(
+        _entity_cache_key(chunk, guidelines_version),
+        json.dumps({"entity_review": review.model_dump(), "entity_compliance": compliance.model_dump()}),
+    )
+
+
+def reduce_entity_reviews(
+    results: List[tuple[EntityReview, EntityCompliance]],
+    rule_findings: List[RuleFinding],
+) -> FinalCombinedReport:
+    """Deterministically folds per-entity results (in document order) and rule findings into the combined report."""
+    entity_reviews = [review for review, _ in results]
+    checked = apply_rule_findings(
+        StandardizationReport(report_summary="", entities=[entity for _, entity in results]),
+        rule_findings,
+    )
+    compliance = checked.entities
+
+    suggestion_count = sum(len(review.suggestions) for review in entity_reviews)
+    most_suggestions = sorted(entity_reviews, key=lambda review: -len(review.suggestions))[:5]
+    overall_summary = f"Reviewed {len(entity_reviews)} entities individually, with {suggestion_count} suggestions in total."
+    if suggestion_count:
+        overall_summary += " Entities with the most suggestions: " + ", ".join(
+            f"{review.entity_name} ({len(review.suggestions)})" for review in most_suggestions if review.suggestions
+        ) + "."
+
+    non_compliant = [entity.entity_name for entity in compliance if not entity.is_compliant]
+    report_summary = f"{len(compliance) - len(non_compliant)} of {len(compliance)} entities comply with the GDM standardization guidelines."
+    if non_compliant:
+        report_summary += " Non-compliant entities: " + ", ".join(non_compliant) + "."
+    if checked.report_summary:
+        report_summary += " " + checked.report_summary
+
+    return FinalCombinedReport(
+        general_review=DtmReviewReport(
+            report_title="DTM Model Review Report",
+            overall_summary=overall_summary,
+            entity_reviews=entity_reviews,
+        ),
+        standardization_report=StandardizationReport(
+            report_summary=report_summary,
+            entities=compliance,
+        ),
+    )
+
+
+class EntityMapReduceAgent(BaseAgent):
+    """Reviews every entity of a large model separately with bounded concurrency, then reduces the results.
+
+    Entities whose results are cached are not reviewed again.
+    """
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        xml_content = ctx.session.state["xml_content"]
+        chunks = split_entities(xml_content)
+        # Rules run over the whole model, since some compare attributes across entities
+        rule_findings = evaluate_rules(analyze_model(xml_content))
+        guidelines = await asyncio.to_thread(get_compiled_guidelines)
+        semaphore = asyncio.Semaphore(config.DTM_REVIEW_MAX_CONCURRENCY)
+
+        async def review(chunk: EntityChunk) -> tuple[EntityReview, EntityCompliance]:
+            # SQLite-backed: keep the lookup off the event loop
+            cached = await asyncio.to_thread(get_cached_entity_review, chunk, guidelines.version)
+            if cached is not None:
+                return cached
+            async with semaphore:
+                try:
+                    review, compliance = await review_entity(chunk, guidelines)
+                    await asyncio.to_thread(cache_entity_review, chunk, guidelines.version, review, compliance)
+                    return review, compliance
+                except Exception as e:
+                    # One failed entity should not sink the review of the whole model
+                    logging.error("Review of entity %s failed: %s", chunk.name, e, exc_info=True)
+                    findings = f"Automated review failed: {e}"
+                    return (
+                        EntityReview(entity_name=chunk.name, review_summary=findings, suggestions=[]),
+                        EntityCompliance(entity_name=chunk.name, is_compliant=False, findings=findings, attributes=[]),
+                    )
+
+        # gather keeps document order, so the reduced report does not depend on completion order
+        results = await asyncio.gather(*(review(chunk) for chunk in chunks))
+        yield _report_event(self, ctx, reduce_entity_reviews(results, rule_findings))
+
+
+MapReduceReviewAgent = EntityMapReduceAgent(
+    name="map_reduce_review_agent",
+    description="Reviews each entity of a large DTM model separately and combines the results into a final report.",
 )
 
 
@@ -135,18 +356,57 @@ FinalReportAgent = LlmAgent(
 
 DtmReviewAgent = SequentialAgent(
     name="dtm_review_agent",
-    description="A sequential agent that performs a comprehensive review of a DTM XML model, including a GDM standardization check and a general best-practices review.",
+    description="A sequential agent that performs a comprehensive review of a DTM XML model, running a GDM standardization check and a general best-practices review in parallel.",
     sub_agents=[
         InitialAnalysisAgent,
-        StandardizationWrapperAgent,
+        ParallelReviewAgent,
         FinalReportAgent,
     ],
 )
 
-root_agent = DtmReviewAgent
+class DtmReviewRouterAgent(BaseAgent):
+    """Sends small models through the whole-model review and large ones through the per-entity map-reduce.
+
+    The route depends on the model size only, never on what is cached, so a
+    resubmitted model gets the same kind of report as before.
+    """
+
+    async def _run_async_impl(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        try:
+            chunks = split_entities(ctx.session.state["xml_content"])
+        except ET.ParseError as e:
+            # Let the model make what it can of XML the splitter cannot parse
+            logging.warning("Could not split DTM XML into entities: %s", e)
+            chunks = []
+
+        if len(chunks) >= config.DTM_MAP_REDUCE_MIN_ENTITIES:
+            agent = MapReduceReviewAgent
+        else:
+            agent = DtmReviewAgent
+        logging.info("Reviewing DTM model with %d entities using %s", len(chunks), agent.name)
+        async for event in agent.run_async(ctx):
+            yield event
+
+
+DtmReviewRouter = DtmReviewRouterAgent(
+    name="dtm_review_router",
+    description="Routes a DTM XML review to the whole-model or the per-entity review depending on model size.",
+    sub_agents=[
+        DtmReviewAgent,
+        MapReduceReviewAgent,
+    ],
+)
+
+root_agent = DtmReviewRouter
 
 config = Settings.get_settings()
 
+entity_review_cache = ReviewCache(
+    config.ENTITY_REVIEW_CACHE_PATH,
+    max_entries=config.ENTITY_REVIEW_CACHE_MAX_ENTRIES,
+    ttl_seconds=config.REVIEW_CACHE_TTL_SECONDS,
+)
+
 gcs_service_py = GcsArtifactService(
     bucket_name=config.ARTIFACT_GCS_BUCKET
 )
@@ -2,7 +2,7 @@ from agents.dtm_review_agent.agent import root_agent as dtm_review_agent
 
 from google.adk.sessions import InMemorySessionService, DatabaseSessionService
 from google.adk.runners import Runner
-from google.adk.events import Event
+from google.adk.events import Event, EventActions
 from fastapi import FastAPI, Body, Depends, HTTPException, File, UploadFile
 from dotenv import load_dotenv
 from typing import Any, AsyncIterator, Optional
@@ -19,10 +19,17 @@ from starlette.types import Lifespan
 from agents.shared_libraries.utils import (
     extract_attachment_ids_and_sanitize_response,
     extract_thinking_process,
+    proxyModel,
 )
+import asyncio
+import json
 import logging
 from google.genai import types
-import vertexai
+from agents.shared_libraries.model_registry import init_vertexai
+from agents.shared_libraries.rate_limiter import limiter_metrics
+from agents.shared_libraries.entity_search import find_similar_entities
+from agents.shared_libraries.guideline_cache import bump_guideline_version, get_compiled_guidelines
+from agents.shared_libraries.review_cache import ReviewCache, review_cache_key
 
 load_dotenv()
 logging.basicConfig(level=logging.DEBUG)
@@ -33,6 +40,7 @@ class AppContexts(SimpleNamespace):
     session_service: InMemorySessionService = None
     artifact_service: GcsArtifactService = None
     dtm_review_agent_runner: Runner = None
+    review_cache: ReviewCache = None
 
 app_contexts = AppContexts()
 
@@ -58,10 +66,17 @@ async def lifespan(app: FastAPI):
         artifact_service=app_contexts.artifact_service,
     )
 
-    vertexai.init(project=config.PROJECT_ID, location=config.REGION)
+    init_vertexai(project=config.PROJECT_ID, location=config.REGION)
+    get_compiled_guidelines()  # Warm the guideline cache before the first review
+    app_contexts.review_cache = ReviewCache(
+        config.REVIEW_CACHE_PATH,
+        max_entries=config.REVIEW_CACHE_MAX_ENTRIES,
+        ttl_seconds=config.REVIEW_CACHE_TTL_SECONDS,
+    )
 
     yield
     #Cleanup operations can go here.
+    app_contexts.review_cache.close()
 
 async def get_app_contexts() -> AppContexts:
     return app_contexts
@@ -148,11 +163,43 @@ async def dtm_review(
         raise HTTPException(status_code=400, detail="XML content is missing.")
 
     try:
+        # Identical XML (up to formatting and attribute order) reviewed against the
+        # same guidelines by the same model gives the same report
+        guidelines = await asyncio.to_thread(get_compiled_guidelines)
+        cache_key = review_cache_key(request.text, guidelines.version, str(proxyModel))
+        cached_response = await asyncio.to_thread(app_context.review_cache.get, cache_key)
+        if cached_response is not None:
+            logging.info("DTM review served from cache (%s)", cache_key[:12])
+            return ChatResponse(response=cached_response)
+
+        # The agents read the XML from session state, so it is not repeated in
+        # the conversation history or echoed through model outputs.
+        session = await app_context.session_service.get_session(
+            app_name="dtm_review_app", user_id=user_id, session_id=session_id
+        )
+        if session is None:
+            await app_context.session_service.create_session(
+                app_name="dtm_review_app",
+                user_id=user_id,
+                session_id=session_id,
+                state={"xml_content": request.text},
+            )
+        else:
+            await app_context.session_service.append_event(
+                session,
+                Event(
+                    author="user",
+                    actions=EventActions(state_delta={"xml_content": request.text}),
+                ),
+            )
+
         events_iterator: AsyncIterator[Event] = (
             app_context.dtm_review_agent_runner.run_async(
                 user_id=user_id,
                 session_id=session_id,
-                new_message={"xml_content": request.text},
+                new_message=types.Content(
+                    role="user", parts=[types.Part(text="Review the DTM XML model.")]
+                ),
             )
         )
         async for event in events_iterator:
@@ -169,6 +216,13 @@ async def dtm_review(
         )
         sanitized_text, thinking_process = extract_thinking_process(sanitized_text)
 
+        # Only complete reports are cached, so a failed run is retried next time
+        try:
+            if "general_review" in json.loads(sanitized_text):
+                await asyncio.to_thread(app_context.review_cache.set, cache_key, sanitized_text)
+        except (json.JSONDecodeError, TypeError):
+            pass
+
         return ChatResponse(
             response=sanitized_text,
             thinking_process=thinking_process,
@@ -186,7 +240,8 @@ async def sql_analysis(
 ) -> dict:
     """Process SQL analysis request and get response from the agent"""
     try:
-        response = extract_sql_details(request.sql_query, request.file_path)
+        # Blocking: the rate limiter waits and backs off on the calling thread
+        response = await asyncio.to_thread(extract_sql_details, request.sql_query, request.file_path)
         return {"response": response}
     except Exception as e:
         logging.error("Error processing SQL analysis request: %s", e, exc_info=True)
@@ -221,7 +276,8 @@ async def sql_analysis_from_file(
         
         sql_bucket_name = "lbg-gdm-sqls"
         
-        gcs_path = upload_bytes_to_gcs(
+        gcs_path = await asyncio.to_thread(
+            upload_bytes_to_gcs,
             bucket_name=sql_bucket_name,
             blob_name=file.filename,
             file_bytes=content,
@@ -230,13 +286,45 @@ async def sql_analysis_from_file(
 
         sql_query = content.decode("utf-8")
 
-        response = extract_sql_details(sql_query, gcs_path)
+        response = await asyncio.to_thread(extract_sql_details, sql_query, gcs_path)
 
         return {"response": response}
     except Exception as e:
         logging.error("Error processing SQL analysis from file: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/entities/{entity_name}/similar")
+async def similar_entities(entity_name: str, k: int = 10) -> dict:
+    """Returns the DTM entities most similar to the given entity, from the entity ANN index."""
+    try:
+        # May sync from BigQuery, train and save the index: keep it off the event loop
+        similar = await asyncio.to_thread(find_similar_entities, entity_name, k=k)
+        return {"entity": entity_name, "similar": similar}
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Entity '{entity_name}' not found in the entity index")
+    except Exception as e:
+        logging.error("Error searching similar entities: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/guidelines/version")
+async def guidelines_changed() -> dict:
+    """Called by the frontend after a guideline is added, updated or deleted; the next review reloads them.
+
+    Only this process is bumped; other workers and instances notice the change within GUIDELINE_CHECK_SECONDS.
+    """
+    generation = bump_guideline_version()
+    return {"generation": generation}
+
+@app.get("/guidelines/version")
+def guidelines_version() -> dict:
+    """Returns the content-hash version of the guidelines currently used by the review agents."""
+    return {"version": get_compiled_guidelines().version}
+
+@app.get("/metrics/limiters")
+async def get_limiter_metrics() -> list[dict]:
+    """Returns the current concurrency limit and call counters of each Vertex AI limiter."""
+    return limiter_metrics()
+
 @app.get("/hello")
 async def read_root():
     return {"Hello": "World"}
@@ -0,0 +1,110 @@
+import copy
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+from google.cloud import bigquery
+
+# Every BigQuery job issued through `run_query` / `run_load_job` is logged as one JSON line.
+# Set BQ_METRICS_FILE to also append the records to a local file, which is rotated
+# once it reaches BQ_METRICS_MAX_BYTES (the previous file is kept as `<file>.1`).
+BQ_METRICS_FILE = os.environ.get("BQ_METRICS_FILE") or None
+BQ_METRICS_MAX_BYTES = int(os.environ.get("BQ_METRICS_MAX_BYTES", 10 * 1024 * 1024))
+
+logger = logging.getLogger(__name__)
+
+_metrics_lock = threading.Lock()
+
+
+def _label_value(name: str) -> str:
+    """Converts a query name into a valid BigQuery label value."""
+    return re.sub(r"[^a-z0-9_-]", "_", name.lower())[:63]
+
+
+def hash_query_parameters(job_config) -> str:
+    """Returns a short, stable hash of a job's query parameters."""
+    params = getattr(job_config, "query_parameters", None) or []
+    payload = json.dumps([param.to_api_repr() for param in params], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def record_metrics(metrics: dict):
+    """Logs a metrics record and, if BQ_METRICS_FILE is set, appends it to that file."""
+    line = json.dumps({"timestamp": datetime.now(timezone.utc).isoformat(), **metrics}, default=str)
+    logger.info("bq_metrics %s", line)
+    if not BQ_METRICS_FILE:
+        return
+    try:
+        with _metrics_lock:
+            if os.path.exists(BQ_METRICS_FILE) and os.path.getsize(BQ_METRICS_FILE) >= BQ_METRICS_MAX_BYTES:
+                os.replace(BQ_METRICS_FILE, f"{BQ_METRICS_FILE}.1")
+            with open(BQ_METRICS_FILE, "a") as f:
+                f.write(line + "\n")
+    except OSError as e:
+        logger.warning("Could not write BigQuery metrics to %s: %s", BQ_METRICS_FILE, e)
+
+
+def run_query(client, name: str, query: str, job_config=None):
+    """Runs a query, waits for it to finish and records its latency and cost.
+
+    Returns the completed QueryJob so callers can read results from it as before.
+    The query name is also attached as a `query_name` job label so jobs can be
+    attributed in INFORMATION_SCHEMA.JOBS.
+    """
+    # Work on a copy so the caller's config (and its labels) is left untouched
+    job_config = copy.deepcopy(job_config) if job_config else bigquery.QueryJobConfig()
+    job_config.labels = {**(job_config.labels or {}), "query_name": _label_value(name)}
+
+    start = time.perf_counter()
+    query_job = None
+    error = None
+    try:
+        query_job = client.query(query, job_config=job_config)
+        query_job.result()
+        return query_job
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        record_metrics({
+            "name": name,
+            "job_type": "query",
+            "params_hash": hash_query_parameters(job_config),
+            "wall_ms": round((time.perf_counter() - start) * 1000, 1),
+            "slot_ms": getattr(query_job, "slot_millis", None),
+            "bytes_processed": getattr(query_job, "total_bytes_processed", None),
+            "bytes_billed": getattr(query_job, "total_bytes_billed", None),
+            "cache_hit": getattr(query_job, "cache_hit", None),
+            "dry_run": bool(job_config.dry_run),
+            "job_id": getattr(query_job, "job_id", None),
+            "error": error,
+        })
+
+
+def run_load_job(client, name: str, df, table_id: str, job_config=None):
+    """Loads a DataFrame into a table, waits for it to finish and records its latency."""
+    start = time.perf_counter()
+    load_job = None
+    error = None
+    try:
+        load_job = client.load_table_from_dataframe(df, table_id, job_config=job_config)
+        load_job.result()
+        return load_job
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        record_metrics({
+            "name": name,
+            "job_type": "load",
+            "table_id": table_id,
+            "wall_ms": round((time.perf_counter() - start) * 1000, 1),
+            "output_rows": getattr(load_job, "output_rows", None),
+            "job_id": getattr(load_job, "job_id", None),
+            "error": error,
+        })
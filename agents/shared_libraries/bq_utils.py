@@ -3,7 +3,9 @@ from google.api_core.exceptions import NotFound
 from datetime import datetime, timezone
 import json
 import os
+from typing import Optional
 from config.settings import Settings
+from agents.shared_libraries.bq_metrics import run_query
 
 def get_bq_client():
     """Initializes the BigQuery client."""
@@ -62,7 +64,7 @@ def insert_sql_extract_to_bq(q_id: str, raw_sql_path: str, parser_output: dict,
     )
 
     try:
-        client.query(merge_query, job_config=job_config).result()
+        run_query(client, "insert_sql_extract_to_bq", merge_query, job_config=job_config).result()
         print(f"Successfully inserted/updated record with q_id: {q_id}")
         return True
     except Exception as e:
@@ -99,11 +101,94 @@ def delete_analysis_data(q_id: str):
         )
 
         try:
-            client.query(query, job_config=job_config).result()
+            run_query(client, "delete_analysis_data", query, job_config=job_config).result()
             print(f"Deleted data from {table_name} for q_id: {q_id}")
         except Exception as e:
             # Don't fail if a table doesn't exist
             if "Not found: Table" in str(e):
                 print(f"Table {table_id} not found, skipping delete.")
                 continue
-            print(f"Failed to delete data from {table_name}: {e}")
\ No newline at end of file
+            print(f"Failed to delete data from {table_name}: {e}")
+
+def get_entity_embeddings(since: datetime = None) -> list[dict]:
+    """Fetches entity names and embeddings from the entities table, optionally only those loaded after `since`."""
+    client = get_bq_client()
+    if not client:
+        print("BigQuery client not available. Skipping operation.")
+        return []
+
+    config = Settings.get_settings()
+    table_id = f"{config.PROJECT_ID}.{config.ENTITIES_DATASET}.{config.ENTITIES_TABLE}"
+
+    query = f"""
+    SELECT complex_type_name, embedding, load_timestamp
+    FROM `{table_id}`
+    WHERE ARRAY_LENGTH(embedding) > 0
+      AND (@since IS NULL OR load_timestamp > @since)
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("since", "TIMESTAMP", since),
+        ]
+    )
+
+    try:
+        rows = run_query(client, "get_entity_embeddings", query, job_config=job_config).result()
+        return [dict(row) for row in rows]
+    except NotFound:
+        print(f"Entities table {table_id} not found.")
+        return []
+    except Exception as e:
+        print(f"Error fetching entity embeddings: {e}")
+        return []
+
+def get_active_guidelines() -> Optional[list[dict]]:
+    """Fetches the active review guidelines defined in the frontend, oldest first. Returns None if they could not be read."""
+    client = get_bq_client()
+    if not client:
+        print("BigQuery client not available. Skipping operation.")
+        return None
+
+    config = Settings.get_settings()
+    table_id = f"{config.PROJECT_ID}.{config.GUIDELINES_DATASET}.{config.GUIDELINES_TABLE}"
+
+    # Same de-duplication as the frontend's get_all_guidelines
+    query = f"""
+    SELECT guideline_id, guideline_text
+    FROM (
+        SELECT *, ROW_NUMBER() OVER(PARTITION BY guideline_text ORDER BY updated_at DESC) as rn
+        FROM `{table_id}`
+    )
+    WHERE rn = 1 AND is_active
+    ORDER BY created_at, guideline_id
+    """
+
+    try:
+        rows = run_query(client, "get_active_guidelines", query).result()
+        return [dict(row) for row in rows]
+    except NotFound:
+        print(f"Guidelines table {table_id} not found.")
+        return []
+    except Exception as e:
+        print(f"Error fetching guidelines: {e}")
+        return None
+
+
+def get_guidelines_fingerprint() -> Optional[str]:
+    """Returns a cheap summary of the guidelines table (row count and latest update) that changes whenever a guideline is added, updated or deleted. Returns None if it could not be read."""
+    client = get_bq_client()
+    if not client:
+        return None
+
+    config = Settings.get_settings()
+    table_id = f"{config.PROJECT_ID}.{config.GUIDELINES_DATASET}.{config.GUIDELINES_TABLE}"
+    query = f"SELECT COUNT(*) AS row_count, MAX(updated_at) AS last_updated FROM `{table_id}`"
+
+    try:
+        row = next(iter(run_query(client, "get_guidelines_fingerprint", query).result()))
+        return f"{row.row_count}:{row.last_updated}"
+    except NotFound:
+        return "missing"
+    except Exception as e:
+        print(f"Error fetching guidelines fingerprint: {e}")
+        return None
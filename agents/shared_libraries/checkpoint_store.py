@@ -0,0 +1,117 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Iterable, Iterator, Optional
+
+
+class CheckpointStore:
+    """Crash-safe record of completed work items and their results for long-running batch jobs.
+
+    Backed by SQLite in WAL mode: marking an item done is a single small
+    transaction appended to the write-ahead log, so the cost per item does not
+    grow with the size of the job and an interrupted write never corrupts items
+    already recorded. Several jobs can share one file, keyed by `job`.
+    """
+
+    def __init__(self, path: str, job: str = "default"):
+        self.path = path
+        self.job = job
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                job TEXT NOT NULL,
+                key TEXT NOT NULL,
+                result TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (job, key)
+            )
+            """
+        )
+
+    def mark_done(self, key: str, result: Any = None):
+        """Records an item as done, with an optional JSON-serializable result."""
+        self.mark_many([(key, result)])
+
+    def mark_many(self, items: Iterable[tuple[str, Any]]):
+        """Records several items as done in a single transaction."""
+        now = time.time()
+        rows = [(self.job, str(key), json.dumps(result, default=str), now) for key, result in items]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    # Upsert in place so an item keeps its rowid, and with it its first-recorded position
+                    "INSERT INTO checkpoints (job, key, result, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (job, key) DO UPDATE SET result = excluded.result, updated_at = excluded.updated_at",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def is_done(self, key: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM checkpoints WHERE job = ? AND key = ?", (self.job, str(key))
+            ).fetchone()
+        return row is not None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Returns the recorded result for an item, or `default` if it is not done."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM checkpoints WHERE job = ? AND key = ?", (self.job, str(key))
+            ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def done_keys(self) -> set[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT key FROM checkpoints WHERE job = ?", (self.job,)).fetchall()
+        return {row[0] for row in rows}
+
+    def results(self) -> Iterator[tuple[str, Any]]:
+        """Yields (key, result) for every done item, in the order they were first recorded."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, result FROM checkpoints WHERE job = ? ORDER BY rowid", (self.job,)
+            ).fetchall()
+        for key, result in rows:
+            yield key, json.loads(result)
+
+    def reset(self, keys: Optional[Iterable[str]] = None) -> int:
+        """Forgets the given items (or the whole job) so they are processed again. Returns the count removed."""
+        with self._lock:
+            if keys is None:
+                cursor = self._conn.execute("DELETE FROM checkpoints WHERE job = ?", (self.job,))
+            else:
+                cursor = self._conn.executemany(
+                    "DELETE FROM checkpoints WHERE job = ? AND key = ?",
+                    [(self.job, str(key)) for key in keys],
+                )
+            return cursor.rowcount
+
+    def compact(self):
+        """Folds the write-ahead log back into the database file and reclaims free space."""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.execute("VACUUM")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM checkpoints WHERE job = ?", (self.job,)).fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,228 @@
+import re
+import xml.etree.ElementTree as ET
+from typing import List, NamedTuple, Optional
+
+from pydantic import BaseModel, Field
+
+
+class DtmAttribute(BaseModel):
+    """An attribute of a DTM entity, as declared in the XML."""
+    name: str = Field(description="Name of the attribute.")
+    data_type: Optional[str] = Field(None, description="Declared type, with length/precision facets if any.")
+    description: Optional[str] = Field(None, description="Documentation text of the attribute.")
+    required: bool = Field(True, description="False when the attribute is optional (minOccurs=0, use='optional' or nillable).")
+    is_key: bool = Field(False, description="Whether the attribute is part of a key of the entity.")
+
+
+class DtmEntity(BaseModel):
+    """A DTM entity (complexType) with its attributes and keys."""
+    name: str = Field(description="Name of the entity.")
+    description: Optional[str] = Field(None, description="Documentation text of the entity.")
+    attributes: List[DtmAttribute] = Field(default_factory=list, description="Attributes in declaration order.")
+    keys: Optional[List[str]] = Field(
+        None,
+        description="Names of the key attributes; None when no <element> declares the entity, so the XSD cannot tell.",
+    )
+
+
+class EntityChunk(NamedTuple):
+    """A single DTM entity cut out of a larger data model export."""
+    name: str
+    xml: str
+
+
+def parse_dtm_xml(xml_content: str) -> ET.Element:
+    """Parses DTM XML with namespace prefixes removed, so snippets with unbound prefixes still parse."""
+    # Same pre-processing as the frontend's Load Entities page
+    processed_xml = re.sub(r'(</?)\w+:', r'\1', xml_content)
+    root = ET.fromstring(processed_xml)
+    # A default xmlns still qualifies every tag as "{uri}tag"; drop it as well
+    for element in root.iter():
+        if isinstance(element.tag, str) and element.tag.startswith("{"):
+            element.tag = element.tag.split("}", 1)[1]
+    return root
+
+
+def _entity_name(element: ET.Element, parent: Optional[ET.Element]) -> Optional[str]:
+    name = element.get("name")
+    if not name and parent is not None and parent.tag == "element":
+        # Anonymous <complexType> declared inline under a named <element>
+        name = parent.get("name")
+    return name
+
+
+def _entity_elements(root: ET.Element) -> list[tuple[str, ET.Element, Optional[ET.Element]]]:
+    """Returns (name, complexType, declaring <element> or None) per top-level entity, in document order."""
+    entities = []
+
+    def visit(element: ET.Element, parent: Optional[ET.Element]):
+        if element.tag == "complexType":
+            name = _entity_name(element, parent)
+            if name:
+                declaring_element = None if element.get("name") else parent
+                entities.append((name, element, declaring_element))
+                return  # Nested complex types belong to this entity
+        for child in element:
+            visit(child, element)
+
+    visit(root, None)
+    return entities
+
+
+def split_entities(xml_content: str) -> list[EntityChunk]:
+    """Cuts a DTM XML model into one chunk per top-level `complexType` entity, in document order.
+
+    Nested complex types stay inside the entity that declares them. The split
+    is deterministic: the same XML always yields the same chunks.
+    """
+    return [
+        # An inline type is kept with its <element> so the chunk still carries the name
+        EntityChunk(name, ET.tostring(declaring_element if declaring_element is not None else element, encoding="unicode").strip())
+        for name, element, declaring_element in _entity_elements(parse_dtm_xml(xml_content))
+    ]
+
+
+def entity_names(xml_content: str) -> list[str]:
+    """Returns the entity names in a DTM XML model, in document order."""
+    return [chunk.name for chunk in split_entities(xml_content)]
+
+
+def _documentation(element: ET.Element) -> Optional[str]:
+    texts = [
+        " ".join(doc.text.split())
+        for doc in element.findall("./annotation/documentation")
+        if doc.text and doc.text.strip()
+    ]
+    return " ".join(texts) or None
+
+
+def _data_type(element: ET.Element) -> Optional[str]:
+    if element.get("type"):
+        return element.get("type").split(":")[-1]
+    restriction = element.find("./simpleType/restriction")
+    if restriction is None:
+        return None
+    data_type = (restriction.get("base") or "").split(":")[-1] or None
+    facets = [
+        restriction.find(f"./{facet}").get("value")
+        for facet in ("maxLength", "length", "totalDigits", "fractionDigits")
+        if restriction.find(f"./{facet}") is not None
+    ]
+    if data_type and facets:
+        data_type += f"({', '.join(facets)})"
+    return data_type
+
+
+def _attributes(entity: ET.Element) -> list[DtmAttribute]:
+    attributes = []
+
+    def visit(element: ET.Element):
+        for child in element:
+            if child.tag == "element" and child.get("name"):
+                attributes.append(DtmAttribute(
+                    name=child.get("name"),
+                    data_type=_data_type(child),
+                    description=_documentation(child),
+                    required=child.get("minOccurs", "1") != "0" and child.get("nillable") != "true",
+                ))
+            elif child.tag == "attribute" and child.get("name"):
+                attributes.append(DtmAttribute(
+                    name=child.get("name"),
+                    data_type=_data_type(child),
+                    description=_documentation(child),
+                    required=child.get("use") == "required",
+                ))
+            elif child.tag in ("sequence", "all", "choice", "complexContent", "simpleContent", "extension", "restriction"):
+                visit(child)
+
+    visit(entity)
+    return attributes
+
+
+def _key_fields(element: ET.Element) -> list[str]:
+    """Field names of the <key>/<unique> constraints declared on an element."""
+    fields = []
+    for constraint in list(element.findall("./key")) + list(element.findall("./unique")):
+        for field in constraint.findall("./field"):
+            xpath = field.get("xpath", "")
+            name = xpath.split("/")[-1].lstrip("@").split(":")[-1]
+            if name and name not in fields:
+                fields.append(name)
+    return fields
+
+
+def _typed_elements(root: ET.Element) -> dict[str, list[ET.Element]]:
+    """Type name -> every <element type="..."> that declares an instance of that named type."""
+    typed: dict[str, list[ET.Element]] = {}
+    for element in root.iter("element"):
+        if element.get("type"):
+            typed.setdefault(element.get("type").split(":")[-1], []).append(element)
+    return typed
+
+
+def _entity_keys(name: str, element: ET.Element, declaring_element: Optional[ET.Element], typed: dict) -> Optional[list[str]]:
+    """Key fields of an entity, from the <key>/<unique> of the <element>(s) declaring it.
+
+    A named complexType cannot carry a <key> itself; its keys live on the
+    elements that reference it by type. With no such element (e.g. a single
+    pasted complexType) the keys are unknown, and None is returned.
+    """
+    if declaring_element is not None:
+        return _key_fields(declaring_element)
+    declaring_elements = typed.get(element.get("name") or name, [])
+    if not declaring_elements:
+        return None
+    keys = []
+    for declaring in declaring_elements:
+        keys.extend(field for field in _key_fields(declaring) if field not in keys)
+    return keys
+
+
+def analyze_model(xml_content: str) -> list[DtmEntity]:
+    """Extracts every entity with its attributes, types, keys and descriptions, in document order."""
+    root = parse_dtm_xml(xml_content)
+    typed = _typed_elements(root)
+    entities = []
+    for name, element, declaring_element in _entity_elements(root):
+        keys = _entity_keys(name, element, declaring_element, typed)
+        attributes = _attributes(element)
+        for attribute in attributes:
+            attribute.is_key = attribute.name in (keys or [])
+        description = _documentation(element)
+        if description is None and declaring_element is not None:
+            description = _documentation(declaring_element)
+        entities.append(DtmEntity(name=name, description=description, attributes=attributes, keys=keys))
+    return entities
+
+
+def format_model_outline(entities: list[DtmEntity]) -> str:
+    """Renders the analyzed model as a compact text outline for prompts."""
+    lines = []
+    for entity in entities:
+        header = f"- {entity.name}"
+        if entity.keys:
+            header += f" [key: {', '.join(entity.keys)}]"
+        if entity.description:
+            header += f": {entity.description}"
+        lines.append(header)
+        for attribute in entity.attributes:
+            line = f"    - {attribute.name}: {attribute.data_type or 'untyped'}"
+            line += ", required" if attribute.required else ", optional"
+            if attribute.is_key:
+                line += ", key"
+            line += f" — {attribute.description}" if attribute.description else " — (no description)"
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def canonicalize_xml(xml_content: str) -> str:
+    """Canonical form of a DTM XML model: namespace prefixes dropped, attributes sorted, insignificant whitespace removed.
+
+    Two exports that differ only in formatting or attribute order give the
+    same string. XML that does not parse falls back to whitespace collapsing.
+    """
+    try:
+        root = parse_dtm_xml(xml_content)
+    except ET.ParseError:
+        return " ".join(xml_content.split())
+    return ET.canonicalize(ET.tostring(root, encoding="unicode"), strip_text=True)
@@ -0,0 +1,142 @@
+import io
+import json
+import os
+import threading
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from google.cloud import bigquery
+
+
+class EmbeddingStore:
+    """Append-only binary store of keyed embedding vectors.
+
+    Vectors are appended as raw float32 (or float16) rows to `vectors.bin` and
+    their keys as lines to `keys.jsonl`, so an append costs only the new rows.
+    Loading memory-maps the vector file (no parsing or copying). If a key is
+    appended again, the latest vector wins. A crash can only lose the batch
+    being appended: rows without a key, or keys without a full row, are ignored.
+    """
+
+    def __init__(self, path: str, dim: int, dtype: str = "float32"):
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._vectors_path = os.path.join(path, "vectors.bin")
+        self._keys_path = os.path.join(path, "keys.jsonl")
+        self._meta_path = os.path.join(path, "meta.json")
+
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                meta = json.load(f)
+            if meta["dim"] != dim or meta["dtype"] != self.dtype.name:
+                raise ValueError(f"Embedding store at {path} holds {meta['dtype']}[{meta['dim']}] vectors, not {self.dtype.name}[{dim}]")
+        else:
+            with open(self._meta_path, "w") as f:
+                json.dump({"dim": dim, "dtype": self.dtype.name}, f)
+
+        self._keys: list[str] = []
+        if os.path.exists(self._keys_path):
+            with open(self._keys_path) as f:
+                for line in f:
+                    try:
+                        self._keys.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break  # Torn final line from an interrupted append
+        row_bytes = self.dim * self.dtype.itemsize
+        vector_rows = os.path.getsize(self._vectors_path) // row_bytes if os.path.exists(self._vectors_path) else 0
+        self._rows = min(len(self._keys), vector_rows)
+        if len(self._keys) != self._rows or vector_rows != self._rows:
+            self._keys = self._keys[:self._rows]
+            self._truncate_to(self._rows)
+        self._key_to_row = {key: row for row, key in enumerate(self._keys)}
+
+    def _truncate_to(self, rows: int):
+        """Drops partial rows/keys left behind by an interrupted append."""
+        if os.path.exists(self._vectors_path):
+            with open(self._vectors_path, "r+b") as f:
+                f.truncate(rows * self.dim * self.dtype.itemsize)
+        with open(self._keys_path, "w") as f:
+            f.writelines(json.dumps(key) + "\n" for key in self._keys)
+
+    def __len__(self) -> int:
+        return len(self._key_to_row)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._key_to_row
+
+    def keys(self) -> list[str]:
+        """Returns each distinct key once, in the order first appended."""
+        return list(self._key_to_row)
+
+    def append(self, keys: Sequence[str], vectors: Iterable[Sequence[float]]):
+        """Appends vectors for the given keys; both files are flushed and fsynced before returning."""
+        array = np.asarray(vectors, dtype=self.dtype).reshape(-1, self.dim)
+        if len(keys) != len(array):
+            raise ValueError(f"Got {len(keys)} keys for {len(array)} vectors")
+        with self._lock:
+            # Vectors first: a key is only trusted once its row is fully on disk
+            with open(self._vectors_path, "ab") as f:
+                f.write(array.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._keys_path, "a") as f:
+                f.writelines(json.dumps(key) + "\n" for key in keys)
+                f.flush()
+                os.fsync(f.fileno())
+            for key in keys:
+                self._key_to_row[key] = self._rows
+                self._keys.append(key)
+                self._rows += 1
+
+    def load(self) -> tuple[list[str], np.ndarray]:
+        """Returns (keys, vectors) with the latest vector per key; vectors are memory-mapped when no key was overwritten."""
+        with self._lock:
+            if self._rows == 0:
+                return [], np.empty((0, self.dim), dtype=self.dtype)
+            matrix = np.memmap(self._vectors_path, dtype=self.dtype, mode="r", shape=(self._rows, self.dim))
+            keys = list(self._key_to_row)
+            rows = np.fromiter(self._key_to_row.values(), dtype=np.int64, count=len(keys))
+        if len(rows) == self._rows:
+            return keys, matrix
+        return keys, np.asarray(matrix[rows])
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        row = self._key_to_row.get(key)
+        if row is None:
+            return None
+        return np.array(np.memmap(self._vectors_path, dtype=self.dtype, mode="r", shape=(self._rows, self.dim))[row])
+
+    def to_arrow(self, key_column: str = "key", vector_column: str = "embedding") -> pa.Table:
+        """Returns the latest vector per key as an Arrow table with a fixed-size list column."""
+        keys, vectors = self.load()
+        flat = pa.array(np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1))
+        return pa.table({
+            key_column: pa.array(keys, type=pa.string()),
+            vector_column: pa.FixedSizeListArray.from_arrays(flat, self.dim),
+        })
+
+    def to_parquet(self, parquet_path: str, **kwargs):
+        """Writes the latest vector per key to a Parquet file."""
+        pq.write_table(self.to_arrow(**kwargs), parquet_path)
+
+    def load_to_bigquery(self, client, table_id: str, key_column: str = "key", vector_column: str = "embedding", write_disposition: str = "WRITE_TRUNCATE"):
+        """Bulk loads every embedding into a BigQuery table with one Parquet load job."""
+        buffer = io.BytesIO()
+        pq.write_table(self.to_arrow(key_column=key_column, vector_column=vector_column), buffer)
+        buffer.seek(0)
+
+        parquet_options = bigquery.ParquetOptions()
+        parquet_options.enable_list_inference = True
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            parquet_options=parquet_options,
+            write_disposition=write_disposition,
+        )
+        load_job = client.load_table_from_file(buffer, table_id, job_config=job_config)
+        load_job.result()
+        return load_job
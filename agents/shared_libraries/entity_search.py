@@ -0,0 +1,72 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+from config.settings import Settings
+from agents.shared_libraries.bq_utils import get_entity_embeddings
+from agents.shared_libraries.vector_index import VectorIndex
+
+# How often the index checks BigQuery for newly loaded entities
+ENTITY_INDEX_REFRESH_SECONDS = 300
+SYNC_FILE = "entity_sync.json"
+
+_lock = threading.Lock()
+_index: Optional[VectorIndex] = None
+_last_refresh = 0.0
+
+
+def _read_last_loaded(index_dir: str) -> Optional[datetime]:
+    try:
+        with open(os.path.join(index_dir, SYNC_FILE)) as f:
+            return datetime.fromisoformat(json.load(f)["last_loaded"])
+    except (FileNotFoundError, KeyError, ValueError, json.JSONDecodeError):
+        return None
+
+
+def _write_last_loaded(index_dir: str, last_loaded: datetime):
+    with open(os.path.join(index_dir, SYNC_FILE), "w") as f:
+        json.dump({"last_loaded": last_loaded.isoformat()}, f)
+
+
+def get_entity_index() -> Optional[VectorIndex]:
+    """Returns the persisted entity ANN index, adding any entities loaded into BigQuery since the last sync."""
+    global _index, _last_refresh
+    config = Settings.get_settings()
+    index_dir = config.ENTITY_INDEX_DIR
+
+    with _lock:
+        if _index is not None and time.monotonic() - _last_refresh < ENTITY_INDEX_REFRESH_SECONDS:
+            return _index
+
+        if _index is None and os.path.exists(os.path.join(index_dir, "index.json")):
+            _index = VectorIndex.load(index_dir)
+        last_loaded = _read_last_loaded(index_dir) if _index is not None else None
+
+        rows = get_entity_embeddings(since=last_loaded)
+        if rows:
+            if _index is None:
+                _index = VectorIndex(len(rows[0]["embedding"]), min_train_size=2000)
+            _index.add(
+                [row["complex_type_name"] for row in rows],
+                [row["embedding"] for row in rows],
+            )
+            _index.save(index_dir)
+            _write_last_loaded(index_dir, max(row["load_timestamp"] for row in rows))
+            print(f"Entity index updated with {len(rows)} entities ({len(_index)} total).")
+
+        _last_refresh = time.monotonic()
+        return _index
+
+
+def find_similar_entities(entity_name: str, k: int = 10) -> list[dict]:
+    """Returns the k entities whose XML embeddings are most similar to the named entity."""
+    index = get_entity_index()
+    if index is None or entity_name not in index:
+        raise KeyError(entity_name)
+    return [
+        {"complex_type_name": name, "similarity": score}
+        for name, score in index.search_by_key(entity_name, k=k)
+    ]
@@ -0,0 +1,172 @@
+import re
+from collections import defaultdict
+from typing import Callable, Iterable, List, Optional
+
+from pydantic import BaseModel, Field
+
+from agents.shared_libraries.dtm_xml import DtmAttribute, DtmEntity
+
+# Mechanically checkable parts of prompt_master.DTM_STANDARDIZATION_GUIDELINES.
+# The subjective parts (concept alignment, synonyms, clarity of wording) are
+# left to the model; everything here is deterministic for a given XML.
+
+NAME_PATTERN = re.compile(r"^[A-Za-z][A-Za-z0-9_]*$")
+MAX_NAME_LENGTH = 128
+MIN_DESCRIPTION_WORDS = 3
+LENGTH_TYPES = {"string", "normalizedstring", "token", "varchar", "nvarchar", "char", "nchar"}
+PII_NAME_PATTERN = re.compile(
+    r"(first_?name|last_?name|sur_?name|full_?name|forename|e_?mail|phone|mobile|birth|dob|address|post_?code|"
+    r"zip_?code|national_?insurance|nino|ssn|passport|driving_?licen[cs]e|tax_?id|iban|account_?number|sort_?code|gender)",
+    re.IGNORECASE,
+)
+PII_MARKER_PATTERN = re.compile(r"\b(pii|spii|personal|sensitive)\b", re.IGNORECASE)
+
+
+class RuleFinding(BaseModel):
+    """A deterministic finding from a GDM standardization rule."""
+    rule: str = Field(description="Identifier of the rule that produced the finding.")
+    entity_name: str = Field(description="Entity the finding applies to.")
+    attribute_name: Optional[str] = Field(None, description="Attribute the finding applies to, if any.")
+    message: str = Field(description="What is wrong and how to fix it.")
+
+
+AttributeIndex = dict[str, list[tuple[str, DtmAttribute]]]
+Rule = Callable[[List[DtmEntity], AttributeIndex], Iterable[RuleFinding]]
+RULES: list[Rule] = []
+
+
+def rule(func: Rule) -> Rule:
+    RULES.append(func)
+    return func
+
+
+def normalize_attribute_name(name: str) -> str:
+    """CustomerId, customer_id and CUSTOMER_ID all map to the same index key."""
+    return name.replace("_", "").lower()
+
+
+def build_attribute_index(entities: List[DtmEntity]) -> AttributeIndex:
+    """Hash index of normalized attribute name -> every (entity name, attribute) that declares it."""
+    index: AttributeIndex = defaultdict(list)
+    for entity in entities:
+        for attribute in entity.attributes:
+            index[normalize_attribute_name(attribute.name)].append((entity.name, attribute))
+    return index
+
+
+def _description_problem(name: str, description: Optional[str]) -> Optional[str]:
+    if not description:
+        return "has no description"
+    if normalize_attribute_name(description.strip(" .")) == normalize_attribute_name(name):
+        return "has a description that only repeats its name"
+    if len(description.split()) < MIN_DESCRIPTION_WORDS:
+        return f"has a description shorter than {MIN_DESCRIPTION_WORDS} words"
+    return None
+
+
+def _name_problem(name: str) -> Optional[str]:
+    if not NAME_PATTERN.match(name):
+        return "must start with a letter and contain only letters, digits and underscores"
+    if len(name) > MAX_NAME_LENGTH:
+        return f"is longer than {MAX_NAME_LENGTH} characters"
+    return None
+
+
+@rule
+def check_naming(entities, index):
+    for entity in entities:
+        problem = _name_problem(entity.name)
+        if problem:
+            yield RuleFinding(rule="entity_naming", entity_name=entity.name, message=f"Entity name {problem}.")
+        for attribute in entity.attributes:
+            problem = _name_problem(attribute.name)
+            if problem:
+                yield RuleFinding(rule="attribute_naming", entity_name=entity.name, attribute_name=attribute.name, message=f"Attribute name {problem}.")
+
+
+@rule
+def check_descriptions(entities, index):
+    for entity in entities:
+        problem = _description_problem(entity.name, entity.description)
+        if problem:
+            yield RuleFinding(rule="entity_description", entity_name=entity.name, message=f"Entity {problem}.")
+        for attribute in entity.attributes:
+            problem = _description_problem(attribute.name, attribute.description)
+            if problem:
+                yield RuleFinding(rule="attribute_description", entity_name=entity.name, attribute_name=attribute.name, message=f"Attribute {problem}.")
+
+
+@rule
+def check_primary_keys(entities, index):
+    for entity in entities:
+        # keys is None when the XSD has no <element> declaring the entity: unknown, not missing
+        if entity.keys == []:
+            yield RuleFinding(rule="primary_key", entity_name=entity.name, message="Entity declares no primary key.")
+
+
+@rule
+def check_data_types(entities, index):
+    for entity in entities:
+        for attribute in entity.attributes:
+            if not attribute.data_type:
+                yield RuleFinding(rule="data_type", entity_name=entity.name, attribute_name=attribute.name, message="Attribute has no data type.")
+            elif attribute.data_type.lower() in LENGTH_TYPES:
+                yield RuleFinding(rule="field_length", entity_name=entity.name, attribute_name=attribute.name, message=f"Attribute of type {attribute.data_type} has no field length.")
+
+
+@rule
+def check_attribute_uniqueness(entities, index):
+    for entity in entities:
+        seen = set()
+        for attribute in entity.attributes:
+            key = normalize_attribute_name(attribute.name)
+            if key in seen:
+                yield RuleFinding(rule="attribute_uniqueness", entity_name=entity.name, attribute_name=attribute.name, message="Attribute name is declared more than once in this entity.")
+            seen.add(key)
+
+
+@rule
+def check_cross_entity_consistency(entities, index):
+    """An attribute that exists in several entities must have the same definition everywhere."""
+    for declarations in index.values():
+        owners = {entity_name for entity_name, _ in declarations}
+        if len(owners) < 2:
+            continue
+        types = {(attribute.data_type or "").lower() for _, attribute in declarations}
+        descriptions = {" ".join((attribute.description or "").lower().split()) for _, attribute in declarations}
+        mismatches = []
+        if len(types) > 1:
+            mismatches.append("data types (" + ", ".join(sorted(t or "untyped" for t in types)) + ")")
+        if len(descriptions) > 1:
+            mismatches.append("descriptions")
+        if not mismatches:
+            continue
+        for entity_name, attribute in declarations:
+            others = sorted(owners - {entity_name})
+            yield RuleFinding(
+                rule="attribute_consistency",
+                entity_name=entity_name,
+                attribute_name=attribute.name,
+                message=f"Attribute is also defined in {', '.join(others)} with different {' and '.join(mismatches)}.",
+            )
+
+
+@rule
+def check_personal_information(entities, index):
+    for entity in entities:
+        for attribute in entity.attributes:
+            if PII_NAME_PATTERN.search(attribute.name) and not PII_MARKER_PATTERN.search(attribute.description or ""):
+                yield RuleFinding(
+                    rule="personal_information",
+                    entity_name=entity.name,
+                    attribute_name=attribute.name,
+                    message="Attribute looks like personal information but is not marked as PII/sensitive; enable the personal information control.",
+                )
+
+
+def evaluate_rules(entities: List[DtmEntity]) -> list[RuleFinding]:
+    """Runs every registered rule; findings are ordered by entity (document order), then by rule."""
+    index = build_attribute_index(entities)
+    findings = [finding for check in RULES for finding in check(entities, index)]
+    entity_order = {entity.name: position for position, entity in enumerate(entities)}
+    return sorted(findings, key=lambda finding: entity_order.get(finding.entity_name, len(entity_order)))
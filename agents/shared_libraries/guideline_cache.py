@@ -0,0 +1,85 @@
+import hashlib
+import logging
+import threading
+import time
+from typing import NamedTuple
+
+from agents.shared_libraries.bq_utils import get_active_guidelines, get_guidelines_fingerprint
+
+# How long to wait before retrying BigQuery after a failed load
+GUIDELINE_RETRY_SECONDS = 60
+# How often to check BigQuery for guideline changes made through another worker or instance
+GUIDELINE_CHECK_SECONDS = 60
+
+
+class CompiledGuidelines(NamedTuple):
+    """The active user-defined guidelines rendered for prompts, versioned by a hash of that text."""
+    text: str
+    version: str
+
+
+def compile_guidelines(rows: list[dict]) -> CompiledGuidelines:
+    """Renders guideline rows as a bullet list; the same rows always give the same text and version."""
+    items = []
+    for row in rows:
+        text = (row.get("guideline_text") or "").strip()
+        if text:
+            items.append("- " + text.replace("\n", "\n  "))
+    text = "\n".join(items)
+    return CompiledGuidelines(text, hashlib.sha256(text.encode("utf-8")).hexdigest()[:16])
+
+
+_lock = threading.Lock()
+_generation = 0  # Bumped whenever the frontend adds, updates or deletes a guideline
+_loaded_generation = -1
+_retry_after = 0.0
+_check_after = 0.0
+_fingerprint = None
+_compiled = compile_guidelines([])
+
+
+def bump_guideline_version() -> int:
+    """Marks the cached guidelines stale; they are reloaded on the next review. Returns the new generation."""
+    global _generation
+    with _lock:
+        _generation += 1
+        return _generation
+
+
+def get_compiled_guidelines() -> CompiledGuidelines:
+    """Returns the active guidelines, reloading them after a version bump, a failed load, or a change seen in BigQuery.
+
+    A bump only reaches the process that received it, so every
+    GUIDELINE_CHECK_SECONDS the table's row count and latest update time are
+    compared with those of the loaded set; the full set is queried only when
+    they differ.
+    """
+    global _loaded_generation, _retry_after, _check_after, _fingerprint, _compiled
+    with _lock:
+        now = time.monotonic()
+        if now < _retry_after:
+            return _compiled
+        if _loaded_generation == _generation:
+            if now < _check_after:
+                return _compiled
+            _check_after = now + GUIDELINE_CHECK_SECONDS
+            fingerprint = get_guidelines_fingerprint()
+            if fingerprint is None or fingerprint == _fingerprint:
+                return _compiled
+        else:
+            fingerprint = get_guidelines_fingerprint()
+
+        generation = _generation
+        rows = get_active_guidelines()
+        if rows is None:
+            # Keep serving the last good set rather than reviewing without guidelines
+            logging.warning("Could not load guidelines; keeping version %s", _compiled.version)
+            _retry_after = time.monotonic() + GUIDELINE_RETRY_SECONDS
+            return _compiled
+
+        _compiled = compile_guidelines(rows)
+        _loaded_generation = generation
+        _fingerprint = fingerprint
+        _check_after = time.monotonic() + GUIDELINE_CHECK_SECONDS
+        logging.info("Loaded %d guidelines (version %s)", len(rows), _compiled.version)
+        return _compiled
@@ -0,0 +1,135 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Optional, Sequence, Union
+
+import vertexai
+from vertexai.generative_models import GenerativeModel
+from vertexai.language_models import TextEmbeddingModel
+from vertexai.preview import caching
+from vertexai.preview.generative_models import GenerativeModel as PreviewGenerativeModel
+
+# GenerativeModel instances share the SDK's cached prediction clients (and their
+# HTTP/gRPC channels), so one instance per configuration can be reused by every
+# request and every worker thread in the process.
+_lock = threading.Lock()
+_initialized: set[tuple[Optional[str], Optional[str]]] = set()
+_models: dict[tuple, GenerativeModel] = {}
+_embedding_models: dict[tuple, TextEmbeddingModel] = {}
+
+# Vertex AI rejects context caches below a minimum size; smaller instructions
+# rely on the service's implicit prefix caching instead.
+CONTEXT_CACHE_MIN_TOKENS = 2048
+CONTEXT_CACHE_TTL = timedelta(hours=1)
+_context_cache_lock = threading.Lock()
+_context_cached_models: dict[tuple, tuple[GenerativeModel, float]] = {}
+_context_cache_unavailable: set[tuple] = set()
+
+
+def init_vertexai(project: Optional[str] = None, location: Optional[str] = None):
+    """Calls vertexai.init once per (project, location) for the lifetime of the process."""
+    key = (project, location)
+    if key in _initialized:
+        return
+    with _lock:
+        if key not in _initialized:
+            vertexai.init(project=project, location=location)
+            _initialized.add(key)
+
+
+def get_generative_model(
+    model_name: str,
+    system_instruction: Union[str, Sequence[str], None] = None,
+    project: Optional[str] = None,
+    location: Optional[str] = None,
+) -> GenerativeModel:
+    """Returns the shared GenerativeModel for this configuration, creating it on first use."""
+    if isinstance(system_instruction, str):
+        system_instruction = [system_instruction]
+    instruction_key = tuple(system_instruction) if system_instruction else None
+    key = (model_name, instruction_key, project, location)
+
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    if project or location:
+        init_vertexai(project, location)
+    with _lock:
+        model = _models.get(key)
+        if model is None:
+            model = GenerativeModel(
+                model_name,
+                system_instruction=list(instruction_key) if instruction_key else None,
+            )
+            _models[key] = model
+    return model
+
+
+def get_text_embedding_model(
+    model_name: str,
+    project: Optional[str] = None,
+    location: Optional[str] = None,
+) -> TextEmbeddingModel:
+    """Returns the shared TextEmbeddingModel for this configuration, loading it on first use."""
+    key = (model_name, project, location)
+
+    model = _embedding_models.get(key)
+    if model is not None:
+        return model
+
+    if project or location:
+        init_vertexai(project, location)
+    with _lock:
+        model = _embedding_models.get(key)
+        if model is None:
+            model = TextEmbeddingModel.from_pretrained(model_name)
+            _embedding_models[key] = model
+    return model
+
+
+def get_context_cached_model(
+    model_name: str,
+    system_instruction: Union[str, Sequence[str]],
+    project: Optional[str] = None,
+    location: Optional[str] = None,
+    ttl: timedelta = CONTEXT_CACHE_TTL,
+) -> GenerativeModel:
+    """Returns a model whose system instruction is served from a Vertex AI context cache.
+
+    The cache is created once per (model, instruction) and recreated shortly
+    before its TTL runs out. Falls back to the plain shared model when the
+    instruction is too small to cache or the cache cannot be created.
+    """
+    if isinstance(system_instruction, str):
+        system_instruction = [system_instruction]
+    key = (model_name, tuple(system_instruction), project, location)
+
+    entry = _context_cached_models.get(key)
+    if entry is not None and entry[1] > time.monotonic():
+        return entry[0]
+    # Rough estimate of ~4 characters per token
+    if key in _context_cache_unavailable or sum(map(len, system_instruction)) // 4 < CONTEXT_CACHE_MIN_TOKENS:
+        return get_generative_model(model_name, system_instruction, project, location)
+
+    if project or location:
+        init_vertexai(project, location)
+    with _context_cache_lock:
+        entry = _context_cached_models.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        try:
+            cached_content = caching.CachedContent.create(
+                model_name=model_name,
+                system_instruction=list(system_instruction),
+                ttl=ttl,
+            )
+            model = PreviewGenerativeModel.from_cached_content(cached_content=cached_content)
+        except Exception as e:
+            logging.warning("Context caching unavailable for %s, sending the full instruction: %s", model_name, e)
+            _context_cache_unavailable.add(key)
+            return get_generative_model(model_name, system_instruction, project, location)
+        # Refresh a few minutes early so a request never races the server-side expiry
+        _context_cached_models[key] = (model, time.monotonic() + ttl.total_seconds() - 300)
+        return model
@@ -15,30 +15,53 @@ DTM_STANDARDIZATION_GUIDELINES = """
 - **Personal Information:** Enable control for personal or sensitive personal information.
 """
 
+# The parts of the guidelines that need judgement. Name format, missing or very
+# short descriptions, missing primary keys, data types and field lengths,
+# duplicate attribute names, cross-entity definition mismatches and unmarked
+# personal information are checked by gdm_rules and merged in afterwards.
+DTM_SUBJECTIVE_STANDARDIZATION_GUIDELINES = """
+**GDM Standardization Guidelines (judgement required)**
+
+**1. Data Entities Defined Correctly**
+- **Alignment:** Entities must be aligned to Concepts in the Data Concept Model.
+- **Naming:** Names should be meaningful business names according to GDM Standards. Synonyms must be resolved to minimize the risk of duplication.
+- **Descriptions:** Descriptions must be complete and unambiguous. Use sub-concepts, specializations, and data collections wisely to limit the proliferation of data products and ensure they remain discoverable.
+- **Primary Keys:** Where a primary key is declared, it must be appropriate as per guidance in the Concept Model.
+
+**2. Data Attributes Defined and Mapped Correctly**
+- **Clarity:** Data attributes that are similar but different need to have much clearer descriptions to differentiate them.
+- **Descriptions:** Descriptions must be complete and unambiguous in meaning.
+- **Data Types:** Declared data types must suit the meaning of the attribute.
+
+Do not report on name format, missing or very short descriptions, missing primary keys, missing data types or field lengths, duplicate attribute names, definition mismatches between entities, or personal information flags: these are checked automatically and added to the report separately.
+"""
+
+# Prompt layout: fixed instructions and guidelines first, per-review content
+# (outline, XML) last, so consecutive reviews share the longest possible
+# prompt prefix and can hit the model's context cache.
+# {custom_guidelines} is the compiled set from the Define Guidelines page; it only
+# changes when a guideline is edited (see guideline_cache).
+
 DTM_STANDARDIZATION_PROMPT = f"""
 You are an expert Data Model Governance Analyst. Your task is to analyze the provided DTM XML model and assess its compliance with the GDM Standardization Guidelines.
 
 You must review each entity and its attributes against the rules provided below. For each entity, provide a compliance summary and then a detailed breakdown for each of its attributes.
-
-**XML Content to Analyze:**
-{{{{xml_content}}}}
+Based on your analysis, generate a complete standardization report. The report should have an overall summary and then a detailed compliance report for each entity and its attributes.
 
 **Guidelines to enforce:**
-{DTM_STANDARDIZATION_GUIDELINES}
+{DTM_SUBJECTIVE_STANDARDIZATION_GUIDELINES}
 
-Based on your analysis, generate a complete standardization report. The report should have an overall summary and then a detailed compliance report for each entity and its attributes.
-"""
+**Additional guidelines defined by the data governance team:**
+{{{{custom_guidelines}}}}
 
-# Prompts for DtmReviewAgent (from dtm_review_agent.py)
-DTM_INITIAL_ANALYSIS_PROMPT = """
-You are an XML parsing agent. Your task is to perform a preliminary scan of the provided DTM XML content.
-Identify all the main data entities defined within the model.
-Return the original XML content along with the list of entity names you have identified.
+**Entities in the Model (parsed from the XML, with attributes, types and keys):**
+{{{{model_outline}}}}
 
 **XML Content to Analyze:**
 {{{{xml_content}}}}
 """
 
+# Prompts for DtmReviewAgent (from dtm_review_agent.py)
 DTM_DETAILED_REVIEW_PROMPT = """
 You are a senior data architect. You have been given a DTM XML model and a list of entities to review.
 Your task is to perform an in-depth review of EACH entity from the provided list.
@@ -49,11 +72,42 @@ For each entity, provide:
 
 After reviewing all entities, compile your findings into a single, comprehensive report. The report must include an overall summary and the detailed reviews for each entity.
 
+**Entities to Review (parsed from the XML, with attributes, types and keys):**
+{{{{model_outline}}}}
+
 **Full DTM XML Content:**
 {{{{xml_content}}}}
+"""
+
+# Prompts for the per-entity (map-reduce) review of large DTM models
+DTM_ENTITY_STANDARDIZATION_PROMPT = f"""
+You are an expert Data Model Governance Analyst. Your task is to assess ONE entity from a DTM XML model against the GDM Standardization Guidelines.
+
+Review the entity and each of its attributes against the rules provided below. Provide a compliance summary for the entity and a detailed breakdown for each of its attributes.
+
+**Guidelines to enforce:**
+{DTM_SUBJECTIVE_STANDARDIZATION_GUIDELINES}
+
+**Additional guidelines defined by the data governance team:**
+{{{{custom_guidelines}}}}
+
+**Entity to Analyze:** {{{{entity_name}}}}
+
+**Entity XML:**
+{{{{xml_content}}}}
+"""
 
-**Entities to Review:**
-{{{{identified_entities}}}}
+DTM_ENTITY_REVIEW_PROMPT = """
+You are a senior data architect. Your task is to perform an in-depth review of ONE entity from a DTM XML model.
+
+Provide:
+1.  A summary of your findings, including both positive aspects and areas for improvement.
+2.  A list of concrete, actionable suggestions for improving the entity definition, its attributes, and its relationships based on best practices.
+
+**Entity to Review:** {{{{entity_name}}}}
+
+**Entity XML Content:**
+{{{{xml_content}}}}
 """
 
 SCHEMA_INFER_PROMPT = """This is a placeholder for the schema infer prompt."""
\ No newline at end of file
@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from google.api_core import exceptions as api_exceptions
+
+T = TypeVar("T")
+
+_QUOTA_ERROR_MARKERS = ("429", "RESOURCE_EXHAUSTED", "Quota exceeded", "Too Many Requests")
+
+
+def is_quota_error(error: Exception) -> bool:
+    """Returns True if the error is a quota / rate-limit error (HTTP 429 / RESOURCE_EXHAUSTED)."""
+    if isinstance(error, (api_exceptions.ResourceExhausted, api_exceptions.TooManyRequests)):
+        return True
+    if getattr(error, "code", None) == 429:
+        return True
+    message = str(error)
+    return any(marker in message for marker in _QUOTA_ERROR_MARKERS)
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD concurrency limiter for calls to a shared, quota-limited backend.
+
+    The number of calls allowed in flight grows by roughly one for every `limit`
+    successful calls (additive increase) and is multiplied by `decrease_factor`
+    when the backend reports a quota error (multiplicative decrease). Throttled
+    calls are retried with jittered exponential backoff.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 32,
+        decrease_factor: float = 0.5,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        # Futures of coroutines waiting for a slot, resolved from release() on their own loop
+        self._async_waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._metrics = {"calls": 0, "successes": 0, "throttled": 0, "retries": 0, "failures": 0, "cancelled": 0}
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    async def acquire_async(self):
+        """Waits for a slot on the event loop, without parking an executor thread.
+
+        Cancellation while waiting leaves no slot taken: the slot is only ever
+        claimed synchronously, after the wait.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self._in_flight < int(self._limit):
+                    self._in_flight += 1
+                    return
+                waiter = (loop, loop.create_future())
+                self._async_waiters.append(waiter)
+            try:
+                await waiter[1]
+            finally:
+                with self._condition:
+                    if waiter in self._async_waiters:
+                        self._async_waiters.remove(waiter)
+
+    def _wake_async_waiters(self):
+        # Caller holds self._condition. Every waiter re-checks the limit when it wakes up.
+        for loop, future in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+            except RuntimeError:
+                pass  # The waiter's loop is closed; nothing is waiting on it any more
+        self._async_waiters.clear()
+
+    def release(self, outcome: str = "success"):
+        """Releases a slot and adjusts the limit. `outcome` is 'success', 'throttled' or 'error'."""
+        with self._condition:
+            self._in_flight -= 1
+            if outcome == "success":
+                self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+            elif outcome == "throttled":
+                # Calls already in flight when the quota was hit will fail too; only
+                # back off once per backoff window rather than once per failure.
+                now = time.monotonic()
+                if now - self._last_decrease >= self.base_delay:
+                    self._limit = max(self.min_limit, self._limit * self.decrease_factor)
+                    self._last_decrease = now
+                    logging.warning("%s: quota error, concurrency limit lowered to %d", self.name, self.limit)
+            self._condition.notify_all()
+            self._wake_async_waiters()
+
+    def _abandon(self):
+        """Releases the slot of an attempt interrupted by cancellation (or another BaseException)."""
+        self.release("error")
+        with self._condition:
+            self._metrics["cancelled"] += 1
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: a random delay up to the exponential cap spreads retries out
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _start_attempt(self):
+        with self._condition:
+            self._metrics["calls"] += 1
+
+    def _settle(self, error: Optional[Exception], attempt: int) -> bool:
+        """Releases the slot of a finished attempt; returns True if the attempt should be retried."""
+        if error is None:
+            self.release("success")
+            with self._condition:
+                self._metrics["successes"] += 1
+            return False
+        if not is_quota_error(error):
+            self.release("error")
+            with self._condition:
+                self._metrics["failures"] += 1
+            return False
+        self.release("throttled")
+        with self._condition:
+            self._metrics["throttled"] += 1
+            if attempt == self.max_retries:
+                self._metrics["failures"] += 1
+                return False
+            self._metrics["retries"] += 1
+        return True
+
+    def call(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Runs fn(*args, **kwargs) within the concurrency limit, retrying quota errors.
+
+        Blocks the calling thread while waiting for a slot or backing off; from
+        async code use `call_async`, or run this in a worker thread.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire()
+            self._start_attempt()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if not self._settle(e, attempt):
+                    raise
+                time.sleep(self._backoff(attempt))
+                continue
+            except BaseException:
+                self._abandon()
+                raise
+            self._settle(None, attempt)
+            return result
+
+    async def call_async(self, fn: Callable[..., Awaitable[T]], *args, **kwargs) -> T:
+        """Async counterpart of `call`: awaits fn(*args, **kwargs) without blocking the event loop.
+
+        A cancelled call (client disconnect, agent teardown) gives its slot back.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.acquire_async()
+            self._start_attempt()
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                if not self._settle(e, attempt):
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            except BaseException:
+                self._abandon()
+                raise
+            self._settle(None, attempt)
+            return result
+
+    def snapshot(self) -> dict:
+        """Returns the current limit, in-flight count and call counters."""
+        with self._condition:
+            return {
+                "name": self.name,
+                "limit": self.limit,
+                "in_flight": self._in_flight,
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                **self._metrics,
+            }
+
+
+_limiters: dict[str, AdaptiveConcurrencyLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(name: str, **kwargs) -> AdaptiveConcurrencyLimiter:
+    """Returns the process-wide limiter for a backend, creating it with `kwargs` on first use."""
+    with _limiters_lock:
+        limiter = _limiters.get(name)
+        if limiter is None:
+            limiter = AdaptiveConcurrencyLimiter(name, **kwargs)
+            _limiters[name] = limiter
+        return limiter
+
+
+def limiter_metrics(name: Optional[str] = None) -> list[dict]:
+    """Returns snapshots of all limiters, or of the named limiter only."""
+    with _limiters_lock:
+        limiters = [l for n, l in _limiters.items() if name is None or n == name]
+    return [limiter.snapshot() for limiter in limiters]
@@ -0,0 +1,114 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from agents.shared_libraries.dtm_xml import canonicalize_xml
+
+
+def review_cache_key(xml_content: str, guidelines_version: str, model: str) -> str:
+    """Cache key for a review: the canonical XML plus everything else that changes the result."""
+    canonical = canonicalize_xml(xml_content)
+    return hashlib.sha256(f"{model}\0{guidelines_version}\0{canonical}".encode("utf-8")).hexdigest()
+
+
+class ReviewCache:
+    """Two-level (in-memory LRU + SQLite on disk) cache of finished review results with TTL/LRU eviction.
+
+    The memory level answers repeat requests without touching disk; the disk
+    level survives restarts and is shared by every worker on the host. Both
+    drop entries older than `ttl_seconds`; the disk keeps the `max_entries`
+    most recently used results.
+    """
+
+    def __init__(self, path: str, max_entries: int = 1000, ttl_seconds: float = 7 * 24 * 3600, memory_entries: int = 128):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS review_cache (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS review_cache_accessed ON review_cache (accessed_at)")
+
+    def _remember(self, key: str, result: str, created_at: float):
+        self._memory[key] = (result, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached result, or None if absent or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] < self.ttl_seconds:
+                self._memory.move_to_end(key)
+                self._conn.execute("UPDATE review_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                return entry[0]
+            self._memory.pop(key, None)
+
+            row = self._conn.execute(
+                "SELECT result, created_at FROM review_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            result, created_at = row
+            if now - created_at >= self.ttl_seconds:
+                self._conn.execute("DELETE FROM review_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE review_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._remember(key, result, created_at)
+            return result
+
+    def set(self, key: str, result: str):
+        """Stores a result, then evicts expired and least recently used entries."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO review_cache (key, result, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, result, now, now),
+                )
+                self._conn.execute("DELETE FROM review_cache WHERE created_at <= ?", (now - self.ttl_seconds,))
+                self._conn.execute(
+                    """
+                    DELETE FROM review_cache WHERE key IN (
+                        SELECT key FROM review_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.max_entries,),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._remember(key, result, now)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute("DELETE FROM review_cache")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM review_cache").fetchone()[0]
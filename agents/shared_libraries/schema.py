@@ -14,7 +14,7 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 
 
@@ -86,4 +86,75 @@ class SQLAnalysisRequest(BaseModel):
     """
 
     sql_query: str
-    file_path: Optional[str] = None
\ No newline at end of file
+    file_path: Optional[str] = None
+
+
+# --- Structured output of extract_sql_details (see SQL_EXTRACTION_INSTRUCTIONS) ---
+
+class SqlFileSummary(BaseModel):
+    inferred_detail: str = Field(description="A high-level, natural language summary of the entire script's purpose.")
+    dependencies: List[str] = Field(description="Explicit dependencies, like job IDs, mentioned in comments.")
+
+class SqlTargetTable(BaseModel):
+    database_name: Optional[str] = Field(description="The database of the table being written to.")
+    schema_name: Optional[str] = Field(description="The schema of the table being written to.")
+    table_name: str = Field(description="The name of the table being written to.")
+    alias: Optional[str] = Field(description="The alias used for the target table.")
+    inferred_target_type: Optional[str] = Field(description="BASE_TABLE, WORK_TABLE or LOG_TABLE.")
+
+class SqlSource(BaseModel):
+    source_id: str = Field(description="A unique ID for this true source within the statement, e.g. 'src1'.")
+    database_name: Optional[str] = Field(description="The database of the true source table.")
+    schema_name: Optional[str] = Field(description="The schema of the true source table.")
+    table_name: str = Field(description="The name of the true source table or view, never a subquery.")
+    alias: Optional[str] = Field(description="The alias used for this source table.")
+    source_type: Optional[str] = Field(description="The type of source, e.g. 'BASE_TABLE'.")
+
+class SqlSourceReference(BaseModel):
+    source_id: str = Field(description="The source_id of the true source table.")
+    column_name: str = Field(description="The name of the true source column.")
+
+class SqlColumnLineage(BaseModel):
+    output_column_name: str = Field(description="The name of the column in the target table being populated.")
+    output_column_ordinal: Optional[int] = Field(description="1-based position for INSERT columns; null for UPDATE columns.")
+    transformation_logic: Optional[str] = Field(description="The full expression deriving the column, with all aliases resolved.")
+    inferred_logic_detail: Optional[str] = Field(description="The business logic by which the column is populated.")
+    source_references: List[SqlSourceReference] = Field(description="The true source columns; empty for constants.")
+
+class SqlJoinCondition(BaseModel):
+    left_source_id: Optional[str] = Field(description="The source_id for the left side of the condition.")
+    left_column: Optional[str] = Field(description="The column name from the left-side table.")
+    operator: Optional[str] = Field(description="The comparison operator, e.g. '='.")
+    right_source_id: Optional[str] = Field(description="The source_id for the right side of the condition.")
+    right_column: Optional[str] = Field(description="The column name from the right-side table.")
+
+class SqlJoin(BaseModel):
+    join_type: str = Field(description="The join type, e.g. 'JOIN', 'LEFT JOIN'.")
+    left_source_id: Optional[str] = Field(description="The source_id of the table on the left.")
+    right_source_id: Optional[str] = Field(description="The source_id of the table on the right.")
+    join_conditions: List[SqlJoinCondition] = Field(description="Every condition of the ON clause.")
+
+class SqlInvolvedColumn(BaseModel):
+    source_id: str = Field(description="The source_id the column belongs to, or 'target' for the target table.")
+    column_name: str = Field(description="The name of the column used in the filter.")
+
+class SqlFilter(BaseModel):
+    clause: str = Field(description="The clause where the filter is applied (WHERE only).")
+    filter_expression: str = Field(description="The full text of the filter condition.")
+    involved_columns: List[SqlInvolvedColumn] = Field(description="The columns used in the filter.")
+
+class SqlStatement(BaseModel):
+    s_id: str = Field(description="A unique, sequential ID for this statement, e.g. 's1'.")
+    inferred_detail: Optional[str] = Field(description="A natural language summary of the statement's purpose.")
+    statement_type: str = Field(description="The DML command, e.g. 'UPDATE', 'INSERT', 'DELETE'.")
+    target_table: SqlTargetTable
+    sources: List[SqlSource]
+    column_lineage: List[SqlColumnLineage]
+    joins: List[SqlJoin]
+    filters: List[SqlFilter]
+
+class SqlExtract(BaseModel):
+    """Structured DML lineage extracted from a SQL script."""
+
+    file_summary: SqlFileSummary
+    statements: List[SqlStatement]
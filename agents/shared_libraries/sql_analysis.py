@@ -1,6 +1,6 @@
 import base64, json, hashlib
 import vertexai
-from vertexai.generative_models import GenerativeModel, Part, SafetySetting
+from vertexai.generative_models import GenerationConfig, Part, SafetySetting
 import pandas as pd
 from google.cloud import storage
 import os
@@ -8,55 +8,23 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 from config.settings import Settings
 import uuid
 from agents.shared_libraries.bq_utils import insert_sql_extract_to_bq, delete_analysis_data
+from agents.shared_libraries.model_registry import get_context_cached_model
+from agents.shared_libraries.rate_limiter import get_limiter
+from agents.shared_libraries.schema import SqlExtract, SqlFileSummary, SqlStatement
+from agents.shared_libraries.structured_output import (
+    parse_model,
+    response_schema_for,
+    salvage_list_items,
+    strip_code_fences,
+    validate_items,
+)
 
-safety_settings = [
-    SafetySetting(
-        category=SafetySetting.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-        threshold=SafetySetting.HarmBlockThreshold.BLOCK_NONE
-    ),
-    SafetySetting(
-        category=SafetySetting.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-        threshold=SafetySetting.HarmBlockThreshold.BLOCK_NONE
-    ),
-    SafetySetting(
-        category=SafetySetting.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-        threshold=SafetySetting.HarmBlockThreshold.BLOCK_NONE
-    ),
-    SafetySetting(
-        category=SafetySetting.HarmCategory.HARM_CATEGORY_HARASSMENT,
-        threshold=SafetySetting.HarmBlockThreshold.BLOCK_NONE
-    ),
-]
-
-def extract_sql_details(sql_query, file_path=None):
-    if file_path:
-        file_name = os.path.basename(file_path)
-        hash_input = file_name
-    else:
-        hash_input = sql_query
-    sql_id = hashlib.sha256(hash_input.encode()).hexdigest()
-    
-    # Delete existing analysis data for this q_id
-    delete_analysis_data(sql_id)
+SQL_ANALYST_SYSTEM_INSTRUCTION = """You are a database analyst expert in writing and understanding SQL queries. 
+            You are also a business expert in the UK banking sector, with a deep understanding of retail and commercial banking products and services."""
 
-    try:
-        
-        if len(sql_query) < 10:
-            sql_query = 'No SQL'
-        
-        config = Settings.get_settings()
-        
-        model = GenerativeModel(
-            config.LLM_MODEL,
-            system_instruction=["""You are a database analyst expert in writing and understanding SQL queries. 
-            You are also a business expert in the UK banking sector, with a deep understanding of retail and commercial banking products and services."""],
-        )
-        
-        
-        ##Change the prompt accordinly to extract various details
-        
-        extraction_prompt = f"""
-You are an expert SQL parser. Your task is to analyze a multi-statement SQL script and extract a detailed, structured JSON representation of all its DML (Data Manipulation Language) operations. These SQLs are from a Banking & Financial Institution.
+# Static extraction instructions, kept byte-identical across calls so they can be
+# served from the model's context cache. The SQL itself is sent as the user content.
+SQL_EXTRACTION_INSTRUCTIONS = """You are an expert SQL parser. Your task is to analyze a multi-statement SQL script and extract a detailed, structured JSON representation of all its DML (Data Manipulation Language) operations. These SQLs are from a Banking & Financial Institution.
 
 Instructions:
 
@@ -91,26 +59,26 @@ Core Logic: Handling UNION / UNION ALL. When the DML's SELECT statement contains
 
   - Branching Lineage: The column_lineage is where the UNION logic becomes visible. For a single output_column_name, transformation logic should be fully resolves but use the inferred_logic_detail to provide full detail with whole understanding of the statement with UNION itself.
 
-If the SQL script is invalid or contains no DML, return an empty JSON object: {{}}
+If the SQL script is invalid or contains no DML, return a file_summary and an empty statements list.
 
 **ALways be consistent with the JSON key name mentioned in the below format** 
 
 Output JSON:
 
 JSON
-{{
-  "file_summary": {{
+{
+  "file_summary": {
     "inferred_detail": "A high-level, natural language summary of the entire script's purpose.",
     "dependencies": [
       "A list of any explicit dependencies, like job IDs, mentioned in comments (e.g., 'C01J01')."
     ]
-  }},
+  },
   "statements": [
-    {{
+    {
       "s_id": "A unique, sequential ID for this statement (e.g., 's1', 's2', 's3').",
       "inferred_detail": "A natural language summary or inferred purpose of the statement.",
       "statement_type": "The DML command (e.g., 'UPDATE', 'INSERT', 'DELETE').",
-      "target_table": {{
+      "target_table": {
         "database_name": "The database of the table being written to.",
         "schema_name": "The schema of the table being written to (or null).",
         "table_name": "The name of the table being written to.",
@@ -118,20 +86,20 @@ JSON
         "inferred_target_type": "The inferred role of this table ['BASE_TABLE', 'WORK_TABLE', 'LOG_TABLE'] (Details of what they mean is displayed here: 'BASE_TABLE ( The primary table(s) the script is designed to populate. This is the final destination of the main data flow)', 
                   'WORK_TABLE(Temporary/interim tables, often prefixed with WK_ or TEMP_. They are used for staging, are written to, then read from, and often deleted at the end )', 
                   'LOG_TABLE (Tables used for logging and status, often named ..._LOG or ..._STATUS and typically targeted by UPDATE statements to track progress.)')
-      }},
+      },
       "sources": [
-        {{
+        {
           "source_id": "A unique ID for this *true* source *within this statement* (e.g., 'src1', 'src2').",
           "database_name": "The database of the *true* source table.",
           "schema_name": "The schema of the *true* source table (or null).",
           "table_name": "The name of the *true* source table. **This MUST be an actual table/view, NEVER a subquery string.**",
           "alias": "The alias used for this source table (e.g., 'A', 'CCA', 'B').",
           "source_type": "The type of source (e.g., 'BASE_TABLE'). **Do NOT use 'SUBQUERY' or 'CTE' here; they must be flattened as described above**"
-        }}
+        }
       ],
       // This should repeat for the same column when its for UNION
      "column_lineage": [
-        {{
+        {
           "output_column_name": "The name of the column in the target table being populated. Do not assume any different column name you need to use the same name what is present for the INSERT.**This field is MANDATORY and MUST NOT be null for INSERTs or UPDATEs.**. ",
           "output_column_ordinal": "The 1-based integer position (1, 2, 3...) for 'INSERT' columns. Should be null for 'UPDATE' columns.",
           "transformation_logic": "The full expression or logic used to derive the column with all aliases resolved. Always resolve the aliases in the logic with corresponding source database and table name e.g.table_database.table_name,
@@ -139,75 +107,183 @@ JSON
           "source_references": [
             // This array should be empty if the transformation_logic is a constant (e.g., '0' or 'I').
             // It MUST point to the 'source_id' of a 'true' source from the 'sources' array above.
-            {{
+            {
               "source_id": ""The 'source_id' (from the 'sources' list) that maps to the *true* source table.",
               "column_name": "The name of the *true* source column from that table."
-            }}
+            }
           ]
-        }}
+        }
       ],
       // This array MUST also include joins "promoted" from any flattened subqueries.
       "joins": [
-        {{
+        {
           "join_type": "The join type (e.g., 'JOIN', 'LEFT JOIN').",
           "left_source_id": "The 'source_id' of the table on the left.",
           "right_source_id": "The 'source_id' of the table on the right.",
           "join_conditions": [
           // Below contiion should cover all the multiple conditions e.g. ON A.COLUMN = B.COLUMN AND C.COLUMN = D.COLUMN
-            {{
+            {
               "left_source_id": "The 'source_id' for the left side of the condition.",
               "left_column": "The column name from the left-side table.",
               "operator": "The comparison operator (e.g., '=', '<=').",
               "right_source_id": "The 'source_id' for the right side of the condition.",
               "right_column": "The column name from the right-side table."
               // repeat this for each condtion between sane table.
-            }}
+            }
           ]
-        }}
+        }
       ],
       "filters": [
-        {{
+        {
           "clause": "The clause where the filter is applied (WHERE condition filter only) **Note that 'ON' clause is not for filters and ON clause would go on into the join coditions above**",
           "filter_expression": "The full text of the filter condition.",
           "involved_columns": [
-            {{
+            {
               "source_id": "The 'source_id' this column belongs to. **Use the special value 'target'** to refer to columns from the 'target_table' (e.g., in an UPDATE's WHERE clause).",
               "column_name": "The name of the column used in the filter."
-            }}
+            }
           ]
-        }}
+        }
       ]
-    }}
+    }
   ]
-}}
-
-       SQL:
-            {sql_query.replace("{","{{").replace("}","}}")}
+}
 """
+
+safety_settings = [
+    SafetySetting(
+        category=SafetySetting.HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+        threshold=SafetySetting.HarmBlockThreshold.BLOCK_NONE
+    ),
+    SafetySetting(
+        category=SafetySetting.HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+        threshold=SafetySetting.HarmBlockThreshold.BLOCK_NONE
+    ),
+    SafetySetting(
+        category=SafetySetting.HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
+        threshold=SafetySetting.HarmBlockThreshold.BLOCK_NONE
+    ),
+    SafetySetting(
+        category=SafetySetting.HarmCategory.HARM_CATEGORY_HARASSMENT,
+        threshold=SafetySetting.HarmBlockThreshold.BLOCK_NONE
+    ),
+]
+
+def _generate_structured(model, contents, schema_cls):
+    """One schema-constrained generate_content call; returns the raw response text."""
+    # Only the output format is constrained; sampling and token limits stay at the model defaults
+    generation_config = GenerationConfig(
+        response_mime_type="application/json",
+        response_schema=response_schema_for(schema_cls),
+    )
+    response = get_limiter("gemini").call(
+        model.generate_content,
+        contents,
+        generation_config=generation_config,
+        stream=False,
+    )
+    return response.text
+
+
+def _regenerate(model, sql_query, request, schema_cls):
+    """Asks for one fragment of the extract again; returns it as a dict, or None if it is still invalid."""
+    contents = [f"SQL:\n{sql_query}", request]
+    fragment = parse_model(_generate_structured(model, contents, schema_cls), schema_cls)
+    return fragment.model_dump() if fragment else None
+
+
+def parse_sql_extract(model, sql_query, response_text):
+    """Validates the extraction locally; only fragments that fail validation are regenerated.
+
+    Returns (parser_output, processing_status).
+    """
+    extract = parse_model(response_text, SqlExtract)
+    if extract is not None:
+        return extract.model_dump(), "NEW"
+
+    print("Extraction failed validation, repairing the failing fragments")
+    head, items, closed = salvage_list_items(strip_code_fences(response_text), "statements")
+
+    statements = []
+    for index, item in enumerate(items):
+        valid, _ = validate_items([item], SqlStatement)
+        if valid:
+            statements.extend(valid)
+            continue
+        s_id = item.get("s_id") if isinstance(item, dict) and item.get("s_id") else f"s{index + 1}"
+        regenerated = _regenerate(
+            model, sql_query,
+            f"Return ONLY the DML statement with s_id '{s_id}' (DML statement number {index + 1} in the script), following the same rules.",
+            SqlStatement,
+        )
+        if regenerated:
+            statements.append(regenerated)
+
+    if not closed:
+        # The response was cut off: extract only what comes after the last complete statement
+        after = f"after the statement with s_id '{statements[-1]['s_id']}'" if statements else "in the script"
+        remaining = _regenerate(
+            model, sql_query,
+            f"Return a file_summary and ONLY the DML statements {after}, continuing the s_id numbering, following the same rules.",
+            SqlExtract,
+        )
+        if remaining:
+            statements.extend(remaining["statements"])
+            head.setdefault("file_summary", remaining["file_summary"])
+
+    file_summary, _ = validate_items([head.get("file_summary")], SqlFileSummary)
+    if not file_summary:
+        file_summary = [_regenerate(model, sql_query, "Return ONLY the file_summary of the script.", SqlFileSummary)]
+
+    if not statements and not file_summary[0]:
+        return {"error": "Invalid JSON response from model", "response_text": response_text}, "ERROR"
+    return {
+        "file_summary": file_summary[0] or {"inferred_detail": None, "dependencies": []},
+        "statements": statements,
+    }, "NEW"
+
+
+def extract_sql_details(sql_query, file_path=None):
+    if file_path:
+        file_name = os.path.basename(file_path)
+        hash_input = file_name
+    else:
+        hash_input = sql_query
+    sql_id = hashlib.sha256(hash_input.encode()).hexdigest()
+    
+    # Delete existing analysis data for this q_id
+    delete_analysis_data(sql_id)
+
+    try:
         
-        generation_config = {
-            "max_output_tokens": 65536,
-            "temperature": 1,
-            "top_p": 0.9,
-        }
-        print("Starting Extraction")
-        responses = model.generate_content(
-            [extraction_prompt],
-            stream=False,
+        if len(sql_query) < 10:
+            sql_query = 'No SQL'
+        
+        config = Settings.get_settings()
+        
+        model = get_context_cached_model(
+            config.LLM_MODEL,
+            system_instruction=[SQL_ANALYST_SYSTEM_INSTRUCTION, SQL_EXTRACTION_INSTRUCTIONS],
+            project=config.PROJECT_ID,
+            location=config.REGION,
         )
         
-        response_text = responses.text.replace("```","" ).replace("json","")
+        
+        ##Change SQL_EXTRACTION_INSTRUCTIONS accordingly to extract various details
+        # Only the SQL varies per call; the instructions are sent as a (context-cached) system instruction
+        extraction_contents = [f"SQL:\n{sql_query}"]
+        
+        print("Starting Extraction")
+        # Decoding is constrained to the SqlExtract schema, so the keys and
+        # nesting are right by construction
+        response_text = _generate_structured(model, extraction_contents, SqlExtract)
         print("Completed Extraction")
-        try:
-            # Validate JSON
-            print(response_text)
-            parser_output = json.loads(response_text)
-            processing_status = "NEW"
+        parser_output, processing_status = parse_sql_extract(model, sql_query, response_text)
+        if processing_status == "NEW":
             print("JSON is valid")
-        except json.JSONDecodeError:
+            response_text = json.dumps(parser_output)
+        else:
             print("Invalid JSON response from model")
-            parser_output = {{"error": "Invalid JSON response from model", "response_text": response_text}}
-            processing_status = "ERROR"
 
         # Insert into BigQuery
         insert_sql_extract_to_bq(
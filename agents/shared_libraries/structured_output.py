@@ -0,0 +1,174 @@
+import json
+import logging
+import re
+from functools import lru_cache
+from typing import Any, Optional, Type, get_args
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmResponse
+from google.genai import types
+from pydantic import BaseModel, ValidationError
+
+# JSON-schema keys the Vertex AI response_schema (an OpenAPI subset) does not accept
+_UNSUPPORTED_SCHEMA_KEYS = {"title", "default", "$defs", "additionalProperties"}
+
+
+def _inline(schema: Any, defs: dict) -> Any:
+    if isinstance(schema, list):
+        return [_inline(item, defs) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    if "$ref" in schema:
+        return _inline(defs[schema["$ref"].split("/")[-1]], defs)
+
+    any_of = schema.get("anyOf")
+    if any_of and any(option.get("type") == "null" for option in any_of):
+        # Optional[X] -> X with nullable, which is how the response schema spells it
+        options = [option for option in any_of if option.get("type") != "null"]
+        merged = {key: value for key, value in schema.items() if key != "anyOf"}
+        if len(options) == 1:
+            merged.update(_inline(options[0], defs))
+        else:
+            merged["anyOf"] = _inline(options, defs)
+        merged["nullable"] = True
+        return merged
+
+    return {
+        key: _inline(value, defs)
+        for key, value in schema.items()
+        if key not in _UNSUPPORTED_SCHEMA_KEYS
+    }
+
+
+@lru_cache(maxsize=None)
+def _response_schema_json(model_cls: Type[BaseModel]) -> str:
+    schema = model_cls.model_json_schema()
+    return json.dumps(_inline(schema, schema.get("$defs", {})))
+
+
+def response_schema_for(model_cls: Type[BaseModel]) -> dict:
+    """Converts a pydantic model into a response_schema for constrained decoding ($refs inlined, Optional as nullable)."""
+    return json.loads(_response_schema_json(model_cls))
+
+
+def strip_code_fences(text: str) -> str:
+    """Removes a ```json ... ``` wrapper (closed or, for truncated output, not), if the model added one."""
+    match = re.match(r"^\s*```(?:json)?\s*(.*?)\s*(?:```\s*)?$", text, re.DOTALL)
+    return match.group(1) if match else text.strip()
+
+
+def salvage_list_items(text: str, list_field: str) -> tuple[dict, list, bool]:
+    """Recovers what it can from JSON that does not parse as a whole.
+
+    Returns (the fields before `list_field`, every complete item of the
+    `list_field` array, whether the array was closed). Items after the first
+    broken one are lost, since there is no reliable way to resync inside it.
+    """
+    match = re.search(r'"%s"\s*:\s*\[' % re.escape(list_field), text)
+    if match is None:
+        return {}, [], False
+
+    head: dict = {}
+    try:
+        head = json.loads(text[:match.end()] + "]}")
+        head.pop(list_field, None)
+    except json.JSONDecodeError:
+        pass
+
+    decoder = json.JSONDecoder()
+    items, position, closed = [], match.end(), False
+    while True:
+        while position < len(text) and text[position] in " \t\r\n,":
+            position += 1
+        if position >= len(text):
+            break
+        if text[position] == "]":
+            closed = True
+            break
+        try:
+            item, position = decoder.raw_decode(text, position)
+        except json.JSONDecodeError:
+            break
+        items.append(item)
+    return head, items, closed
+
+
+def validate_items(items: list, item_cls: Type[BaseModel]) -> tuple[list, list[int]]:
+    """Validates list items one by one; returns (valid items as dicts, indices of invalid items)."""
+    valid, invalid = [], []
+    for index, item in enumerate(items):
+        try:
+            valid.append(item_cls.model_validate(item).model_dump())
+        except ValidationError:
+            invalid.append(index)
+    return valid, invalid
+
+
+def parse_model(text: str, model_cls: Type[BaseModel]) -> Optional[BaseModel]:
+    """Returns the validated model, or None if the text is not valid JSON for it."""
+    try:
+        return model_cls.model_validate_json(strip_code_fences(text))
+    except ValidationError:
+        return None
+
+
+def repair_model_json(text: str, model_cls: Type[BaseModel], list_field: str) -> Optional[str]:
+    """Turns a malformed response into valid JSON for `model_cls`, keeping every item of `list_field` that validates.
+
+    Missing text fields before the list are filled with a note rather than
+    failing the whole response. Returns None if nothing can be recovered.
+    """
+    model = parse_model(text, model_cls)
+    if model is not None:
+        return model.model_dump_json()
+
+    head, items, closed = salvage_list_items(strip_code_fences(text), list_field)
+    item_cls = get_args(model_cls.model_fields[list_field].annotation)[0]
+    if isinstance(item_cls, type) and issubclass(item_cls, BaseModel):
+        valid, invalid = validate_items(items, item_cls)
+    else:
+        valid = [item for item in items if isinstance(item, item_cls)]
+        invalid = [index for index, item in enumerate(items) if not isinstance(item, item_cls)]
+    if not head and not valid:
+        return None
+
+    note = "(Incomplete model response; only the items that validated were kept.)"
+    if invalid or not closed:
+        logging.warning("Dropped %d invalid %s item(s) from %s (truncated: %s)", len(invalid), list_field, model_cls.__name__, not closed)
+    for name, field in model_cls.model_fields.items():
+        if name != list_field and field.annotation is str and not isinstance(head.get(name), str):
+            head[name] = note
+    try:
+        return model_cls.model_validate({**head, list_field: valid}).model_dump_json()
+    except ValidationError:
+        return None
+
+
+def repair_output_callback(model_cls: Type[BaseModel], list_field: str):
+    """after_model_callback for an LlmAgent with `output_schema=model_cls`.
+
+    The agent's output_schema already constrains decoding; this catches what
+    still slips through (fenced or truncated JSON, an invalid list item) and
+    repairs it locally, so the review does not have to be run again.
+    """
+
+    def callback(callback_context: CallbackContext, llm_response: LlmResponse) -> Optional[LlmResponse]:
+        if llm_response.partial or not llm_response.content or not llm_response.content.parts:
+            return None
+        text = "".join(part.text or "" for part in llm_response.content.parts if not part.thought)
+        if not text:
+            return None
+        try:
+            model_cls.model_validate_json(text)
+            return None
+        except ValidationError:
+            pass
+        repaired = repair_model_json(text, model_cls, list_field)
+        if repaired is None:
+            logging.error("Could not repair %s output of %s", model_cls.__name__, callback_context.agent_name)
+            return None
+        return llm_response.model_copy(
+            update={"content": types.Content(role="model", parts=[types.Part(text=repaired)])}
+        )
+
+    return callback
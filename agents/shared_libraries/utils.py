@@ -27,6 +27,9 @@ from google.oauth2 import id_token
 from google.genai.types import Part, HttpOptions
 from google import genai
 from google.adk.models.google_llm import BaseLlm, Gemini
+from google.adk.models import LlmRequest, LlmResponse
+from agents.shared_libraries.rate_limiter import get_limiter
+from typing import AsyncGenerator
 from functools import cached_property
 from typing_extensions import override
 from google.genai import Client, types
@@ -64,6 +67,31 @@ customAFC = types.GenerateContentConfig(
 proxyModel = config.LLM_MODEL
 
 
+class RateLimitedGemini(Gemini):
+    """Gemini model whose requests go through the shared "gemini" concurrency limiter.
+
+    Quota errors are retried with backoff and lower the concurrency for every
+    Vertex AI caller in the process, as for the direct SDK calls in sql_analysis.
+    Streamed responses are collected before they are yielded.
+    """
+
+    @override
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        async def collect() -> list[LlmResponse]:
+            return [
+                response
+                async for response in super(RateLimitedGemini, self).generate_content_async(llm_request, stream)
+            ]
+
+        for response in await get_limiter("gemini").call_async(collect):
+            yield response
+
+
+rateLimitedModel = RateLimitedGemini(model=config.LLM_MODEL)
+
+
 def store_uploaded_image_as_artifact(
     artifact_service: GcsArtifactService,
     app_name: str,
@@ -0,0 +1,224 @@
+import json
+import os
+import threading
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class VectorIndex:
+    """Persistent inverted-file (IVF) approximate nearest-neighbour index over cosine similarity.
+
+    Vectors are clustered around `n_lists` k-means centroids; a query only scans
+    the members of its `n_probe` closest clusters instead of every vector. Until
+    enough vectors have been added to train the centroids, queries fall back to
+    an exact scan. Vectors can be added (or replaced by key) at any time; the
+    centroids are retrained automatically once the index has grown well past the
+    size it was trained at.
+    """
+
+    def __init__(self, dim: int, n_lists: Optional[int] = None, min_train_size: int = 1000):
+        self.dim = dim
+        self.n_lists = n_lists
+        self.min_train_size = min_train_size
+        self.keys: list[str] = []
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.trained_size = 0
+        self._key_to_row: dict[str, int] = {}
+        self._lists: Optional[list[np.ndarray]] = None
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._key_to_row
+
+    # --- Building ---------------------------------------------------------
+
+    def train(self, iterations: int = 10, sample_size: int = 50_000, seed: int = 0):
+        """Fits the IVF centroids with spherical k-means on (a sample of) the stored vectors."""
+        with self._lock:
+            n = len(self.vectors)
+            if n == 0:
+                return
+            n_lists = self.n_lists or max(1, int(np.sqrt(n)))
+            n_lists = min(n_lists, n)
+            rng = np.random.default_rng(seed)
+            sample = self.vectors[rng.choice(n, size=min(sample_size, n), replace=False)]
+            centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+            for _ in range(iterations):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                for c in range(n_lists):
+                    members = sample[labels == c]
+                    if len(members):
+                        centroids[c] = members.mean(axis=0)
+                centroids = _normalize(centroids)
+
+            self.centroids = centroids.astype(np.float32)
+            self.assignments = self._assign(self.vectors)
+            self.trained_size = n
+            self._lists = None
+
+    def _assign(self, vectors: np.ndarray, block_size: int = 8192) -> np.ndarray:
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), block_size):
+            block = vectors[start:start + block_size]
+            labels[start:start + block_size] = np.argmax(block @ self.centroids.T, axis=1)
+        return labels
+
+    def add(self, keys: Sequence[str], vectors: Iterable[Sequence[float]]):
+        """Adds vectors under the given keys; an existing key has its vector replaced."""
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+        if len(keys) != len(vectors):
+            raise ValueError(f"Got {len(keys)} keys for {len(vectors)} vectors")
+
+        with self._lock:
+            existing_rows, new_keys, new_rows = [], [], []
+            for i, key in enumerate(keys):
+                row = self._key_to_row.get(key)
+                if row is None:
+                    new_keys.append(key)
+                    new_rows.append(i)
+                else:
+                    existing_rows.append((row, i))
+
+            if existing_rows:
+                if not self.vectors.flags.writeable:
+                    self.vectors = np.array(self.vectors)
+                rows, src = zip(*existing_rows)
+                self.vectors[list(rows)] = vectors[list(src)]
+                if self.centroids is not None:
+                    self.assignments[list(rows)] = self._assign(vectors[list(src)])
+
+            if new_keys:
+                added = vectors[new_rows]
+                start = len(self.keys)
+                self.vectors = np.concatenate([self.vectors, added])
+                self.keys.extend(new_keys)
+                self._key_to_row.update({key: start + i for i, key in enumerate(new_keys)})
+                if self.centroids is not None:
+                    self.assignments = np.concatenate([self.assignments, self._assign(added)])
+
+            self._lists = None
+            if self.centroids is None and len(self) >= self.min_train_size:
+                self.train()
+            elif self.centroids is not None and len(self) > 4 * self.trained_size:
+                self.train()
+
+    # --- Querying ---------------------------------------------------------
+
+    def _inverted_lists(self) -> list[np.ndarray]:
+        if self._lists is None:
+            order = np.argsort(self.assignments, kind="stable")
+            bounds = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+            self._lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(self.centroids))]
+        return self._lists
+
+    def search(
+        self,
+        queries: Iterable[Sequence[float]],
+        k: int = 10,
+        n_probe: int = 8,
+        exclude_self: bool = False,
+        query_keys: Optional[Sequence[str]] = None,
+    ) -> list[list[tuple[str, float]]]:
+        """Returns, per query vector, up to k (key, cosine similarity) pairs, best first.
+
+        With `exclude_self`, hits whose key equals the matching entry of
+        `query_keys` are dropped.
+        """
+        queries = _normalize(np.asarray(queries, dtype=np.float32).reshape(-1, self.dim))
+        with self._lock:
+            if not len(self):
+                return [[] for _ in range(len(queries))]
+            if self.centroids is None:
+                candidate_sets = [None] * len(queries)
+            else:
+                lists = self._inverted_lists()
+                n_probe = min(n_probe, len(self.centroids))
+                probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :n_probe]
+                candidate_sets = [np.concatenate([lists[c] for c in probe]) for probe in probes]
+
+            results = []
+            for qi, (query, candidates) in enumerate(zip(queries, candidate_sets)):
+                candidate_vectors = self.vectors if candidates is None else self.vectors[candidates]
+                scores = candidate_vectors @ query
+                skip_key = query_keys[qi] if exclude_self and query_keys is not None else None
+                take = min(k + (1 if skip_key is not None else 0), len(scores))
+                if take == 0:
+                    results.append([])
+                    continue
+                top = np.argpartition(-scores, take - 1)[:take]
+                top = top[np.argsort(-scores[top], kind="stable")]
+                rows = top if candidates is None else candidates[top]
+                hits = [(self.keys[row], float(scores[t])) for row, t in zip(rows, top) if self.keys[row] != skip_key]
+                results.append(hits[:k])
+            return results
+
+    def search_by_key(self, key: str, k: int = 10, n_probe: int = 8) -> list[tuple[str, float]]:
+        """Returns the k entries most similar to an entry already in the index."""
+        with self._lock:
+            row = self._key_to_row.get(key)
+            if row is None:
+                raise KeyError(key)
+            vector = np.array(self.vectors[row])
+        return self.search([vector], k=k, n_probe=n_probe, exclude_self=True, query_keys=[key])[0]
+
+    # --- Persistence ------------------------------------------------------
+
+    def save(self, path: str):
+        """Writes the index to a directory (vectors as .npy so they can be memory-mapped on load)."""
+        with self._lock:
+            os.makedirs(path, exist_ok=True)
+            arrays = {"vectors": self.vectors, "assignments": self.assignments}
+            if self.centroids is not None:
+                arrays["centroids"] = self.centroids
+            for name, array in arrays.items():
+                # Write beside and swap in, since `vectors` may be memory-mapped from the target file
+                tmp_path = os.path.join(path, f"{name}.tmp.npy")
+                np.save(tmp_path, array)
+                os.replace(tmp_path, os.path.join(path, f"{name}.npy"))
+            meta = {
+                "dim": self.dim,
+                "n_lists": self.n_lists,
+                "min_train_size": self.min_train_size,
+                "trained_size": self.trained_size,
+                "keys": self.keys,
+            }
+            tmp_path = os.path.join(path, "index.json.tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(meta, f)
+            # Metadata is replaced last and atomically, so a crash never pairs new keys with old vectors
+            os.replace(tmp_path, os.path.join(path, "index.json"))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> "VectorIndex":
+        """Loads an index written by `save`; with `mmap`, vectors are memory-mapped read-only until modified."""
+        with open(os.path.join(path, "index.json")) as f:
+            meta = json.load(f)
+        index = cls(meta["dim"], n_lists=meta["n_lists"], min_train_size=meta["min_train_size"])
+        index.keys = meta["keys"]
+        index._key_to_row = {key: row for row, key in enumerate(index.keys)}
+        # Arrays may be ahead of the keys if a save was interrupted; the keys are authoritative
+        index.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r" if mmap else None)[:len(index.keys)]
+        index.assignments = np.load(os.path.join(path, "assignments.npy"))[:len(index.keys)]
+        centroids_path = os.path.join(path, "centroids.npy")
+        if os.path.exists(centroids_path):
+            index.centroids = np.load(centroids_path)
+        index.trained_size = meta["trained_size"]
+        return index
+
+    @classmethod
+    def load_or_create(cls, path: str, dim: int, **kwargs) -> "VectorIndex":
+        if os.path.exists(os.path.join(path, "index.json")):
+            return cls.load(path)
+        return cls(dim, **kwargs)
@@ -2,8 +2,10 @@ from google.adk.agents import LlmAgent
 from pydantic import BaseModel, Field
 from typing import List
 
-from agents.shared_libraries.utils import proxyModel
+from agents.shared_libraries.utils import rateLimitedModel
 from agents.shared_libraries import prompt_master
+from agents.shared_libraries.gdm_rules import RuleFinding
+from agents.shared_libraries.structured_output import repair_output_callback
 import logging
 
 logging.basicConfig(level=logging.DEBUG)
@@ -30,12 +32,51 @@ class StandardizationReport(BaseModel):
     entities: List[EntityCompliance] = Field(description="A list of compliance reports for each entity in the model.")
 
 
+def _append_finding(findings: str, finding: RuleFinding) -> str:
+    line = f"[Automated check: {finding.rule}] {finding.message}"
+    return f"{findings}\n{line}" if findings else line
+
+
+def apply_rule_findings(report: StandardizationReport, findings: List[RuleFinding]) -> StandardizationReport:
+    """Merges deterministic rule findings into a (model-generated) standardization report.
+
+    Entities or attributes the model did not mention are added; anything with a
+    finding is marked non-compliant. The input report is not modified.
+    """
+    report = report.model_copy(deep=True)
+    entities = {entity.entity_name: entity for entity in report.entities}
+    for finding in findings:
+        entity = entities.get(finding.entity_name)
+        if entity is None:
+            entity = EntityCompliance(entity_name=finding.entity_name, is_compliant=True, findings="", attributes=[])
+            report.entities.append(entity)
+            entities[finding.entity_name] = entity
+        entity.is_compliant = False
+        if finding.attribute_name is None:
+            entity.findings = _append_finding(entity.findings, finding)
+            continue
+        attribute = next((a for a in entity.attributes if a.attribute_name == finding.attribute_name), None)
+        if attribute is None:
+            attribute = AttributeCompliance(attribute_name=finding.attribute_name, is_compliant=True, findings="")
+            entity.attributes.append(attribute)
+        attribute.is_compliant = False
+        attribute.findings = _append_finding(attribute.findings, finding)
+    if findings:
+        flagged = len({finding.entity_name for finding in findings})
+        summary = f"Automated checks raised {len(findings)} findings across {flagged} entities."
+        report.report_summary = f"{report.report_summary} {summary}".strip()
+    return report
+
+
 # --- Agent Definition ---
 
 StandardizingAgent = LlmAgent(
-    model=proxyModel,
+    model=rateLimitedModel,
     name="standardizing_agent",
     description="Analyzes a DTM XML model to check its compliance against GDM standardization guidelines.",
     instruction=prompt_master.DTM_STANDARDIZATION_PROMPT,
     output_schema=StandardizationReport,
+    output_key="standardization_report",
+    include_contents='none',
+    after_model_callback=repair_output_callback(StandardizationReport, "entities"),
 )
\ No newline at end of file
@@ -1,25 +1,33 @@
+import argparse
+from datetime import datetime, timezone
+
 from google.cloud import bigquery
-from google.api_core.exceptions import GoogleAPIError
+from google.api_core.exceptions import GoogleAPIError, NotFound
 
+from agents.shared_libraries.checkpoint_store import CheckpointStore
 
-def run_bigquery_ddl():
-    """
-    Initializes the BigQuery client and executes the DDL statements
-    for the new statement-level lineage model.
-    """
-    try:
-        client = bigquery.Client()
-        print(f"✅ BigQuery client initialized. Using project: {client.project}")
-    except Exception as e:
-        print(f"❌ Could not initialize BigQuery client. Error: {e}")
-        print(
-            "Please ensure you are authenticated (e.g., `gcloud auth application-default login`)"
-        )
-        return
 
-    ddl_statements = [
-        """
-        CREATE OR REPLACE TABLE `r2d2-00.gdm.raw_sql_extracts`(
+LINEAGE_DATASET = "r2d2-00.gdm"
+# Records the progress of each table swap so an interrupted migration can resume
+MIGRATION_CHECKPOINT_DB = "bq_gdm_migration_checkpoint.db"
+
+# Partitioning and clustering for each lineage table. Every lineage read filters on
+# q_id (and usually s_id / source_id), so clustering on those columns lets BigQuery
+# prune blocks instead of scanning whole tables.
+TABLE_LAYOUTS = {
+    "raw_sql_extracts": {"partition_by": "DATE(inserted_at)", "cluster_by": ["q_id", "file_name"]},
+    "query_statements": {"partition_by": None, "cluster_by": ["q_id", "s_id"]},
+    "statement_sources": {"partition_by": None, "cluster_by": ["q_id", "s_id", "source_id"]},
+    "column_lineage": {"partition_by": None, "cluster_by": ["q_id", "s_id"]},
+    "statement_joins": {"partition_by": None, "cluster_by": ["q_id", "s_id"]},
+    "statement_filters": {"partition_by": None, "cluster_by": ["q_id", "s_id"]},
+}
+
+# DDL templates for the statement-level lineage model. `{create}` is the DDL verb,
+# `{table_id}` the fully qualified table and `{layout}` the PARTITION/CLUSTER clause.
+DDL_TEMPLATES = {
+    "raw_sql_extracts": """
+        {create} `{table_id}` (
             q_id STRING OPTIONS ( description = "Primary Key. A unique identifier for the entire SQL file/script."),
             raw_sql_path STRING OPTIONS ( description = "Raw SQL Path"),
             file_name STRING OPTIONS (description = "File Name"),
@@ -29,13 +37,15 @@ def run_bigquery_ddl():
             dependencies ARRAY<STRING> OPTIONS(description="A list of explicit dependencies for the entire file (e.g., upstream job IDs)."),
             inserted_at TIMESTAMP OPTIONS (description = "The timestamp when the file was first ingested."),
             processed_at TIMESTAMP OPTIONS ( description = "The timestamp when the file was last successfully processed into statement tables.")
-        ) OPTIONS (
+        )
+        {layout}
+        OPTIONS (
             description = "Master log of all SQL files/scripts that have been ingested for parsing.",
             labels = [("agent", "reverse_agent")]
         )
         """,
-        """
-       CREATE OR REPLACE TABLE `r2d2-00.gdm.query_statements` (
+    "query_statements": """
+        {create} `{table_id}` (
             q_id STRING OPTIONS (description = "Foreign Key. Links to the parent file in raw_sql_extracts."),
             s_id STRING OPTIONS (description = "Primary Key (composite). A unique ID for this specific statement within the file (e.g., s1, s2)."),
             inferred_detail STRING OPTIONS (description = "A natural language summary or inferred purpose of the statement."),
@@ -45,13 +55,15 @@ def run_bigquery_ddl():
             target_table_name STRING OPTIONS (description = "The name of the table being modified."),
             target_table_alias STRING OPTIONS (description = "The alias used for the target table in the DML statement (if any)."),
             inferred_target_type STRING OPTIONS (description = "Inferred table role based on script-wide analysis: BASE_TABLE, WORK_TABLE, LOG_TABLE.")
-        ) OPTIONS (
+        )
+        {layout}
+        OPTIONS (
             description = "Tracks each individual DML (INSERT, UPDATE, etc.) statement within a SQL file.",
             labels = [("agent", "reverse_agent")]
         )
         """,
-        """
-        CREATE OR REPLACE TABLE `r2d2-00.gdm.statement_sources` (
+    "statement_sources": """
+        {create} `{table_id}` (
             q_id STRING OPTIONS (description = "Foreign Key. Links to the parent file."),
             s_id STRING OPTIONS (description = "Foreign Key. Links to the specific statement."),
             source_id STRING OPTIONS (description = "Primary Key (composite). A unique ID for this source table *within this statement* (e.g., src1, src2)."),
@@ -60,13 +72,15 @@ def run_bigquery_ddl():
             source_table_name STRING OPTIONS (description = "The name of the source table (or '(Subquery)')."),
             source_alias STRING OPTIONS (description = "The alias used for this source table in the statement."),
             source_type STRING OPTIONS (description = "The type of source (BASE_TABLE, CTE, SUBQUERY).")
-        ) OPTIONS (
+        )
+        {layout}
+        OPTIONS (
             description = "Catalogs every source table (FROM/JOIN) used by a specific statement.",
             labels = [("agent", "reverse_agent")]
         )
         """,
-        """
-        CREATE OR REPLACE TABLE `r2d2-00.gdm.column_lineage` (
+    "column_lineage": """
+        {create} `{table_id}` (
             q_id STRING OPTIONS (description = "Foreign Key. Links to the parent file."),
             s_id STRING OPTIONS (description = "Foreign Key. Links to the specific statement."),
             output_column_name STRING OPTIONS (description = "The final name of the column being inserted or updated."),
@@ -74,37 +88,92 @@ def run_bigquery_ddl():
             transformation_logic STRING OPTIONS (description = "The full expression or function used to create the column."),
             inferred_logic_detail STRING OPTIONS (description = "A natural language summary or inferred purpose how this column is populated"),
             source_references ARRAY<STRUCT<source_id STRING, column_name STRING>> OPTIONS (description = "Links to the specific source table (via source_id) and column name that feeds this output column.")
-        ) OPTIONS (
+        )
+        {layout}
+        OPTIONS (
             description = "Core column-level lineage, mapping statement outputs to specific statement sources.",
             labels = [("agent", "reverse_agent")]
         )
         """,
-        """
-        CREATE OR REPLACE TABLE `r2d2-00.gdm.statement_joins` (
+    "statement_joins": """
+        {create} `{table_id}` (
             q_id STRING OPTIONS (description = "Foreign Key. Links to the parent file."),
             s_id STRING OPTIONS (description = "Foreign Key. Links to the specific statement."),
             join_type STRING OPTIONS (description = "The type of join (INNER, LEFT, RIGHT, FULL OUTER, CROSS)."),
             left_source_id STRING OPTIONS (description = "The source_id (from statement_sources) of the table on the left side."),
             right_source_id STRING OPTIONS (description = "The source_id (from statement_sources) of the table on the right side."),
             join_conditions ARRAY<STRUCT<left_column STRING, operator STRING, right_column STRING>> OPTIONS (description = "An array of structs detailing the join conditions.")
-        ) OPTIONS (
+        )
+        {layout}
+        OPTIONS (
             description = "Stores structured information about all join operations in a specific statement.",
             labels = [("agent", "reverse_agent")]
         )
         """,
-        """
-        CREATE OR REPLACE TABLE `r2d2-00.gdm.statement_filters` (
+    "statement_filters": """
+        {create} `{table_id}` (
             q_id STRING OPTIONS (description = "Foreign Key. Links to the parent file."),
             s_id STRING OPTIONS (description = "Foreign Key. Links to the specific statement."),
             clause STRING OPTIONS (description = "The clause where the filter is applied (WHERE, HAVING, ON)."),
             filter_expression STRING OPTIONS (description = "The full text of the filter condition."),
             involved_columns ARRAY<STRUCT<source_id STRING, column_name STRING>> OPTIONS (description = "An array identifying all source columns (via source_id) part of the filter.")
-        ) OPTIONS (
+        )
+        {layout}
+        OPTIONS (
             description = "Stores conditions from WHERE, HAVING, and ON clauses for a specific statement.",
             labels = [("agent", "reverse_agent")]
         )
         """,
-    ]
+}
+
+
+def get_layout_clause(table_name: str) -> str:
+    """Builds the PARTITION BY / CLUSTER BY clause for a lineage table."""
+    layout = TABLE_LAYOUTS[table_name]
+    clauses = []
+    if layout["partition_by"]:
+        clauses.append(f"PARTITION BY {layout['partition_by']}")
+    if layout["cluster_by"]:
+        clauses.append(f"CLUSTER BY {', '.join(layout['cluster_by'])}")
+    return "\n        ".join(clauses)
+
+
+def build_ddl(table_name: str, create: str = "CREATE OR REPLACE TABLE", table_id: str = None) -> str:
+    """Renders the DDL statement for a lineage table."""
+    return DDL_TEMPLATES[table_name].format(
+        create=create,
+        table_id=table_id or f"{LINEAGE_DATASET}.{table_name}",
+        layout=get_layout_clause(table_name),
+    )
+
+
+def get_bq_client():
+    """Initializes the BigQuery client."""
+    try:
+        client = bigquery.Client()
+        print(f"✅ BigQuery client initialized. Using project: {client.project}")
+        return client
+    except Exception as e:
+        print(f"❌ Could not initialize BigQuery client. Error: {e}")
+        print(
+            "Please ensure you are authenticated (e.g., `gcloud auth application-default login`)"
+        )
+        return None
+
+
+def run_bigquery_ddl():
+    """
+    Initializes the BigQuery client and executes the DDL statements
+    for the new statement-level lineage model.
+
+    This drops and recreates every table. Use `migrate_bigquery_tables` to
+    apply layout changes to tables that already hold data.
+    """
+    client = get_bq_client()
+    if not client:
+        return
+
+    ddl_statements = [build_ddl(table_name) for table_name in DDL_TEMPLATES]
 
     print(f"\nFound {len(ddl_statements)} DDL commands to execute for the new model.\n")
     print("-" * 80)
@@ -137,5 +206,148 @@ def run_bigquery_ddl():
     print("All DDL commands have been processed.")
 
 
+def _table_row_count(client, table_id: str) -> int:
+    """Returns the number of rows in a table."""
+    rows = client.query(f"SELECT COUNT(*) AS row_count FROM `{table_id}`").result()
+    return next(iter(rows)).row_count
+
+
+def _table_exists(client, table_id: str) -> bool:
+    """Checks whether a table exists."""
+    try:
+        client.get_table(table_id)
+    except NotFound:
+        return False
+    return True
+
+
+def _has_target_layout(table: bigquery.Table, table_name: str) -> bool:
+    """Checks whether an existing table already has the configured partitioning and clustering."""
+    layout = TABLE_LAYOUTS[table_name]
+    if list(table.clustering_fields or []) != layout["cluster_by"]:
+        return False
+    if layout["partition_by"] and table.time_partitioning is None:
+        return False
+    return True
+
+
+def migrate_bigquery_tables():
+    """
+    Non-destructively rebuilds the lineage tables with partitioning and clustering.
+
+    For each table that does not have the target layout, the data is copied into a
+    new table created from the current DDL, row counts are verified, and the tables
+    are swapped by renaming. The original table is kept as `<table>__backup_<timestamp>`
+    so it can be inspected or restored before being dropped by hand.
+
+    The swap is recorded in MIGRATION_CHECKPOINT_DB before the first rename, so a
+    run interrupted between the two renames completes the swap instead of
+    recreating the table. If the checkpoint is lost, a leftover `<table>__migrating`
+    table is renamed into place rather than creating an empty table.
+    """
+    client = get_bq_client()
+    if not client:
+        return
+
+    store = CheckpointStore(MIGRATION_CHECKPOINT_DB, job=f"migrate:{LINEAGE_DATASET}")
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")
+    print(f"\nChecking {len(DDL_TEMPLATES)} lineage tables for migration.\n")
+    print("-" * 80)
+
+    for table_name in DDL_TEMPLATES:
+        table_id = f"{LINEAGE_DATASET}.{table_name}"
+        staging_name = f"{table_name}__migrating"
+        staging_id = f"{LINEAGE_DATASET}.{staging_name}"
+        backup_name = f"{table_name}__backup_{stamp}"
+
+        try:
+            progress = store.get(table_name, {})
+            if progress.get("stage") in ("swapping", "original_renamed"):
+                print(f"Resuming interrupted swap for `{table_id}` (original at `{progress['backup_name']}`).")
+                if progress["stage"] == "swapping" and _table_exists(client, table_id):
+                    # Interrupted before the original was renamed away
+                    client.query(f"ALTER TABLE `{table_id}` RENAME TO `{progress['backup_name']}`").result()
+                    store.mark_done(table_name, {**progress, "stage": "original_renamed"})
+                client.query(f"ALTER TABLE `{staging_id}` RENAME TO `{table_name}`").result()
+                store.mark_done(table_name, {**progress, "stage": "done"})
+                print(f"✅ Migrated `{table_id}`. Original kept as `{LINEAGE_DATASET}.{progress['backup_name']}`.\n")
+                print("-" * 80)
+                continue
+
+            try:
+                existing_table = client.get_table(table_id)
+            except NotFound:
+                if _table_exists(client, staging_id):
+                    # A swap was interrupted without a usable checkpoint; the staging table holds the copied data
+                    print(f"Table `{table_id}` does not exist but `{staging_id}` does. Completing the swap.")
+                    client.query(f"ALTER TABLE `{staging_id}` RENAME TO `{table_name}`").result()
+                    store.mark_done(table_name, {**progress, "stage": "done"})
+                    print(f"✅ Migrated `{table_id}` from `{staging_id}`.\n")
+                    print("-" * 80)
+                    continue
+                print(f"Table `{table_id}` does not exist. Creating it with the new layout.")
+                client.query(build_ddl(table_name, create="CREATE TABLE IF NOT EXISTS")).result()
+                print(f"✅ Created `{table_id}`.\n")
+                print("-" * 80)
+                continue
+
+            if _has_target_layout(existing_table, table_name):
+                print(f"✅ `{table_id}` already has the target layout. Skipping.\n")
+                print("-" * 80)
+                continue
+
+            print(f"Migrating `{table_id}` via `{staging_id}`")
+            client.query(build_ddl(table_name, create="CREATE TABLE IF NOT EXISTS", table_id=staging_id)).result()
+            # The staging table may hold rows from an interrupted run.
+            client.query(f"TRUNCATE TABLE `{staging_id}`").result()
+
+            staging_columns = {field.name for field in client.get_table(staging_id).schema}
+            columns = [field.name for field in existing_table.schema if field.name in staging_columns]
+            column_list = ", ".join(f"`{column}`" for column in columns)
+            client.query(
+                f"INSERT INTO `{staging_id}` ({column_list}) SELECT {column_list} FROM `{table_id}`"
+            ).result()
+
+            source_rows = _table_row_count(client, table_id)
+            copied_rows = _table_row_count(client, staging_id)
+            if source_rows != copied_rows:
+                print(f"❌ Row count mismatch for `{table_id}` ({source_rows} vs {copied_rows}). Leaving the original in place.\n")
+                print("-" * 80)
+                continue
+
+            # Record the intent first so a crash between here and the second rename can be resumed
+            store.mark_done(table_name, {"stage": "swapping", "backup_name": backup_name, "rows": copied_rows})
+            client.query(f"ALTER TABLE `{table_id}` RENAME TO `{backup_name}`").result()
+            store.mark_done(table_name, {"stage": "original_renamed", "backup_name": backup_name, "rows": copied_rows})
+            client.query(f"ALTER TABLE `{staging_id}` RENAME TO `{table_name}`").result()
+            store.mark_done(table_name, {"stage": "done", "backup_name": backup_name, "rows": copied_rows})
+            print(f"✅ Migrated {copied_rows} rows. Original kept as `{LINEAGE_DATASET}.{backup_name}`.\n")
+
+        except GoogleAPIError as e:
+            print(f"❌ Error migrating `{table_id}`.")
+            print(f"   Error details: {e}\n")
+
+        except Exception as e:
+            print(f"❌ An unexpected error occurred while migrating `{table_id}`.")
+            print(f"   Error details: {e}\n")
+
+        print("-" * 80)
+
+    store.compact()
+    store.close()
+    print("All lineage tables have been checked.")
+
+
 if __name__ == "__main__":
-    run_bigquery_ddl()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Create or migrate the statement-level lineage tables.")
+    parser.add_argument(
+        "--migrate",
+        action="store_true",
+        help="Rebuild existing tables with partitioning/clustering, keeping their data, instead of recreating them empty.",
+    )
+    args = parser.parse_args()
+
+    if args.migrate:
+        migrate_bigquery_tables()
+    else:
+        run_bigquery_ddl()
\ No newline at end of file
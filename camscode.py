@@ -1,18 +1,24 @@
 import base64, json
-import vertexai
-from vertexai.generative_models import GenerativeModel, Part, SafetySetting
+from vertexai.generative_models import SafetySetting
 import pandas as pd
 from google.cloud import storage
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from agents.shared_libraries.model_registry import get_generative_model
+from agents.shared_libraries.rate_limiter import get_limiter
+from agents.shared_libraries.checkpoint_store import CheckpointStore
 
 ### Variables ########
 
 GEMINI_MODEL = "gemini-1.5-pro-002"
 PROJECT_ID = "prj-cams-playground-vertexai"
 LOCATION_ID = "asia-south1"
-BATCH_SIZE = 10
-RERUN = False
+PROGRESS_EVERY = 10
+MAX_WORKERS = 20  # Upper bound; the limiter below finds the sustainable concurrency
+SYSTEM_INSTRUCTION = """You a database analyst expert in writing and understanding sql queries. 
+            You are also a business expert in financial investments like  mutual funds (MFs), 
+            alternative investment funds (AIFs), insurance companies and other financial institutions."""
+RERUN_IDS = []  # LinkIDs to process again even if they are already checkpointed
 CHECK_ID = 'FATFCountryIdentification2FUNDSNET'
 REPORT_TYPE = 'ETL'
 
@@ -25,12 +31,15 @@ COLUMNS_ALL = "ColumnsFull.csv"
 
 #### Output Files #######
 OUTPUT_CSV_FILE = "SQLQueriesGenAIExtract001.csv"  ##Change the name of the file as requried
-CHECKPOINT_FILE = f"""{OUTPUT_CSV_FILE}_checkpoint.json"""
+CHECKPOINT_DB = f"""{OUTPUT_CSV_FILE}_checkpoint.db"""  # Processed LinkIDs and their results; OUTPUT_CSV_FILE is built from it
 OUTPUT_TABLE_LIST = "TablesFromGenAI.csv"
 OUTPUT_COLUMNS_LIST = "ColumnsFromGenAI.csv"
 OUTPUT_TABLES_PER_REPORT = "TablesListPerReport.csv"
 OUTPUT_COLUMNS_PER_REPORT = "ColumnsListPerReport.csv"
 
+# Shared AIMD limiter for every Gemini call made by this script
+gemini_limiter = get_limiter("gemini", max_limit=MAX_WORKERS)
+
 
 
 
@@ -59,12 +68,13 @@ def extract_details(sql_query):
         if len(sql_query) < 10:
             sql_query = 'No SQL'
             
-        vertexai.init(project=PROJECT_ID, location=LOCATION_ID)
-        model = GenerativeModel(
+        # Shared across all worker threads; created (and vertexai.init called) only once
+        model = get_generative_model(
             GEMINI_MODEL,
-            system_instruction=["""You a database analyst expert in writing and understanding sql queries. 
-            You are also a business expert in financial investments like  mutual funds (MFs), 
-            alternative investment funds (AIFs), insurance companies and other financial institutions."""])
+            system_instruction=SYSTEM_INSTRUCTION,
+            project=PROJECT_ID,
+            location=LOCATION_ID,
+        )
         
         
         ##Change the prompt accordinly to extract various details
@@ -136,7 +146,9 @@ Output JSON:
         "top_p": 0.9,
     }
         # print(extraction_prompt)
-        responses = model.generate_content(
+        # Retries quota (429) errors with backoff and adapts concurrency across workers
+        responses = gemini_limiter.call(
+            model.generate_content,
             [extraction_prompt],
             generation_config=generation_config,
             # safety_settings=safety_settings,
@@ -149,24 +161,44 @@ Output JSON:
 
 
 import os
+import threading
+from functools import lru_cache
 current_dir = os.getcwd()
+
+# Report type -> (source corpus file, SQL column)
+SOURCE_QUERY_FILES = {
+    "ROR": ("Consolidated Source Reports.csv", "SQL"),
+    "ETL": ("ETLQueries.csv", "RF Query"),
+}
+_source_index_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _load_source_query_index(report_type):
+    filename, sql_column = SOURCE_QUERY_FILES[report_type]
+    filepath = os.path.join(current_dir, "../SourceQueries", filename)
+    source_df = pd.read_csv(filepath, usecols=["LinkID", sql_column])
+    # Keep the first query per LinkID, as the per-report filter used to
+    source_df = source_df.drop_duplicates(subset="LinkID", keep="first")
+    return dict(zip(source_df["LinkID"], source_df[sql_column]))
+
+
+def get_source_query_index(report_type):
+    """Returns the LinkID -> SQL index for a report type, reading its CSV only once per process."""
+    # The lock makes the first load happen once even when every worker asks at the same time
+    with _source_index_lock:
+        return _load_source_query_index(report_type)
+
+
 def process_sql_from_gcs(RType,RId):
     try:
         if RType=="MIS":
             filepath=os.path.join(current_dir, "../SourceQueries/MISReports",f'''{RId}.txt''')     
             with open(filepath, 'r') as f:  # Use 'r' for reading
                 content_text = f.read()
-        elif RType=="ROR":
-            filepath=os.path.join(current_dir, "../SourceQueries","Consolidated Source Reports.csv")
-            ror_df = pd.read_csv(filepath)
-            ror_row = ror_df[ror_df['LinkID'] == RId]
-            content_text=ror_row["SQL"].iloc[0]
         else:
-            filepath=os.path.join(current_dir, "../SourceQueries","ETLQueries.csv")
-            etl_df = pd.read_csv(filepath)
-            etl_row = etl_df[etl_df['LinkID'] == RId]
-            # print(etl_row)
-            content_text=etl_row["RF Query"].iloc[0]
+            source_type = "ROR" if RType=="ROR" else "ETL"
+            content_text = get_source_query_index(source_type)[RId]
         # print("SQL:::  " + content_text)
         response = extract_details(str(content_text))
         response_json = json.loads(response)
@@ -182,36 +214,31 @@ def process_sql_from_gcs(RType,RId):
 def process_file_future(row):
     response = process_sql_from_gcs(row["Report Type"],row["LinkID"])
     if response:
-        df = pd.json_normalize(response)
-        df["LinkID"] = row["LinkID"]
-        return df, row["LinkID"]
+        response["LinkID"] = row["LinkID"]
+        return response, row["LinkID"]
     else:
         print("No Reponse from Gemini" + str(row))
     return None
 
 
+def materialize_output_csv(store):
+    """Builds OUTPUT_CSV_FILE from the results recorded in the checkpoint store."""
+    final_df = pd.json_normalize([response for _, response in store.results()])
+    final_df.to_csv(OUTPUT_CSV_FILE, index=False)
+    return final_df
+
+
 def main():
     try:
-        final_df = pd.DataFrame()
-        processed_files = set()
         skip_count=0
-        
-        if os.path.exists(OUTPUT_CSV_FILE):
-            try:
-                final_df = pd.read_csv(OUTPUT_CSV_FILE)
-                    
-            except pd.errors.EmptyDataError:
-                print("Output CSV is empty, starting fresh.")
-            except pd.errors.ParserError:
-                print("Error parsing existing CSV. Starting fresh.")
-        else:
-            print("Output CSV not found!!! Creating one..")
-                
-        # Load checkpoint or initialize
-        if os.path.exists(CHECKPOINT_FILE):
-            with open(CHECKPOINT_FILE, "r") as f:
-                checkpoint = json.load(f)
-                processed_files = set(checkpoint.get("processed_files", []))
+        processed_count=0
+
+        store = CheckpointStore(CHECKPOINT_DB, job="extract")
+        if RERUN_IDS:
+            print(f"Re-running {store.reset(RERUN_IDS)} checkpointed reports.")
+        processed_files = store.done_keys()
+        if not processed_files:
+            print("No checkpoint found!!! Starting fresh..")
 
         # # Read GCS paths from the text file
         # with open(GCS_PATHS_LIST_FILE, "r") as f:
@@ -235,66 +262,47 @@ def main():
     
         # process_df = process_df.head(5)
 
-        # Process files in batches
-        with ThreadPoolExecutor(max_workers=20) as executor:
-            for i in range(0, len(process_df), BATCH_SIZE):
-                batch = process_df[i:i + BATCH_SIZE]
-                batch_df = pd.DataFrame()
-                newly_processed = set()
-                
-                futures = []
-                for _, row in batch.iterrows():
-                  if ((row["LinkID"] not in processed_files)):
-                      # print(batch)
-                      futures.append(executor.submit(process_file_future, row))
-                      
-                  else:
-                    if RERUN:
-                          
-                          final_df = final_df[final_df['LinkID'] != row["LinkID"]]
-                          processed_files.remove(row["LinkID"])
-                          # print(batch)
-                          futures.append(executor.submit(process_file_future, row))
-                      
-    
-                for future in as_completed(futures):
+        process_df = process_df[~process_df["LinkID"].isin(processed_files)]
+        pending_rows = (row for _, row in process_df.iterrows())
+
+        # Keep up to MAX_WORKERS requests in flight: as soon as one finishes the
+        # next report is submitted, so a slow query never holds up the others.
+        # Each result is checkpointed as it arrives; nothing is rewritten per batch.
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+
+            def submit_next():
+                row = next(pending_rows, None)
+                if row is None:
+                    return None
+                return executor.submit(process_file_future, row)
+
+            in_flight = {future for future in (submit_next() for _ in range(MAX_WORKERS)) if future}
+
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
                     result = future.result()
-                    
+
                     if result is not None:
-                        df, gcs_path_from_future = result
-                        batch_df = pd.concat([batch_df, df], ignore_index=True)
-                        newly_processed.add(gcs_path_from_future)
+                        response, link_id = result
+                        store.mark_done(link_id, response)
+                        processed_files.add(link_id)
+                        processed_count += 1
+                        if processed_count % PROGRESS_EVERY == 0:
+                            print(f"{processed_count} processed...")
                     else:
                         skip_count += 1
-                # for gcs_path in batch:
-                #     if gcs_path not in processed_files:
-                #         try:
-                #             if ".txt" in gcs_path:
-                #                 response = process_sql_from_gcs(gcs_path)
-                #                 if response:
-                #                     temp_df = pd.json_normalize(response, meta=['Purpose'])
-                #                     batch_df = pd.concat([batch_df, temp_df])
-                #                     newly_processed.add(gcs_path)
-                #         except Exception as e:
-                #             print(f"Error processing {gcs_path} in batch: {e}")
-                #     else:
-                #         skip_count+=1  
-                    
-
-                if not batch_df.empty: #only append if there are successful processes
-                    final_df = pd.concat([final_df, batch_df])
-                    processed_files.update(newly_processed)
-
-                # Update checkpoint after each batch (more frequent checkpoints)
-                checkpoint = {"processed_files": list(processed_files)}
-                with open(CHECKPOINT_FILE, "w") as f:
-                    json.dump(checkpoint, f)
-                final_df.to_csv(OUTPUT_CSV_FILE, index=False)
-
-
-                # print(f"Completed batch. Processed {len(processed_files)} files.")
+
+                    next_future = submit_next()
+                    if next_future:
+                        in_flight.add(next_future)
+
+        materialize_output_csv(store)
+        store.compact()
+        store.close()
 
         print(f"Processing complete. Total processed: {len(processed_files)} files. Skipped {skip_count} files ")
+        print(f"Gemini limiter: {gemini_limiter.snapshot()}")
 
 
     except Exception as e:
@@ -307,7 +315,6 @@ if __name__ == "__main__":
 
 import pandas as pd
 import ast
-from itertools import combinations
 import re
 
 mapping_df = pd.read_csv(MAPPING_FILE)
@@ -315,132 +322,104 @@ mapping_dict = dict(zip(mapping_df['Name'], mapping_df['CorrectedName']))
 df_tables = pd.read_csv("FullTableList.csv")
 table_names_in_df_tables = set(df_tables['TableName'].str.upper().tolist())
 
-def process_tables_with_columns(row):
-    try:
-        table_list = ast.literal_eval(str(row['TableNamesAllTables']))
-        results = []
-        for table_data in table_list:
-            if isinstance(table_data, dict) and 'Name' in table_data:
-                table_name = table_data['Name']
-                alias = table_data.get('Alias', 'NA').upper()  # Handle missing aliases
-                columns = table_data.get('Columns', [])  # Handle missing column lists
-
-                
-
-                # Process and map the table name
-                if "." in table_name:
-                    parts = table_name.split('.')
-                    schema = parts[0]
-                    table = parts[-1]
-                    if "@" in table:
-                        table = table.split("@")[0]
-                else:
-                    schema = ""
-                    table = table_name
-                mapped_table = mapping_dict.get(table, table)
-
-                # Append results with LinkID and columns
-                results.append({'LinkID': row['LinkID'], 'TableName': mapped_table, 'Columns': columns})
-        return results
-    except Exception as e:
-        print(f"Error processing tables and columns: {e}")
-        return []
-    
-def process_tables(tables, alias_to_name):
-    processed_tables = []
-    if isinstance(tables, list):
-        for _t in tables:
-            if _t:
-                # print("Processing: " + _t)
-                # Alias replacement happens here, before further processing
-                # print(alias_to_name)
-                for alias, name in alias_to_name.items():
-                    _t = re.sub(rf'\b{alias}\b', name, _t.upper()) #replaced '\b\b' with '\b{alias}\b'
-                    # print("Alias: "+_t)
-                if len(_t.split(' ')) == 2:
-                    _t = _t.split(' ')[0]
-                formatted_table_name = _t.upper()
-                if "." in formatted_table_name:
-                    parts = formatted_table_name.split('.')
-                    schema = parts[0]
-                    table = parts[-1]
-                    if "@" in table:
-                        table = table.split("@")[0]
-                else:
-                    schema = ""
-                    table = formatted_table_name
-                    for alias, name in alias_to_name.items():
-                        table = re.sub(rf'\b{alias}\b', name, table)
-
-                mapped_table = mapping_dict.get(table, table)
-                processed_tables.append((schema, mapped_table))
-
-        return (list(set(processed_tables))) 
-    else:
-        if tables:
-          parts = tables.split('.')
-          if len(parts) > 1: #check we have schema
-            schema = parts[0].upper()
-            for part in parts[1:]:
-              processed_tables.append((schema, part.upper()))
-          else:
-            processed_tables.append(("", parts[0].upper()))
-          return processed_tables
-        return []
-    
-# df_full = pd.read_csv("Extract0801.csv")
-df_full = pd.read_csv(OUTPUT_CSV_FILE)
-df = df_full.copy()
 
-def extract_table_names(row):
-  try:
-    table_list = ast.literal_eval(row)
-    return [d['Name'] for d in table_list if isinstance(d, dict) and 'Name' in d]
-  except Exception as e:
-    print(f"Error parsing table string - ")
-    return []
+def map_table_names(tables):
+    """Maps a Series of table names through mapping_dict, keeping unmapped names as they are."""
+    return tables.where(~tables.isin(mapping_dict.keys()), tables.map(mapping_dict))
+
 
+def split_schema_and_table(names):
+    """Splits a Series of SCHEMA.TABLE[@DBLINK] names into (schema, table) Series."""
+    has_schema = names.str.contains(".", regex=False)
+    parts = names.str.split(".")
+    schema = parts.str[0].where(has_schema, "")
+    table = parts.str[-1].str.split("@").str[0].where(has_schema, names)
+    return schema, table
 
-def extract_aliases(row):
+
+def parse_table_entries(value):
+    """Parses a TableNamesAllTables cell once into its list of table dicts."""
     try:
-        tables_alias_str = row
-        tables_alias = ast.literal_eval(tables_alias_str)
-        alias_to_name = {item['Alias'].upper(): item['Name'].upper() for item in tables_alias if 'Alias' in item and 'Name' in item}
-        return alias_to_name
+        table_list = ast.literal_eval(str(value))
     except Exception as e:
-      print(f"Error parsing alias string - ")
-      return {}
-    
-
-df['TableNamesList'] = df['TableNamesAllTables'].apply(extract_table_names)
-df['AliasToName'] = df['TableNamesAllTables'].apply(extract_aliases)
+        print(f"Error parsing table string - ")
+        return []
+    if not isinstance(table_list, list):
+        return []
+    return [d for d in table_list if isinstance(d, dict) and 'Name' in d]
 
 
+def build_alias_pattern(table_entries):
+    """Builds one compiled regex per report that replaces every table alias with its table name."""
+    alias_to_name = {
+        str(item['Alias']).upper(): str(item['Name']).upper()
+        for item in table_entries if 'Alias' in item
+    }
+    if not alias_to_name:
+        return None, alias_to_name
+    # Longest aliases first so that e.g. "AB" wins over "A" at the same position
+    aliases = sorted(alias_to_name, key=len, reverse=True)
+    pattern = re.compile(r'\b(?:' + '|'.join(re.escape(alias) for alias in aliases) + r')\b')
+    return pattern, alias_to_name
 
-df['TableNamesProcessed'] = df.apply(lambda row: process_tables(row['TableNamesList'], row['AliasToName']), axis=1)
 
+def resolve_aliases(table_name, pattern, alias_to_name):
+    """Replaces aliases in a single table name using the report's compiled alias pattern."""
+    table_name = str(table_name).upper()
+    if pattern is None:
+        return table_name
+    return pattern.sub(lambda m: alias_to_name[m.group(0)], table_name)
 
-df_exploded = df.explode('TableNamesProcessed')
-df_exploded[['SchemaName', 'TableName']] = pd.DataFrame(df_exploded['TableNamesProcessed'].tolist(), index=df_exploded.index)
 
+# df_full = pd.read_csv("Extract0801.csv")
+df_full = pd.read_csv(OUTPUT_CSV_FILE)
+df = df_full.copy()
 
-df_output = df_exploded[['LinkID', 'SchemaName', 'TableName']]
+# Parse every report's table list exactly once, then work on one flat frame with
+# a row per (report, table) instead of re-parsing per stage.
+df['TableEntries'] = df['TableNamesAllTables'].map(parse_table_entries)
+alias_patterns = df['TableEntries'].map(build_alias_pattern)
+
+entries = df[['LinkID', 'TableEntries']].assign(AliasPattern=alias_patterns).explode('TableEntries')
+entries = entries[entries['TableEntries'].notna()]
+entries['Name'] = entries['TableEntries'].map(lambda d: d['Name'])
+entries = entries[entries['Name'].astype(bool)]
+
+# --- Tables per report ---
+resolved_names = pd.Series(
+    [resolve_aliases(name, *alias) for name, alias in zip(entries['Name'], entries['AliasPattern'])],
+    index=entries.index,
+    dtype=object,
+)
+# "TABLE ALIAS" -> "TABLE"
+name_tokens = resolved_names.str.split(' ')
+resolved_names = resolved_names.where(name_tokens.str.len() != 2, name_tokens.str[0])
+
+schema_names, table_names = split_schema_and_table(resolved_names)
+
+df_output = pd.DataFrame({
+    'LinkID': entries['LinkID'],
+    'SchemaName': schema_names,
+    'TableName': map_table_names(table_names),
+})
+# Same (schema, table) listed twice in one report only counts once
+df_output = df_output.reset_index().drop_duplicates(subset=['index', 'SchemaName', 'TableName']).drop(columns='index')
 df_output = df_output[df_output["TableName"]!="UNKNOWN"]
 
-# df_output.loc[:, 'AlreadyInList'] = df_output['TableName'].apply(lambda x: "Yes" if x in table_names_in_df_tables else "No")
+# df_output.loc[:, 'AlreadyInList'] = df_output['TableName'].isin(table_names_in_df_tables).map({True: "Yes", False: "No"})
 
-# print(df_output[df_output["TableName"]!=""])
-    
 df_output.to_csv(OUTPUT_TABLE_LIST, index=False)
 
 print(f"Tables extracted and outputted to {OUTPUT_TABLE_LIST}")
 
-df['TableNamesAndColumns'] = df.apply(process_tables_with_columns, axis=1)
-df_exploded_columns = df.explode('TableNamesAndColumns')
-
-df_output_columns = pd.json_normalize(df_exploded_columns['TableNamesAndColumns'])
-# df_output_columns = pd.concat([df_exploded_columns[['LinkID']], df_output_columns], axis=1)
+# --- Tables and columns per report (raw names, no alias resolution) ---
+_, raw_table_names = split_schema_and_table(entries['Name'].astype(str))
 
+df_output_columns = pd.DataFrame({
+    'LinkID': entries['LinkID'],
+    'TableName': map_table_names(raw_table_names),
+    'Columns': entries['TableEntries'].map(lambda d: d.get('Columns', [])),
+})
 
 df_output_columns.to_csv(OUTPUT_COLUMNS_LIST, index=False)
 print(f"Table names and columns extracted and outputted to {OUTPUT_COLUMNS_LIST}")
@@ -452,7 +431,14 @@ print(f"Table names and columns extracted and outputted to {OUTPUT_COLUMNS_LIST}
 
 # df_output_yes = df_output[df_output['AlreadyInList'] == 'Yes']
 
-df_grouped = df_output[df_output['TableName'].notna()].groupby('LinkID')['TableName'].apply(lambda x: sorted(list(set(x)))).reset_index()
+df_grouped = (
+    df_output[df_output['TableName'].notna()]
+    .drop_duplicates(subset=['LinkID', 'TableName'])
+    .sort_values(['LinkID', 'TableName'])
+    .groupby('LinkID')['TableName']
+    .agg(list)
+    .reset_index()
+)
 df_grouped.rename(columns={'TableName': 'TableNames'}, inplace=True)
 
 df_grouped.to_csv(OUTPUT_TABLES_PER_REPORT, index=False)
@@ -460,8 +446,9 @@ print(f"Tables extracted and outputted to {OUTPUT_TABLES_PER_REPORT}")
 
 
 import pandas as pd
+import numpy as np
 import ast
-from pandas._typing import SequenceNotStr
+from functools import lru_cache
 
 try:
     columns_df = pd.read_csv(COLUMNS_ALL)
@@ -470,41 +457,12 @@ try:
     mapping_df = pd.read_csv(MAPPING_FILE)
     mapping_dict = dict(zip(mapping_df['Name'], mapping_df['CorrectedName']))
     table_per_id_df = pd.read_csv(OUTPUT_TABLES_PER_REPORT)
-    
-    df = pd.read_csv(OUTPUT_COLUMNS_LIST)
-    
-    def get_valid_column(column_name, valid_tables_str, columns_df):
-        try:
-            table_valid_list = ast.literal_eval(str(valid_tables_str[0]))
-        except Exception as e:
-            print("Error parsing the table list " + str(e))
-            table_valid_list = []
-        
-        if len(column_name.split('.'))==2:
-            column_name=column_name.split('.')[1]
-        for table in table_valid_list:
-          if f'{table}.{column_name}' in columns_set:
-             return f'{table}.{column_name}'
-        return None
 
-    def map_and_uppercase(table):
-        schema = ''
-        formatted_table_name = str(table).upper()
-        if "." in formatted_table_name:
-            table = formatted_table_name.rsplit(".", 1)[-1] #Correct rsplit usage
-            schema = formatted_table_name.split(".")[0]
-            if "@" in table:
-                table = table.split("@")[0]
-        elif "@" in str(table):
-                table = table.split("@")[0]
-        else:
-            table = formatted_table_name #Handle cases without "."
-        mapped_table = mapping_dict.get(table, table)
-        return mapped_table.upper() if isinstance(mapped_table, str) else mapped_table
+    df = pd.read_csv(OUTPUT_COLUMNS_LIST)
 
-    df[['TableName']] = df['TableName'].apply(lambda x: pd.Series(map_and_uppercase(x))) #Correct: Apply to 'table' column and create two new columns
-    
     #Improved error handling for ast.literal_eval
+    #Cached: the same literal (e.g. a report's table list) is parsed only once
+    @lru_cache(maxsize=None)
     def safe_literal_eval(x):
         try:
             return ast.literal_eval(x) if isinstance(x, str) and x.startswith('[') else []
@@ -513,29 +471,60 @@ try:
             print(f"Warning: Skipping invalid list literal: {x}")
             return []
 
-    df['Columns'] = df['Columns'].apply(safe_literal_eval)
+    # LinkID -> candidate tables, taken from the first row per LinkID
+    tables_by_link_id = {
+        link_id: safe_literal_eval(str(tables))
+        for link_id, tables in table_per_id_df.drop_duplicates(subset='LinkID').set_index('LinkID')['TableNames'].items()
+    }
+
+    def get_valid_column(link_id, column_name):
+        if len(column_name.split('.'))==2:
+            column_name=column_name.split('.')[1]
+        for table in tables_by_link_id.get(link_id, []):
+          if f'{table}.{column_name}' in columns_set:
+             return f'{table}.{column_name}'
+        return None
+
+    # Upper-case, strip schema and @DBLINK, then map to the corrected table name
+    table_raw = df['TableName'].astype(str)
+    table_upper = table_raw.str.upper()
+    table_name = np.where(
+        table_upper.str.contains(".", regex=False),
+        table_upper.str.rsplit(".", n=1).str[-1].str.split("@").str[0],
+        np.where(table_raw.str.contains("@", regex=False), table_raw.str.split("@").str[0], table_upper),
+    )
+    table_name = pd.Series(table_name, index=df.index, dtype=object)
+    df['TableName'] = table_name.where(~table_name.isin(mapping_dict.keys()), table_name.map(mapping_dict)).str.upper()
+
+    df['Columns'] = df['Columns'].map(safe_literal_eval)
     df = df.explode('Columns')
 
 
     #Handle potential None values more gracefully.
     # df = df.dropna(subset=['column_name'], how='all') #Only drop if ALL values are NaN.
     df['Columns'] = df['Columns'].astype(str).str.upper()
-    df['ValidColumn'] = df.apply(lambda x: "Yes" if f"{x['TableName']}.{x['Columns']}" in columns_set else "No", axis=1)
+    is_valid = (df['TableName'] + "." + df['Columns']).isin(columns_set)
+    df['ValidColumn'] = np.where(is_valid, "Yes", "No")
 
     df = df.drop_duplicates().reset_index(drop=True) # Correct column selection
     no_valid_rows = df[df['ValidColumn'] == 'No']
-   
-    v_count=0
-    for index, row in no_valid_rows.iterrows():
-        link_id = row['LinkID'] 
-        valid_tables = table_per_id_df[table_per_id_df['LinkID'] == link_id]['TableNames']
-        corrected_column = get_valid_column(row['Columns'], valid_tables.values, columns_df)
-        if corrected_column:
-            v_count+=1
-            df.loc[index,"TableName"] = corrected_column.split('.')[0]
-            df.loc[index, 'Columns'] = corrected_column.split('.')[1]
-            df.loc[index, 'ValidColumn'] = "Yes"    
-            
+
+    # Look each (LinkID, column) pair up once, however many rows share it
+    corrections = {
+        key: get_valid_column(*key)
+        for key in set(zip(no_valid_rows['LinkID'], no_valid_rows['Columns']))
+    }
+    corrected_column = pd.Series(
+        [corrections[key] for key in zip(no_valid_rows['LinkID'], no_valid_rows['Columns'])],
+        index=no_valid_rows.index,
+        dtype=object,
+    ).dropna()
+
+    v_count = len(corrected_column)
+    df.loc[corrected_column.index, 'TableName'] = corrected_column.str.split('.').str[0]
+    df.loc[corrected_column.index, 'Columns'] = corrected_column.str.split('.').str[1]
+    df.loc[corrected_column.index, 'ValidColumn'] = "Yes"
+
     print(f"Updated {v_count} invalid columns as Valid through lazy selection")
     df = df.drop_duplicates().reset_index(drop=True)
     print(len(df))
@@ -551,21 +540,22 @@ except Exception as e:
     print(f"An unexpected error occurred: {e}")
 
 
-from __future__ import annotations
 import json, pandas as pd, os
-import time
-import vertexai
-from vertexai.language_models import TextEmbeddingInput, TextEmbeddingModel
-from vertexai.generative_models import GenerativeModel, Part, SafetySetting
+from agents.shared_libraries.model_registry import get_text_embedding_model
+from agents.shared_libraries.vector_index import VectorIndex
+from agents.shared_libraries.embedding_store import EmbeddingStore
+from google.cloud import bigquery
+from vertexai.language_models import TextEmbeddingInput
 
 PROJECT_ID = "prj-cams-playground-vertexai"
 LOCATION_ID = "asia-south1"
 
-EMBEDDING_FILE = 'cols_embeddings.json'
-CHECKPOINT_FILE = f'checkpoint_{EMBEDDING_FILE}'
+EMBEDDING_FILE = 'cols_embeddings.json'  # Legacy JSON output; only read to seed a new EMBEDDING_STORE_DIR
+EMBEDDING_STORE_DIR = 'cols_embeddings'  # Binary float32 vectors + keys per TABLE.COLUMN, appended per batch
+EMBEDDING_DIM = 768
+BQ_EMBEDDINGS_TABLE = ""  # e.g. "project.dataset.column_embeddings"; left empty, nothing is loaded to BigQuery
 SIMILARITY_MATRIX_FILE = 'TableColumnsSimilarityMatrix.csv'
-
-processed_files = set()
+COLUMN_INDEX_DIR = 'cols_embeddings_index'  # ANN index over column embeddings for ad-hoc "similar column" lookups
 
 safety_settings = [
     SafetySetting(
@@ -587,171 +577,252 @@ safety_settings = [
 ]
 
 
-if os.path.exists(CHECKPOINT_FILE):
-    with open(CHECKPOINT_FILE, "r") as f:
-        checkpoint = json.load(f)
-        processed_files = set(checkpoint.get("processed_files", []))
-else:
-    processed_files = set()
+embedding_store = EmbeddingStore(EMBEDDING_STORE_DIR, dim=EMBEDDING_DIM)
 
-try:
-    with open(EMBEDDING_FILE, 'r') as f:
-        embeddings_dict = json.load(f)
-except (FileNotFoundError, json.JSONDecodeError):
-    embeddings_dict = {}
+# Seed a new store from embeddings saved as JSON by earlier runs
+if not len(embedding_store):
+    try:
+        with open(EMBEDDING_FILE, 'r') as f:
+            legacy_embeddings = json.load(f)
+        if legacy_embeddings:
+            embedding_store.append(list(legacy_embeddings), list(legacy_embeddings.values()))
+        del legacy_embeddings
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+processed_files = set(embedding_store.keys())
+
+
+EMBEDDING_MODEL = "text-embedding-005"
+EMBEDDING_BATCH_SIZE = 250  # Max instances per text-embedding-005 request
+EMBEDDING_MAX_WORKERS = 8
 
 
 def embed_text(texts) -> list[list[float]]:
-    dimensionality = 768
+    dimensionality = EMBEDDING_DIM
     task = "SEMANTIC_SIMILARITY"
-    model = TextEmbeddingModel.from_pretrained("text-embedding-005")
+    model = get_text_embedding_model(EMBEDDING_MODEL, project=PROJECT_ID, location=LOCATION_ID)
     inputs = [TextEmbeddingInput(text, task) for text in texts]
     kwargs = dict(output_dimensionality=dimensionality) if dimensionality else {}
     embeddings = model.get_embeddings(inputs, **kwargs)
     return [embedding.values for embedding in embeddings]
 
 
-df_full = pd.read_csv(COLUMNS_ALL)
-df = df_full.head(1000)
-
-_c = 0
-
-for i, _row in df.iterrows():
-    table_name = _row['TableNameDB']
-    column_name = _row['ColumnNameDB']
-
-    # Create a composite key (e.g., "TABLE_NAME.COLUMN_NAME")
-    composite_key = f"{table_name}.{column_name}"
-
-    if composite_key in processed_files:
-        _c += 1
-        continue
-
-    _text = f'''
-    Column Name: {column_name}
-    Table Name : {table_name}
-    '''
-    # print(_text)
-
+def embed_batch(texts):
+    """Embeds one batch of texts under the shared limiter; returns (texts, embeddings or None)."""
     try:
-        time.sleep(2)
-        embedding = embed_text([_row['ColumnNameDB']]) # Pass in the contextually rich text
-       
-        if embedding:
-            embeddings_dict[composite_key] = embedding[0]
-            processed_files.add(composite_key)
-        else:
-            print(f"Warning: Embedding generation failed for {composite_key} in table {table_name}")
+        # Backs off on quota errors instead of sleeping before every request
+        return texts, embedding_limiter.call(embed_text, texts)
     except Exception as e:
-        print(f"Error processing row {composite_key}: {e}")
+        print(f"Error embedding batch starting with {texts[0]!r}: {e}")
+        return texts, None
 
-    _c += 1
-    if _c % 20 == 0:
+
+embedding_limiter = get_limiter("text-embedding", max_limit=EMBEDDING_MAX_WORKERS)
+
+df_full = pd.read_csv(COLUMNS_ALL)
+df = df_full
+
+# Create a composite key (e.g., "TABLE_NAME.COLUMN_NAME") per column
+df = df.assign(CompositeKey=df['TableNameDB'].astype(str) + "." + df['ColumnNameDB'].astype(str))
+_c = int(df['CompositeKey'].isin(processed_files).sum())
+pending_df = df[~df['CompositeKey'].isin(processed_files)]
+
+# Many tables share column names: embed each distinct text once and fan the
+# vector out to every TABLE.COLUMN key that uses it.
+# (Only the column name is embedded, not a "Column Name / Table Name" text.)
+keys_by_text = pending_df.groupby(pending_df['ColumnNameDB'].astype(str))['CompositeKey'].agg(list).to_dict()
+unique_texts = list(keys_by_text)
+batches = [unique_texts[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(unique_texts), EMBEDDING_BATCH_SIZE)]
+print(f"{len(pending_df)} columns to embed as {len(unique_texts)} distinct texts in {len(batches)} requests")
+
+with ThreadPoolExecutor(max_workers=EMBEDDING_MAX_WORKERS) as executor:
+    for texts, embeddings in executor.map(embed_batch, batches):
+        if not embeddings or len(embeddings) != len(texts):
+            print(f"Warning: Embedding generation failed for {len(texts)} texts")
+            continue
+        batch_keys, batch_vectors = [], []
+        for text, embedding in zip(texts, embeddings):
+            for composite_key in keys_by_text[text]:
+                batch_keys.append(composite_key)
+                batch_vectors.append(embedding)
+        embedding_store.append(batch_keys, batch_vectors)
+        for text in texts:
+            processed_files.update(keys_by_text[text])
+            _c += len(keys_by_text[text])
         print(str(_c) + " Processed...")
-        with open(CHECKPOINT_FILE, "w") as f:
-            json.dump({"processed_files": list(processed_files)}, f)
-        with open(EMBEDDING_FILE, 'w') as file:
-            json.dump(embeddings_dict, file, indent=4)
 
 print(str(_c) + " Processed...")
-with open(CHECKPOINT_FILE, "w") as f:
-    json.dump({"processed_files": list(processed_files)}, f)
 
-with open(EMBEDDING_FILE, 'w') as file:
-    json.dump(embeddings_dict, file, indent=4)
+# Add newly embedded columns to the persistent ANN index
+column_index = VectorIndex.load_or_create(COLUMN_INDEX_DIR, dim=EMBEDDING_DIM)
+store_keys, store_vectors = embedding_store.load()
+new_rows = [row for row, key in enumerate(store_keys) if key not in column_index]
+if new_rows:
+    column_index.add([store_keys[row] for row in new_rows], store_vectors[new_rows])
+    column_index.save(COLUMN_INDEX_DIR)
+print(f"Column index at {COLUMN_INDEX_DIR} holds {len(column_index)} columns")
+# e.g. column_index.search_by_key("TABLE_NAME.COLUMN_NAME", k=10)
 
-print(str(_c) + f" Embeddings saved to {EMBEDDING_FILE}")
+# One Parquet load job for every embedding instead of per-row inserts
+if BQ_EMBEDDINGS_TABLE:
+    embedding_store.load_to_bigquery(
+        bigquery.Client(project=PROJECT_ID), BQ_EMBEDDINGS_TABLE,
+        key_column="table_column", vector_column="embedding",
+    )
+    print(f"Loaded {len(embedding_store)} embeddings into {BQ_EMBEDDINGS_TABLE}")
+
+print(str(_c) + f" Embeddings saved to {EMBEDDING_STORE_DIR}")
+print(f"Embedding limiter: {embedding_limiter.snapshot()}")
 
 
 
 import numpy as np
-import csv
+import argparse
 import pandas as pd
-import json
-
-def cosine_similarity(a, b):
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
-
-try:
-    with open(EMBEDDING_FILE, 'r') as f:
-        embeddings_dict = json.load(f)
-except (FileNotFoundError, json.JSONDecodeError) as e:
-    print(f"Error loading embeddings: {e}")
-    embeddings_dict = {}
-
-if embeddings_dict:
-    link_ids = list(embeddings_dict.keys())
-    num_links = len(link_ids)
-
-    # Calculate similarity matrix only once
-    table_dict = {link_id: link_id.split(".")[0] for link_id in link_ids}
-    
-    similarity_matrix = np.zeros((num_links, num_links))
-    # for i, link_id1 in enumerate(link_ids):
-    #     embedding1 = np.array(embeddings_dict[link_id1])
-    #     for j, link_id2 in enumerate(link_ids):
-    #         embedding2 = np.array(embeddings_dict[link_id2])
-    #         similarity_matrix[i, j] = cosine_similarity(embedding1, embedding2)
-    
-    similarity_matrix = np.zeros((num_links, num_links))
-    for i, link_id1 in enumerate(link_ids):
-      print(table1)
-      table1 = table_dict[link_id1]
-      embedding1 = np.array(embeddings_dict[link_id1])
-      for j, link_id2 in enumerate(link_ids):
-        table2 = table_dict[link_id2]
-        if table1 and table2 and table1 != table2: # Only compare if tables are different and valid table name exist
-          embedding2 = np.array(embeddings_dict[link_id2])
-          similarity_matrix[i, j] = cosine_similarity(embedding1, embedding2)
-        else:
-          similarity_matrix[i, j] = -1
-
-    # Get similarity threshold from the user
-    while True:
-        try:
-            similarity_threshold = float(input("Enter the similarity threshold (between 0 and 1): "))
-            if 0 <= similarity_threshold <= 1:
-                break
+import pyarrow as pa
+import pyarrow.parquet as pq
+from agents.shared_libraries.embedding_store import EmbeddingStore
+
+SIMILARITY_TOP_K = 50  # Neighbours kept per column; bounds memory at O(N * k)
+SIMILARITY_BLOCK_SIZE = 1024  # Rows per matrix-multiply block; bounds scratch memory at O(block * N)
+SIMILARITY_THRESHOLDS = [0.8, 0.85, 0.9]  # Defaults for --thresholds
+SIMILARITY_OUTPUT_FORMAT = "csv"  # Default for --format ("csv" or "parquet")
+OUTPUT_CHUNK_ROWS = 5000  # Source columns written per chunk
+
+
+def normalize_rows(matrix):
+    """Scales each row to unit length so a dot product is the cosine similarity."""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def neighbour_rows(start, end, threshold, neighbour_idx, neighbour_sim, tables, columns):
+    """Builds the output rows for source columns [start, end): one row per similar column at or
+    above the threshold, or a single row with empty similar table/column if none qualify."""
+    idx = neighbour_idx[start:end]
+    sim = neighbour_sim[start:end]
+    has_neighbour = (idx >= 0) & (sim >= threshold)
+    source_idx = start + np.nonzero(has_neighbour)[0]
+    target_idx = idx[has_neighbour]
+    lonely_idx = start + np.nonzero(~has_neighbour.any(axis=1))[0]
+
+    no_match = np.full(len(lonely_idx), None, dtype=object)
+    rows = pd.DataFrame({
+        'Order': np.concatenate([source_idx, lonely_idx]),
+        'TableName': tables[np.concatenate([source_idx, lonely_idx])],
+        'ColumnName': columns[np.concatenate([source_idx, lonely_idx])],
+        'SimilarTable': np.concatenate([tables[target_idx], no_match]),
+        'SimilarColumn': np.concatenate([columns[target_idx], no_match]),
+        'Similarity': np.concatenate([sim[has_neighbour], np.full(len(lonely_idx), np.nan, dtype=np.float32)]),
+    })
+    return rows.sort_values('Order', kind="stable").drop(columns='Order')
+
+
+def write_neighbours(output_filename, output_format, threshold, neighbour_idx, neighbour_sim, tables, columns):
+    """Streams the neighbour rows for one threshold to CSV or Parquet, OUTPUT_CHUNK_ROWS source columns at a time."""
+    writer = None
+    try:
+        for start in range(0, max(len(neighbour_idx), 1), OUTPUT_CHUNK_ROWS):
+            chunk = neighbour_rows(
+                start, min(start + OUTPUT_CHUNK_ROWS, len(neighbour_idx)), threshold,
+                neighbour_idx, neighbour_sim, tables, columns,
+            )
+            if output_format == "parquet":
+                table = pa.Table.from_pandas(chunk.astype({'SimilarTable': 'string', 'SimilarColumn': 'string'}), preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(output_filename, table.schema)
+                writer.write_table(table)
             else:
-                print("Threshold must be between 0 and 1.")
-        except ValueError:
-            print("Invalid input. Please enter a number.")
-
-
-    #Find nearest neighbors based on threshold
-    results = []
-    for i, link_id in enumerate(link_ids):
-        similar_links = []
-        for j, similarity in enumerate(similarity_matrix[i]):
-            if i != j and similarity >= similarity_threshold:  #Exclude self-similarity
-                similar_links.append(link_ids[j])
-        results.append({"LinkID": link_id, "SimilarLinks": similar_links})
-
-    # Output to CSV
-    df = pd.DataFrame(results)
-    rows = []
-    for _, row in df.iterrows():
-        link_table, link_column = row['LinkID'].split('.')
-        # print(row['SimilarLinks'])
-        similar_links = eval(str(row['SimilarLinks']))  # Safely evaluate the string representation of the list
-
-        if similar_links:  # Check if similar_links is not empty
-            for similar_link in similar_links:
-                similar_table, similar_column = similar_link.split('.')
-                rows.append([link_table, link_column, similar_table, similar_column])
-        else:
-             rows.append([link_table, link_column, None, None])  # Handle empty SimilarLinks
-
-
-    s_df = pd.DataFrame(rows, columns=['TableName', 'ColumnName', 'SimilarTable', 'SimilarColumn'])
-
+                chunk.to_csv(output_filename, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+similarity_arg_parser = argparse.ArgumentParser(description="Find similar columns across tables from their embeddings.")
+similarity_arg_parser.add_argument(
+    "--thresholds", type=float, nargs="+", default=SIMILARITY_THRESHOLDS,
+    help="Similarity thresholds (0-1); one output file is written per threshold.",
+)
+similarity_arg_parser.add_argument(
+    "--top-k", type=int, default=SIMILARITY_TOP_K,
+    help="Maximum number of similar columns kept per column.",
+)
+similarity_arg_parser.add_argument(
+    "--format", choices=["csv", "parquet"], default=SIMILARITY_OUTPUT_FORMAT,
+    help="Output file format.",
+)
+
+
+def top_k_neighbours(matrix, table_codes, k, threshold, block_size=SIMILARITY_BLOCK_SIZE):
+    """Finds each row's k most similar rows from other tables with similarity >= threshold.
+
+    `matrix` must be row-normalized. Rows with a negative table code (no table name)
+    are never matched. Returns (indices, similarities), both (N, k) and sorted by
+    descending similarity, with index -1 where fewer than k neighbours qualify.
+    """
+    n = len(matrix)
+    k = max(0, min(k, n - 1))
+    neighbour_idx = np.full((n, k), -1, dtype=np.int64)
+    neighbour_sim = np.full((n, k), np.nan, dtype=np.float32)
+    if k == 0:
+        return neighbour_idx, neighbour_sim
+
+    valid_target = table_codes >= 0
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        sims = matrix[start:end] @ matrix.T
+        block_codes = table_codes[start:end, None]
+        # Same-table pairs (including self) and pairs without a table name never match
+        excluded = (block_codes == table_codes[None, :]) | (block_codes < 0) | ~valid_target[None, :]
+        sims[excluded] = -np.inf
+
+        part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        part_sims = np.take_along_axis(sims, part, axis=1)
+        order = np.argsort(-part_sims, axis=1, kind="stable")
+        part = np.take_along_axis(part, order, axis=1)
+        part_sims = np.take_along_axis(part_sims, order, axis=1)
+
+        keep = part_sims >= threshold
+        neighbour_idx[start:end] = np.where(keep, part, -1)
+        neighbour_sim[start:end] = np.where(keep, part_sims, np.nan)
+    return neighbour_idx, neighbour_sim
+
+
+# Memory-mapped straight from disk, no JSON parsing
+link_ids, stored_vectors = EmbeddingStore(EMBEDDING_STORE_DIR, dim=EMBEDDING_DIM).load()
+
+if link_ids:
+    num_links = len(link_ids)
 
-    output_filename = f"NearestNeighbours_{similarity_threshold*100}_percent.csv"
-    s_df.to_csv(output_filename, index=False)
-    print(f"Nearest neighbors saved to {output_filename}")
+    # One normalized float32 matrix instead of re-creating arrays per pair
+    embedding_matrix = normalize_rows(np.asarray(stored_vectors, dtype=np.float32))
+    link_parts = pd.Series(link_ids).str.split(".", n=1)
+    link_tables = link_parts.str[0]
+    link_columns = link_parts.str[1]
+    table_codes, _ = pd.factorize(link_tables)
+    table_codes = np.where(link_tables.fillna("") == "", -1, table_codes)
+
+    args, _ = similarity_arg_parser.parse_known_args()
+    thresholds = sorted(set(args.thresholds))
+    if any(not 0 <= threshold <= 1 for threshold in thresholds):
+        raise ValueError(f"Thresholds must be between 0 and 1, got {thresholds}")
+
+    # One neighbour search at the loosest threshold; every stricter threshold is a
+    # filter over the same (similarity-sorted) neighbour lists.
+    neighbour_idx, neighbour_sim = top_k_neighbours(
+        embedding_matrix, table_codes, args.top_k, thresholds[0]
+    )
+
+    for similarity_threshold in thresholds:
+        output_filename = f"NearestNeighbours_{similarity_threshold*100}_percent.{args.format}"
+        write_neighbours(
+            output_filename, args.format, similarity_threshold,
+            neighbour_idx, neighbour_sim, link_tables.values, link_columns.values,
+        )
+        print(f"Nearest neighbors saved to {output_filename}")
 
 else:
-    print(f"No embeddings loaded. Please check your {EMBEDDING_FILE}")
-
-
-    
\ No newline at end of file
+    print(f"No embeddings loaded. Please check your {EMBEDDING_STORE_DIR}")
@@ -75,6 +75,20 @@ class Settings(BaseSettings):
     # SERVICE_ACCOUNT: str = Field(..., env="SERVICE_ACCOUNT")
     RAW_SQL_EXTRACTS_DATASET: str = Field("gdm", env="RAW_SQL_EXTRACTS_DATASET")
     RAW_SQL_EXTRACTS_TABLE: str = Field("raw_sql_extracts", env="RAW_SQL_EXTRACTS_TABLE")
+    ENTITIES_DATASET: str = Field("gdm", env="ENTITIES_DATASET")
+    ENTITIES_TABLE: str = Field("entities", env="ENTITIES_TABLE")
+    ENTITY_INDEX_DIR: str = Field("entity_index", env="ENTITY_INDEX_DIR")
+    GUIDELINES_DATASET: str = Field("gdm", env="GUIDELINES_DATASET")
+    GUIDELINES_TABLE: str = Field("guidelines", env="GUIDELINES_TABLE")
+    REVIEW_CACHE_PATH: str = Field("review_cache.db", env="REVIEW_CACHE_PATH")
+    REVIEW_CACHE_MAX_ENTRIES: int = Field(1000, env="REVIEW_CACHE_MAX_ENTRIES")
+    REVIEW_CACHE_TTL_SECONDS: int = Field(7 * 24 * 3600, env="REVIEW_CACHE_TTL_SECONDS")
+    # Per-entity results, so a resubmitted model only re-reviews the entities that changed
+    ENTITY_REVIEW_CACHE_PATH: str = Field("entity_review_cache.db", env="ENTITY_REVIEW_CACHE_PATH")
+    ENTITY_REVIEW_CACHE_MAX_ENTRIES: int = Field(20000, env="ENTITY_REVIEW_CACHE_MAX_ENTRIES")
+    # Models with at least this many entities are reviewed entity by entity (map-reduce)
+    DTM_MAP_REDUCE_MIN_ENTITIES: int = Field(15, env="DTM_MAP_REDUCE_MIN_ENTITIES")
+    DTM_REVIEW_MAX_CONCURRENCY: int = Field(8, env="DTM_REVIEW_MAX_CONCURRENCY")
 
     # RAW_DATA_BUCKET: str = Field(..., env="RAW_DATA_BUCKET")
     # DOCUMENTS_FOLDER: str = Field(..., env="DOCUMENTS_FOLDER")
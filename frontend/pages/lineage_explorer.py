@@ -14,6 +14,7 @@ from utils.bq_utils import (
     get_tables_for_qid,
     get_recursive_lineage_for_tables,
     get_detailed_lineage_for_tables,
+    estimate_lineage_cost,
 )
 
 st.set_page_config(layout="wide")
@@ -138,7 +139,6 @@ if extracts_df.empty:
     st.stop()
 
 files_df = extracts_df.copy()
-files_df["dependencies"] = files_df["dependencies"].apply(lambda x: ", ".join(x) if isinstance(x, list) else x)
 files_df["Select"] = False
 
 # Display the files in a table with checkboxes
@@ -244,9 +244,39 @@ if st.session_state.get('show_tables', False):
             ]].to_dict('records')
 
             selected_qids = st.session_state.get("selected_qids", [])
+
+            # Pre-flight check: estimate bytes scanned and recursion fan-out before
+            # running the full trace, and fall back to a depth-limited trace when
+            # the selection is too expensive.
+            max_depth = None
+            estimate = estimate_lineage_cost(
+                selected_target_tables_list, selected_qids, st.session_state.lineage_estimate_depth
+            )
+            if estimate:
+                gib_processed = estimate["bytes_processed"] / 1024**3
+                summary = (
+                    f"~{gib_processed:.2f} GiB scanned, {estimate['anchor_count']:,} starting columns, "
+                    f"fan-out {estimate['fan_out']} (~{estimate['estimated_rows']:,} trace rows)"
+                )
+                if (
+                    estimate["bytes_processed"] > st.session_state.lineage_max_bytes
+                    or estimate["estimated_rows"] > st.session_state.lineage_max_rows
+                ):
+                    max_depth = st.session_state.lineage_fallback_depth
+                    st.error(
+                        f"This lineage trace is too expensive to run in full ({summary}). "
+                        f"Showing lineage up to {max_depth} hops only. "
+                        "Select fewer tables or files to trace the complete lineage."
+                    )
+                elif (
+                    estimate["bytes_processed"] > st.session_state.lineage_warn_bytes
+                    or estimate["estimated_rows"] > st.session_state.lineage_warn_rows
+                ):
+                    st.warning(f"This lineage trace may be slow ({summary}). Consider selecting fewer tables or files.")
+
             # Get column lineage for selected statements
-            lineage_trace_df = get_recursive_lineage_for_tables(selected_target_tables_list, selected_qids)
-            detailed_lineage_df = get_detailed_lineage_for_tables(selected_target_tables_list, selected_qids)
+            lineage_trace_df = get_recursive_lineage_for_tables(selected_target_tables_list, selected_qids, max_depth)
+            detailed_lineage_df = get_detailed_lineage_for_tables(selected_target_tables_list, selected_qids, max_depth)
 
             if not lineage_trace_df.empty:
                 st.header("End-to-End Column Lineage")
@@ -275,14 +305,12 @@ if st.session_state.get('show_tables', False):
                 if 'q_id' in display_df.columns:
                     display_df = display_df.drop(columns=['q_id'])
 
-                # Convert unhashable columns to string before dropping duplicates
-                if 'full_path_hops' in display_df.columns:
-                    # The 'full_path_hops' column contains lists of dictionaries, which are not hashable.
-                    # We convert it to a string representation to allow for deduplication.
-                    display_df['full_path_hops'] = display_df['full_path_hops'].apply(str)
-
-                # Remove duplicate rows from the DataFrame
-                display_df.drop_duplicates(inplace=True)
+                # Remove duplicate rows from the DataFrame. The nested 'full_path_hops'
+                # column stays Arrow-backed; 'path_fingerprint' identifies it for deduplication.
+                dedupe_cols = [col for col in display_df.columns if col != 'full_path_hops']
+                display_df = display_df.drop_duplicates(subset=dedupe_cols)
+                if 'path_fingerprint' in display_df.columns:
+                    display_df = display_df.drop(columns=['path_fingerprint'])
 
                 # Sort the data for better readability
                 display_df = display_df.sort_values(by=["final_target_table", "final_target_column"])
@@ -310,6 +338,13 @@ if st.session_state.get('show_tables', False):
                     st.subheader("Detailed Lineage Table")
                     
                     if not display_df.empty:
+                        if "truncated" in display_df.columns and display_df["truncated"].fillna(False).astype(bool).any():
+                            truncated_count = int(display_df["truncated"].fillna(False).astype(bool).sum())
+                            st.warning(
+                                f"{truncated_count} paths were cut off at {max_depth} hops and continue further upstream "
+                                "(marked in the 'Truncated' column and in the CSV download)."
+                            )
+
                         # Define columns to display
                         cols_to_display = [
                             
@@ -324,6 +359,7 @@ if st.session_state.get('show_tables', False):
                             "inferred_logic_detail",                         
                             "file_name",
                             "max_depth",
+                            "truncated",
                         ]
                         
                         # Create a list of columns that exist in the dataframe
@@ -342,6 +378,7 @@ if st.session_state.get('show_tables', False):
                             "inferred_logic_detail": "Inferred Logic",                            
                             "file_name": "File Name",
                             "max_depth": "Depth",
+                            "truncated": "Truncated",
                         }
                         
                         # Rename the columns that exist
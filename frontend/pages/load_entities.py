@@ -4,9 +4,16 @@ from utils.init import init_session_state
 init_session_state()
 import xml.etree.ElementTree as ET
 import logging
+import os
 import re
-from utils.bq_utils import insert_entity_to_bq
-from utils.vertexai_utils import generate_embedding
+import pandas as pd
+from utils.bq_utils import insert_entity_to_bq, bulk_upsert_entities
+from utils.entity_loader import iter_entities, iter_entities_from_directory
+from utils.vertexai_utils import generate_embedding, generate_embeddings_concurrently
+
+# Entities embedded per progress update; each batch is embedded concurrently
+EMBEDDING_BATCH_SIZE = 64
+EMBEDDING_MAX_WORKERS = 8
 
 
 def main():
@@ -15,13 +22,21 @@ def main():
 
     st.markdown(
         """
-        Paste an XML block from an ER Studio data model export below.
+        Paste an XML block from an ER Studio data model export, or bulk load a full export.
         The tool will extract the `complexType` name, generate an embedding for the XML content,
         and load it into a BigQuery table for further analysis and similarity search.
         The target table is `gdm.entities` and will be created if it doesn't exist.
         """
     )
 
+    single_tab, bulk_tab = st.tabs(["Paste XML Block", "Bulk Load Export"])
+    with single_tab:
+        load_single_entity()
+    with bulk_tab:
+        load_entities_in_bulk()
+
+
+def load_single_entity():
     xml_input = st.text_area("Paste XML Block Here", height=400, key="xml_input_entity")
 
     if st.button("Load Entity to BigQuery", type="primary", use_container_width=True):
@@ -85,5 +100,88 @@ def main():
                 logging.error(f"Error in load_entities: {e}", exc_info=True)
 
 
+def _stream_uploaded_entities(uploaded_files):
+    for uploaded_file in uploaded_files:
+        for entity in iter_entities(uploaded_file):
+            yield uploaded_file.name, entity
+
+
+def _embed_batch(batch, failed):
+    """Embeds a batch of (file name, entity) concurrently; entities without an embedding are recorded in `failed`."""
+    if not batch:
+        return []
+    embeddings, errors = generate_embeddings_concurrently(
+        [entity.xml_block for _, entity in batch], max_workers=EMBEDDING_MAX_WORKERS
+    )
+    rows = []
+    for index, ((file_name, entity), embedding) in enumerate(zip(batch, embeddings)):
+        if index in errors:
+            failed.append({"Entity": entity.name, "File": file_name, "Error": errors[index]})
+        else:
+            rows.append({"complex_type_name": entity.name, "xml_block": entity.xml_block, "embedding": list(embedding)})
+    return rows
+
+
+def load_entities_in_bulk():
+    """Loads every entity of one or more full ER Studio XML exports.
+
+    The exports are streamed and split into entities, embedded in concurrent
+    batches and upserted with a single staged load and MERGE.
+    """
+    uploaded_files = st.file_uploader("Upload XML export files", type="xml", accept_multiple_files=True, key="bulk_entity_files")
+    directory = st.text_input("...or load every .xml file in a directory", key="bulk_entity_directory")
+
+    if not st.button("Bulk Load Entities to BigQuery", type="primary", use_container_width=True):
+        return
+    if not uploaded_files and not directory:
+        st.warning("Please upload an XML export or enter a directory.")
+        return
+    if not uploaded_files and not os.path.isdir(directory):
+        st.error(f"Directory not found: {directory}")
+        return
+
+    sources = _stream_uploaded_entities(uploaded_files) if uploaded_files else iter_entities_from_directory(directory)
+    rows = []
+    failed = []
+    status_text = st.empty()
+
+    try:
+        batch = []
+        for file_name, entity in sources:
+            batch.append((file_name, entity))
+            if len(batch) == EMBEDDING_BATCH_SIZE:
+                rows.extend(_embed_batch(batch, failed))
+                batch = []
+                status_text.text(f"Embedded {len(rows)} entities (reading {file_name})...")
+        rows.extend(_embed_batch(batch, failed))
+    except ET.ParseError as e:
+        st.error(f"Invalid XML format in the export. Error: {e}")
+        return
+
+    if failed:
+        st.error(f"Could not generate embeddings for {len(failed)} entities; they were NOT loaded. Re-run the load for these entities:")
+        st.dataframe(pd.DataFrame(failed), use_container_width=True, hide_index=True)
+    if not rows:
+        if not failed:
+            st.error("No `<complexType>` entities were found in the export.")
+        return
+
+    status_text.text(f"Loading {len(rows)} entities into BigQuery...")
+    project_id = st.session_state.get("project_id", "r2d2-00")
+    affected_rows = bulk_upsert_entities(
+        project_id=project_id,
+        dataset_id="gdm",
+        table_name="entities",
+        entities=pd.DataFrame(rows),
+    )
+    status_text.empty()
+    if affected_rows is not None:
+        message = f"Loaded {len(rows)} entities ({affected_rows} inserted or updated) into BigQuery."
+        if failed:
+            st.warning(message + f" {len(failed)} entities failed (listed above).")
+        else:
+            st.success(message)
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
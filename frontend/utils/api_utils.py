@@ -250,16 +250,15 @@ def generate_config(prompt: str, base64_data,gcs_uri, retry_delay=1):
                 print(f"API returned a structured error: {result.error}")
                 return {"section_name": "API Error", "response_text": str(result.error)}
 
-            # Internally validate if the response content is parsable JSON
+            # Only transport errors are retried: re-posting the whole request does
+            # not fix a malformed response, and it multiplies the latency
             try:
                 json.loads(result.response)
                 return result.response 
             except json.JSONDecodeError:
-                print(f"Response is not parsable JSON on attempt {attempt + 1}.")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
+                print("Response is not parsable JSON.")
+                return None
 
-        
         except requests.exceptions.RequestException as e:
             print(f"Request failed on attempt {attempt + 1}: {e}")
             if attempt < max_retries - 1:
@@ -275,7 +274,9 @@ def generate_dtm_review(xml_content: str, retry_delay=1):
     user_id = "dtm_review_user"
     max_retries = 3
 
-    _create_session_api(app_name, user_id, session_id)
+    # A fresh session per review keeps each run's events separate; the error is already shown
+    if not _create_session_api(app_name, user_id, session_id):
+        return None
     request_body = ChatRequest(
         text=xml_content,
         user_id=user_id,
@@ -296,21 +297,28 @@ def generate_dtm_review(xml_content: str, retry_delay=1):
                 st.error(f"API returned an error: {result.error}")
                 return None
             
-            # The response should be a JSON string.
+            # The response should be a JSON string. The backend already validates
+            # and repairs it, so only transport errors below are retried.
             try:
                 json.loads(result.response)
                 return result.response 
             except json.JSONDecodeError:
-                print(f"Response is not parsable JSON on attempt {attempt + 1}.")
-                if attempt >= max_retries - 1:
-                    st.error("Failed to get a parsable JSON response from the server.")
-                    st.text(result.response) # show the raw response
-                    return None
-                time.sleep(retry_delay)
+                st.error("Failed to get a parsable JSON response from the server.")
+                st.text(result.response) # show the raw response
+                return None
         except requests.exceptions.RequestException as e:
             st.error(f"Request failed on attempt {attempt + 1}: {e}")
             if attempt < max_retries - 1:
                 time.sleep(retry_delay)
     
     st.error("All retries failed. Could not generate review.")
-    return None
\ No newline at end of file
+    return None
+
+
+def notify_guidelines_changed():
+    """Tells the backend that the guidelines changed, so the review agents reload them before the next review."""
+    try:
+        response = requests.post(_get_api_url("/guidelines/version"), headers=_make_request_headers())
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        st.warning(f"Guidelines were saved, but the review service could not be notified: {e}")
@@ -0,0 +1,9 @@
+# BigQuery job metrics are shared with the backend; see agents/shared_libraries/bq_metrics.py
+import utils.repo_path  # noqa: F401
+from agents.shared_libraries.bq_metrics import (  # noqa: F401
+    BQ_METRICS_FILE,
+    hash_query_parameters,
+    record_metrics,
+    run_load_job,
+    run_query,
+)
@@ -1,7 +1,12 @@
 import streamlit as st, pandas as pd
-from google.cloud import bigquery
+import pyarrow as pa
+import pyarrow.compute as pc
+import uuid
+from google.cloud import bigquery, bigquery_storage
 from google.api_core.exceptions import NotFound
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from utils.bq_metrics import run_query, run_load_job
+from utils.api_utils import notify_guidelines_changed
 
 
 GCP_PROJECT_ID = st.session_state["project_id"]
@@ -24,6 +29,35 @@ def get_bq_client():
         st.error(f"Could not connect to BigQuery. Please check your GCP authentication. Error: {e}")
         return None
 
+@st.cache_resource
+def get_bqstorage_client():
+    """Initializes and caches the BigQuery Storage Read API client used for large result sets."""
+    try:
+        return bigquery_storage.BigQueryReadClient()
+    except Exception as e:
+        st.warning(f"BigQuery Storage API client not available, falling back to the REST API. Error: {e}")
+        return None
+
+def query_to_arrow(client, name: str, query: str, job_config=None) -> pa.Table:
+    """Runs a query and returns the result as an Arrow table, streamed through the Storage Read API.
+
+    REPEATED and STRUCT columns come back as native Arrow list/struct arrays
+    rather than Python objects.
+    """
+    query_job = run_query(client, name, query, job_config=job_config)
+    return query_job.to_arrow(bqstorage_client=get_bqstorage_client())
+
+def arrow_to_dataframe(table: pa.Table, arrow_dtypes: bool = True) -> pd.DataFrame:
+    """Wraps an Arrow table as a pyarrow-backed DataFrame without copying the column buffers.
+
+    With `arrow_dtypes=False` the default NumPy/object dtypes are used instead:
+    ArrowDtype turns NULLs into pd.NA, so `==` comparisons give NA-bearing masks
+    that cannot index a DataFrame. Use it for readers whose pages filter that way.
+    """
+    if not arrow_dtypes:
+        return table.to_pandas()
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
 def export_to_bigquery(df: pd.DataFrame, batch_id: str):
     """Exports the results DataFrame to a BigQuery table."""
     client = get_bq_client()
@@ -54,10 +88,7 @@ def export_to_bigquery(df: pd.DataFrame, batch_id: str):
 
     try:
         st.toast("Exporting results to BigQuery...")
-        job = client.load_table_from_dataframe(
-            df_to_load, BQ_TABLE_ID, job_config=job_config
-        )
-        job.result() 
+        run_load_job(client, "export_to_bigquery", df_to_load, BQ_TABLE_ID, job_config=job_config)
         st.success(f"Successfully exported results to BigQuery table: `{BQ_TABLE_ID}`")
         get_run_history.clear()
     except Exception as e:
@@ -84,7 +115,7 @@ def get_run_history():
     LIMIT 100;
     """
     try:
-        return client.query(query).to_dataframe()
+        return run_query(client, "get_run_history", query).to_dataframe()
     except Exception:
         return pd.DataFrame()
 
@@ -113,29 +144,21 @@ def get_history_details(batch_id: str):
         ]
     )
     try:
-        query_job = client.query(query, job_config=job_config)
+        query_job = run_query(client, "get_history_details", query, job_config=job_config)
         return query_job.to_dataframe()
     except Exception as e:
         st.error(f"Could not fetch history details: {e}")
         return pd.DataFrame()
 
-def insert_entity_to_bq(project_id: str, dataset_id: str, table_name: str, entity_name: str, xml_block: str, embedding: list[float]) -> bool:
-    """Inserts or updates an entity in a BigQuery table using a MERGE statement."""
-    client = get_bq_client()
-    if not client:
-        st.error("BigQuery client not available.")
-        return False
-
-    table_id = f"{project_id}.{dataset_id}.{table_name}"
+ENTITY_TABLE_SCHEMA = [
+    bigquery.SchemaField("complex_type_name", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("xml_block", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("embedding", "FLOAT64", mode="REPEATED"),
+    bigquery.SchemaField("load_timestamp", "TIMESTAMP", mode="REQUIRED"),
+]
 
-    schema = [
-        bigquery.SchemaField("complex_type_name", "STRING", mode="REQUIRED"),
-        bigquery.SchemaField("xml_block", "STRING", mode="REQUIRED"),
-        bigquery.SchemaField("embedding", "FLOAT64", mode="REPEATED"),
-        bigquery.SchemaField("load_timestamp", "TIMESTAMP", mode="REQUIRED"),
-    ]
-
-    # Create dataset and table if they don't exist
+def _ensure_entity_table(client, dataset_id: str, table_id: str) -> bool:
+    """Creates the entities dataset and table if they don't exist."""
     try:
         client.get_dataset(dataset_id)
     except NotFound:
@@ -150,13 +173,25 @@ def insert_entity_to_bq(project_id: str, dataset_id: str, table_name: str, entit
         client.get_table(table_id)
     except NotFound:
         st.info(f"Table {table_id} not found. Creating it.")
-        table = bigquery.Table(table_id, schema=schema)
+        table = bigquery.Table(table_id, schema=ENTITY_TABLE_SCHEMA)
         try:
             client.create_table(table)
             st.success(f"Table {table_id} created.")
         except Exception as e:
             st.error(f"Failed to create BigQuery table: {e}")
             return False
+    return True
+
+def insert_entity_to_bq(project_id: str, dataset_id: str, table_name: str, entity_name: str, xml_block: str, embedding: list[float]) -> bool:
+    """Inserts or updates an entity in a BigQuery table using a MERGE statement."""
+    client = get_bq_client()
+    if not client:
+        st.error("BigQuery client not available.")
+        return False
+
+    table_id = f"{project_id}.{dataset_id}.{table_name}"
+    if not _ensure_entity_table(client, dataset_id, table_id):
+        return False
 
     # Use MERGE statement for upsert logic
     merge_query = f"""
@@ -189,7 +224,7 @@ def insert_entity_to_bq(project_id: str, dataset_id: str, table_name: str, entit
     )
 
     try:
-        query_job = client.query(merge_query, job_config=job_config)
+        query_job = run_query(client, "insert_entity_to_bq", merge_query, job_config=job_config)
         query_job.result()  # Wait for the job to complete
 
         if query_job.num_dml_affected_rows is not None and query_job.num_dml_affected_rows > 0:
@@ -203,6 +238,68 @@ def insert_entity_to_bq(project_id: str, dataset_id: str, table_name: str, entit
         return False
 
 
+def bulk_upsert_entities(project_id: str, dataset_id: str, table_name: str, entities: pd.DataFrame) -> int | None:
+    """Upserts many entities with one staged load and one MERGE.
+
+    `entities` has complex_type_name, xml_block and embedding columns. The rows
+    are loaded into a short-lived staging table and merged into the entities
+    table in a single statement; if a name appears more than once, the last
+    occurrence wins. Returns the number of rows affected, or None on failure.
+    """
+    client = get_bq_client()
+    if not client:
+        st.error("BigQuery client not available.")
+        return None
+
+    table_id = f"{project_id}.{dataset_id}.{table_name}"
+    if not _ensure_entity_table(client, dataset_id, table_id):
+        return None
+
+    staging_table_id = f"{table_id}_staging_{uuid.uuid4().hex[:12]}"
+    staging_table = bigquery.Table(staging_table_id, schema=ENTITY_TABLE_SCHEMA + [
+        bigquery.SchemaField("load_order", "INT64", mode="REQUIRED"),
+    ])
+    # Expires on its own if the load is interrupted before the cleanup below
+    staging_table.expires = datetime.now(timezone.utc) + timedelta(hours=1)
+
+    df_to_load = entities[["complex_type_name", "xml_block", "embedding"]].copy()
+    df_to_load["load_timestamp"] = datetime.now(timezone.utc)
+    df_to_load["load_order"] = range(len(df_to_load))
+
+    merge_query = f"""
+    MERGE `{table_id}` T
+    USING (
+        SELECT complex_type_name, xml_block, embedding, load_timestamp
+        FROM `{staging_table_id}`
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY complex_type_name ORDER BY load_order DESC) = 1
+    ) S
+    ON T.complex_type_name = S.complex_type_name
+    WHEN MATCHED THEN
+        UPDATE SET
+            xml_block = S.xml_block,
+            embedding = S.embedding,
+            load_timestamp = S.load_timestamp
+    WHEN NOT MATCHED THEN
+        INSERT (complex_type_name, xml_block, embedding, load_timestamp)
+        VALUES (complex_type_name, xml_block, embedding, load_timestamp)
+    """
+
+    try:
+        client.create_table(staging_table)
+        job_config = bigquery.LoadJobConfig(
+            schema=staging_table.schema,
+            write_disposition="WRITE_TRUNCATE",
+        )
+        run_load_job(client, "bulk_upsert_entities_stage", df_to_load, staging_table_id, job_config=job_config)
+        query_job = run_query(client, "bulk_upsert_entities_merge", merge_query)
+        return query_job.num_dml_affected_rows or 0
+    except Exception as e:
+        st.error(f"An error occurred during the bulk BigQuery load: {e}")
+        return None
+    finally:
+        client.delete_table(staging_table_id, not_found_ok=True)
+
+
 def get_all_xml_blocks(project_id: str, dataset_id: str, table_name: str) -> pd.DataFrame:
     """Fetches all XML blocks from the specified BigQuery table."""
     client = get_bq_client()
@@ -214,7 +311,7 @@ def get_all_xml_blocks(project_id: str, dataset_id: str, table_name: str) -> pd.
     query = f"SELECT complex_type_name, xml_block FROM `{table_id}`"
 
     try:
-        query_job = client.query(query)
+        query_job = run_query(client, "get_all_xml_blocks", query)
         df = query_job.to_dataframe()
         return df
     except Exception as e:
@@ -267,7 +364,7 @@ def get_all_guidelines() -> pd.DataFrame:
     ) WHERE rn = 1"""
     
     try:
-        return client.query(query).to_dataframe()
+        return run_query(client, "get_all_guidelines", query).to_dataframe()
     except Exception:
         # Return empty dataframe if table doesn't exist
         return pd.DataFrame()
@@ -299,8 +396,9 @@ def add_guideline(guideline_text: str):
     )
 
     try:
-        client.query(query, job_config=job_config).result()
+        run_query(client, "add_guideline", query, job_config=job_config).result()
         st.success("Guideline added successfully!")
+        notify_guidelines_changed()
     except Exception as e:
         st.error(f"Failed to add guideline: {e}")
 
@@ -329,8 +427,9 @@ def update_guideline(guideline_id: str, new_text: str, is_active: bool):
     )
 
     try:
-        client.query(query, job_config=job_config).result()
+        run_query(client, "update_guideline", query, job_config=job_config).result()
         st.success("Guideline updated successfully!")
+        notify_guidelines_changed()
     except Exception as e:
         st.error(f"Failed to update guideline: {e}")
 
@@ -350,8 +449,9 @@ def delete_guideline(guideline_id: str):
     )
 
     try:
-        client.query(query, job_config=job_config).result()
+        run_query(client, "delete_guideline", query, job_config=job_config).result()
         st.success("Guideline deleted successfully!")
+        notify_guidelines_changed()
     except Exception as e:
         st.error(f"Failed to delete guideline: {e}")
 
@@ -385,7 +485,7 @@ def delete_analysis_data(q_id: str):
         )
 
         try:
-            client.query(query, job_config=job_config).result()
+            run_query(client, "delete_analysis_data", query, job_config=job_config).result()
             st.toast(f"Deleted data from {table_name} for q_id: {q_id}")
         except Exception as e:
             # Don't fail if a table doesn't exist
@@ -412,7 +512,7 @@ def delete_raw_sql_extract(q_id: str):
     )
 
     try:
-        client.query(query, job_config=job_config).result()
+        run_query(client, "delete_raw_sql_extract", query, job_config=job_config).result()
         st.toast(f"Deleted data from raw_sql_extracts for q_id: {q_id}")
     except Exception as e:
         st.error(f"Failed to delete data from raw_sql_extracts: {e}")
@@ -447,7 +547,7 @@ def get_sql_extract(file_name: str):
     )
 
     try:
-        query_job = client.query(query, job_config=job_config)
+        query_job = run_query(client, "get_sql_extract", query, job_config=job_config)
         results = query_job.to_dataframe()
         if not results.empty:
             return results.to_dict('records')[0]
@@ -469,10 +569,7 @@ def insert_df_to_bq(df: pd.DataFrame, table_id: str) -> bool:
     )
 
     try:
-        job = client.load_table_from_dataframe(
-            df, table_id, job_config=job_config
-        )
-        job.result()
+        run_load_job(client, "insert_df_to_bq", df, table_id, job_config=job_config)
         return True
     except Exception as e:
         st.error(f"Failed to insert data into BigQuery: {e}")
@@ -500,7 +597,7 @@ def update_processing_status(q_id: str, status: str):
     )
 
     try:
-        client.query(query, job_config=job_config).result()
+        run_query(client, "update_processing_status", query, job_config=job_config).result()
     except Exception as e:
         st.error(f"Failed to update processing status: {e}")
 
@@ -525,7 +622,16 @@ def get_all_sql_extracts():
         ORDER BY file_name
     """
     try:
-        return client.query(query).to_dataframe()
+        table = query_to_arrow(client, "get_all_sql_extracts", query)
+        # Flatten the REPEATED dependencies column to a display string in Arrow
+        # instead of joining Python lists row by row.
+        dependencies_idx = table.schema.get_field_index("dependencies")
+        table = table.set_column(
+            dependencies_idx,
+            "dependencies",
+            pc.binary_join(table.column("dependencies"), ", "),
+        )
+        return arrow_to_dataframe(table)
     except Exception as e:
         st.error(f"Could not fetch SQL extracts: {e}")
         return pd.DataFrame()
@@ -563,7 +669,7 @@ def get_tables_for_qid(q_ids: list[str]) -> pd.DataFrame:
         ]
     )
     try:
-        return client.query(query, job_config=job_config).to_dataframe()
+        return arrow_to_dataframe(query_to_arrow(client, "get_tables_for_qid", query, job_config=job_config))
     except Exception as e:
         st.error(f"Could not fetch tables for q_ids {q_ids}: {e}")
         return pd.DataFrame()
@@ -594,7 +700,7 @@ def get_statements_for_qids(q_ids: list[str]) -> pd.DataFrame:
         ]
     )
     try:
-        return client.query(query, job_config=job_config).to_dataframe()
+        return arrow_to_dataframe(query_to_arrow(client, "get_statements_for_qids", query, job_config=job_config))
     except Exception as e:
         st.error(f"Could not fetch statements: {e}")
         return pd.DataFrame()
@@ -629,7 +735,7 @@ def get_sources_for_sids(q_ids: list[str], s_ids: list[str]) -> pd.DataFrame:
         ]
     )
     try:
-        return client.query(query, job_config=job_config).to_dataframe()
+        return arrow_to_dataframe(query_to_arrow(client, "get_sources_for_sids", query, job_config=job_config))
     except Exception as e:
         st.error(f"Could not fetch sources: {e}")
         return pd.DataFrame()
@@ -662,21 +768,13 @@ def get_column_lineage_for_sids(q_ids: list[str], s_ids: list[str]) -> pd.DataFr
         ]
     )
     try:
-        return client.query(query, job_config=job_config).to_dataframe()
+        return arrow_to_dataframe(query_to_arrow(client, "get_column_lineage_for_sids", query, job_config=job_config))
     except Exception as e:
         st.error(f"Could not fetch column lineage: {e}")
         return pd.DataFrame()
 
-@st.cache_data(ttl=3600)
-def get_recursive_lineage_for_tables(selected_target_tables: list, selected_qids: list[str]) -> pd.DataFrame:
-    """Fetches the recursive column lineage for a given list of tables."""
-    client = get_bq_client()
-    if not client or not selected_target_tables:
-        return pd.DataFrame()
-
-    project_id = st.session_state.get("project_id", "r2d2-00")
-    dataset_id = st.session_state.get("guidelines_bq_dataset", "gdm")
-
+def _lineage_job_config(selected_target_tables: list, selected_qids: list[str], max_depth: int | None = None, dry_run: bool = False) -> bigquery.QueryJobConfig:
+    """Builds the query parameters shared by the recursive lineage queries."""
     struct_query_params = []
     for table in selected_target_tables:
         db_name = table.get("target_database_name")
@@ -693,7 +791,37 @@ def get_recursive_lineage_for_tables(selected_target_tables: list, selected_qids
             bigquery.StructQueryParameter(None, db_param, schema_param, table_param)
         )
 
-    query = f"""  
+    # Define the type of the STRUCTs within the ARRAY
+    struct_type = bigquery.StructQueryParameterType(
+        bigquery.ScalarQueryParameterType('STRING', name='target_database_name'),
+        bigquery.ScalarQueryParameterType('STRING', name='target_schema_name'),
+        bigquery.ScalarQueryParameterType('STRING', name='target_table_name')
+    )
+
+    # Create the ArrayQueryParameter
+    selected_tables_param = bigquery.ArrayQueryParameter(
+        'selected_target_tables',
+        struct_type,
+        struct_query_params  # Use the list of StructQueryParameter objects
+    )
+
+    qids_param = bigquery.ArrayQueryParameter(
+        'selected_qids',
+        'STRING',
+        selected_qids
+    )
+
+    max_depth_param = bigquery.ScalarQueryParameter('max_depth', 'INT64', max_depth)
+
+    return bigquery.QueryJobConfig(
+        query_parameters=[selected_tables_param, qids_param, max_depth_param],
+        dry_run=dry_run,
+        use_query_cache=not dry_run,
+    )
+
+def _recursive_lineage_query(project_id: str, dataset_id: str) -> str:
+    """Builds the recursive column lineage query for the given project and dataset."""
+    return f"""  
     WITH RECURSIVE
         all_column_links AS (
           -- This CTE flattens all known column links from your metadata
@@ -812,6 +940,8 @@ def get_recursive_lineage_for_tables(selected_target_tables: list, selected_qids
               COALESCE(next_hop.target_column_name, '')
             )
             NOT IN UNNEST(prev_hop.trace_path)
+            -- Optional depth limit, used when a full trace is too expensive
+            AND (@max_depth IS NULL OR prev_hop.depth < @max_depth)
         )
 
         /*
@@ -840,61 +970,9 @@ def get_recursive_lineage_for_tables(selected_target_tables: list, selected_qids
           depth;
     """
 
-    # Define the type of the STRUCTs within the ARRAY
-    struct_type = bigquery.StructQueryParameterType(
-        bigquery.ScalarQueryParameterType('STRING', name='target_database_name'),
-        bigquery.ScalarQueryParameterType('STRING', name='target_schema_name'),
-        bigquery.ScalarQueryParameterType('STRING', name='target_table_name')
-    )
-
-    # Create the ArrayQueryParameter
-    selected_tables_param = bigquery.ArrayQueryParameter(
-        'selected_target_tables',
-        struct_type,
-        struct_query_params  # Use the list of StructQueryParameter objects
-    )
-
-    qids_param = bigquery.ArrayQueryParameter(
-        'selected_qids',
-        'STRING',
-        selected_qids
-    )
-
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[selected_tables_param, qids_param]
-    )
-
-    try:
-        return client.query(query, job_config=job_config).to_dataframe()
-    except Exception as e:
-        st.error(f"Could not fetch recursive lineage: {e}")
-        return pd.DataFrame()
-
-@st.cache_data(ttl=3600)
-def get_detailed_lineage_for_tables(selected_target_tables: list, selected_qids: list[str]) -> pd.DataFrame:
-    """Fetches the detailed column lineage for a given list of tables, including full path information."""
-    client = get_bq_client()
-    if not client or not selected_target_tables:
-        return pd.DataFrame()
-
-    project_id = st.session_state.get("project_id", "r2d2-00")
-    dataset_id = st.session_state.get("guidelines_bq_dataset", "gdm")
-
-    struct_query_params = []
-    for table in selected_target_tables:
-        db_name = table.get("target_database_name")
-        schema_name = table.get("target_schema_name")
-        table_name = table.get("target_table_name")
-
-        db_param = bigquery.ScalarQueryParameter("target_database_name", "STRING", db_name if pd.notna(db_name) else None)
-        schema_param = bigquery.ScalarQueryParameter("target_schema_name", "STRING", schema_name if pd.notna(schema_name) else None)
-        table_param = bigquery.ScalarQueryParameter("target_table_name", "STRING", table_name if pd.notna(table_name) else None)
-
-        struct_query_params.append(
-            bigquery.StructQueryParameter(None, db_param, schema_param, table_param)
-        )
-
-    query = f"""
+def _detailed_lineage_query(project_id: str, dataset_id: str) -> str:
+    """Builds the detailed (end-of-path) column lineage query for the given project and dataset."""
+    return f"""
     WITH RECURSIVE
         all_column_links AS (
           -- [This CTE is unchanged]
@@ -1043,6 +1121,8 @@ def get_detailed_lineage_for_tables(selected_target_tables: list, selected_qids:
               COALESCE(next_hop.target_column_name, '')
             )
             NOT IN UNNEST(prev_hop.trace_path)
+            -- Optional depth limit, used when a full trace is too expensive
+            AND (@max_depth IS NULL OR prev_hop.depth < @max_depth)
         )
 
     /*
@@ -1076,53 +1156,154 @@ def get_detailed_lineage_for_tables(selected_target_tables: list, selected_qids:
       ) AS lineage_path_string,
 
       -- This column contains all details if you need them in a nested table
-      lt.full_path_hops
+      lt.full_path_hops,
+
+      -- Hashable stand-in for full_path_hops so callers can deduplicate without
+      -- materialising the nested array as Python objects
+      FARM_FINGERPRINT(TO_JSON_STRING(lt.full_path_hops)) AS path_fingerprint,
+
+      -- The path was cut off by @max_depth: its source has further upstream links
+      NOT lt.is_path_end AS truncated
 
-    FROM
-      lineage_trace AS lt
+    FROM (
+      SELECT
+        trace.*,
+        -- *** MODIFICATION 3: "end-of-path" rows ***
+        -- The source is a "leaf" (i.e., it's not a target for any other link)
+        NOT EXISTS (
+          SELECT 1
+          FROM all_column_links AS next_link
+          WHERE next_link.target_database_name IS NOT DISTINCT FROM trace.source_database_name
+            AND next_link.target_schema_name IS NOT DISTINCT FROM trace.source_schema_name
+            AND next_link.target_table_name IS NOT DISTINCT FROM trace.source_table_name
+            AND next_link.target_column_name IS NOT DISTINCT FROM trace.source_column_name
+        )
+        -- Also rows where the trace just stopped (source is NULL)
+        OR trace.source_column_name IS NULL AS is_path_end
+      FROM
+        lineage_trace AS trace
+    ) AS lt
     WHERE
-      -- *** MODIFICATION 3: Filter for "end-of-path" rows only ***
-      -- This selects only the rows where the source is a "leaf" (i.e., it's not a target for any other link)
-      NOT EXISTS (
-        SELECT 1
-        FROM all_column_links AS next_link
-        WHERE next_link.target_database_name IS NOT DISTINCT FROM lt.source_database_name
-          AND next_link.target_schema_name IS NOT DISTINCT FROM lt.source_schema_name
-          AND next_link.target_table_name IS NOT DISTINCT FROM lt.source_table_name
-          AND next_link.target_column_name IS NOT DISTINCT FROM lt.source_column_name
-      )
-      -- Also include rows where the trace just stopped (source is NULL)
-      OR lt.source_column_name IS NULL
+      lt.is_path_end
+      -- Paths that hit the depth limit end here too, flagged as truncated
+      OR (@max_depth IS NOT NULL AND lt.depth >= @max_depth)
     ORDER BY
       final_target_table,
       final_target_column,
       max_depth;
     """
 
-    struct_type = bigquery.StructQueryParameterType(
-        bigquery.ScalarQueryParameterType('STRING', name='target_database_name'),
-        bigquery.ScalarQueryParameterType('STRING', name='target_schema_name'),
-        bigquery.ScalarQueryParameterType('STRING', name='target_table_name')
-    )
+@st.cache_data(ttl=3600)
+def estimate_lineage_cost(selected_target_tables: list, selected_qids: list[str], depth: int = 5) -> dict:
+    """Estimates the cost of a recursive lineage trace before running it.
 
-    selected_tables_param = bigquery.ArrayQueryParameter(
-        'selected_target_tables',
-        struct_type,
-        struct_query_params
-    )
+    Dry-runs the recursive query for the bytes it would scan and counts the column
+    links in the selected q_ids to estimate how far the recursion fans out over
+    `depth` hops. `depth` is an argument (not read from session state) so the
+    cached estimate is keyed on it.
+    """
+    client = get_bq_client()
+    if not client or not selected_target_tables:
+        return {}
 
-    qids_param = bigquery.ArrayQueryParameter(
-        'selected_qids',
-        'STRING',
-        selected_qids
-    )
+    project_id = st.session_state.get("project_id", "r2d2-00")
+    dataset_id = st.session_state.get("guidelines_bq_dataset", "gdm")
 
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[selected_tables_param, qids_param]
+    edge_query = f"""
+    WITH links AS (
+      SELECT
+        q.target_database_name,
+        q.target_schema_name,
+        q.target_table_name,
+        ARRAY_LENGTH(l.source_references) AS source_count
+      FROM
+        `{project_id}.{dataset_id}.query_statements` AS q
+      JOIN
+        `{project_id}.{dataset_id}.column_lineage` AS l
+        ON q.q_id = l.q_id AND q.s_id = l.s_id
+      WHERE q.q_id IN UNNEST(@selected_qids)
     )
+    SELECT
+      COUNT(*) AS link_count,
+      IFNULL(SUM(GREATEST(IFNULL(source_count, 0), 1)), 0) AS edge_count,
+      COUNTIF(EXISTS(
+        SELECT 1
+        FROM UNNEST(@selected_target_tables) AS t
+        WHERE links.target_database_name = t.target_database_name
+          AND links.target_table_name = t.target_table_name
+          AND links.target_schema_name IS NOT DISTINCT FROM t.target_schema_name
+      )) AS anchor_count
+    FROM links
+    """
+
+    try:
+        dry_run_job = run_query(
+            client,
+            "estimate_lineage_cost_dry_run",
+            _recursive_lineage_query(project_id, dataset_id),
+            job_config=_lineage_job_config(selected_target_tables, selected_qids, dry_run=True),
+        )
+        counts = run_query(
+            client,
+            "estimate_lineage_cost_edges",
+            edge_query,
+            job_config=_lineage_job_config(selected_target_tables, selected_qids),
+        ).to_dataframe().iloc[0]
+    except Exception as e:
+        st.warning(f"Could not estimate lineage query cost: {e}")
+        return {}
+
+    link_count = int(counts["link_count"])
+    edge_count = int(counts["edge_count"])
+    anchor_count = int(counts["anchor_count"])
+    # Average number of upstream sources per column link; the trace grows roughly
+    # by this factor on every hop.
+    fan_out = edge_count / link_count if link_count else 0.0
+    estimated_rows = anchor_count * sum(fan_out ** d for d in range(depth))
+
+    return {
+        "bytes_processed": dry_run_job.total_bytes_processed or 0,
+        "link_count": link_count,
+        "edge_count": edge_count,
+        "anchor_count": anchor_count,
+        "fan_out": round(fan_out, 2),
+        "estimated_rows": int(estimated_rows),
+    }
+
+@st.cache_data(ttl=3600)
+def get_recursive_lineage_for_tables(selected_target_tables: list, selected_qids: list[str], max_depth: int | None = None) -> pd.DataFrame:
+    """Fetches the recursive column lineage for a given list of tables, optionally limited to `max_depth` hops."""
+    client = get_bq_client()
+    if not client or not selected_target_tables:
+        return pd.DataFrame()
+
+    project_id = st.session_state.get("project_id", "r2d2-00")
+    dataset_id = st.session_state.get("guidelines_bq_dataset", "gdm")
+
+    query = _recursive_lineage_query(project_id, dataset_id)
+    job_config = _lineage_job_config(selected_target_tables, selected_qids, max_depth)
+
+    try:
+        return arrow_to_dataframe(query_to_arrow(client, "get_recursive_lineage_for_tables", query, job_config=job_config))
+    except Exception as e:
+        st.error(f"Could not fetch recursive lineage: {e}")
+        return pd.DataFrame()
+
+@st.cache_data(ttl=3600)
+def get_detailed_lineage_for_tables(selected_target_tables: list, selected_qids: list[str], max_depth: int | None = None) -> pd.DataFrame:
+    """Fetches the detailed column lineage for a given list of tables, including full path information."""
+    client = get_bq_client()
+    if not client or not selected_target_tables:
+        return pd.DataFrame()
+
+    project_id = st.session_state.get("project_id", "r2d2-00")
+    dataset_id = st.session_state.get("guidelines_bq_dataset", "gdm")
+
+    query = _detailed_lineage_query(project_id, dataset_id)
+    job_config = _lineage_job_config(selected_target_tables, selected_qids, max_depth)
 
     try:
-        return client.query(query, job_config=job_config).to_dataframe()
+        return arrow_to_dataframe(query_to_arrow(client, "get_detailed_lineage_for_tables", query, job_config=job_config))
     except Exception as e:
         st.error(f"Could not fetch detailed lineage: {e}")
         return pd.DataFrame()
@@ -1151,7 +1332,8 @@ def get_all_source_tables() -> pd.DataFrame:
         ORDER BY 1, 2
     """
     try:
-        return client.query(query).to_dataframe()
+        # Filtered with boolean masks in pages/sql_stats.py, which NA values would break
+        return arrow_to_dataframe(query_to_arrow(client, "get_all_source_tables", query), arrow_dtypes=False)
     except Exception as e:
         st.error(f"Could not fetch source tables: {e}")
         return pd.DataFrame()
@@ -1186,7 +1368,8 @@ def get_source_column_usage() -> pd.DataFrame:
         ORDER BY 1, 2, 3
     """
     try:
-        return client.query(query).to_dataframe()
+        # Filtered with boolean masks in pages/sql_stats.py, which NA values would break
+        return arrow_to_dataframe(query_to_arrow(client, "get_source_column_usage", query), arrow_dtypes=False)
     except Exception as e:
         st.error(f"Could not fetch source column usage: {e}")
         return pd.DataFrame()
@@ -1229,7 +1412,8 @@ def get_all_joins() -> pd.DataFrame:
         ORDER BY usage_count DESC
     """
     try:
-        return client.query(query).to_dataframe()
+        # Filtered with boolean masks in pages/sql_stats.py, which NA values would break
+        return arrow_to_dataframe(query_to_arrow(client, "get_all_joins", query), arrow_dtypes=False)
     except Exception as e:
         st.error(f"Could not fetch joins: {e}")
         return pd.DataFrame()
@@ -1262,7 +1446,7 @@ def insert_raw_sql_extract_placeholder(q_id: str, file_name: str):
     )
 
     try:
-        client.query(merge_query, job_config=job_config).result()
+        run_query(client, "insert_raw_sql_extract_placeholder", merge_query, job_config=job_config).result()
         return True
     except Exception as e:
         st.error(f"Failed to insert placeholder for {file_name}: {e}")
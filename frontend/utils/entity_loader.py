@@ -0,0 +1,71 @@
+import glob
+import os
+import xml.etree.ElementTree as ET
+from typing import IO, Iterator, NamedTuple, Union
+
+
+class EntityBlock(NamedTuple):
+    """A single `complexType` entity cut out of an ER Studio XML export."""
+    name: str
+    xml_block: str
+
+
+def _local_name(tag) -> str:
+    return tag.split("}", 1)[1] if isinstance(tag, str) and tag.startswith("{") else tag
+
+
+def iter_entities(source: Union[str, IO[bytes]]) -> Iterator[EntityBlock]:
+    """Streams the top-level `complexType` entities out of an XML export, in document order.
+
+    The export is read with iterparse and every top-level element is freed once
+    it has been handled, so memory stays flat regardless of the model size.
+    Nested complex types stay inside the entity that declares them; an
+    anonymous complexType is kept with its named `<element>`.
+    """
+    stack: list[ET.Element] = []
+    # id(<element>) -> entity name, for anonymous complexTypes emitted when their <element> closes
+    pending: dict[int, str] = {}
+    entity_depth = None
+
+    for event, payload in ET.iterparse(source, events=("start", "end", "start-ns")):
+        if event == "start-ns":
+            prefix, uri = payload
+            # Serialize with the export's own prefixes (xs:, xsd:, ...) rather than ns0:
+            try:
+                ET.register_namespace(prefix, uri)
+            except ValueError:
+                pass  # ns0-style prefixes are reserved; ElementTree generates those itself
+            continue
+
+        element = payload
+        if event == "start":
+            if _local_name(element.tag) == "complexType" and entity_depth is None:
+                entity_depth = len(stack)
+            stack.append(element)
+            continue
+
+        stack.pop()
+        parent = stack[-1] if stack else None
+
+        if entity_depth == len(stack):
+            entity_depth = None
+            name = element.get("name")
+            if name:
+                yield EntityBlock(name, ET.tostring(element, encoding="unicode").strip())
+            elif parent is not None and _local_name(parent.tag) == "element" and parent.get("name"):
+                pending[id(parent)] = parent.get("name")
+
+        name = pending.pop(id(element), None)
+        if name:
+            yield EntityBlock(name, ET.tostring(element, encoding="unicode").strip())
+
+        if parent is not None and len(stack) == 1:
+            # Direct child of the document root: handled, so drop it
+            parent.remove(element)
+
+
+def iter_entities_from_directory(directory: str) -> Iterator[tuple[str, EntityBlock]]:
+    """Streams (file name, entity) for every .xml file in a directory, in file name order."""
+    for path in sorted(glob.glob(os.path.join(directory, "*.xml"))):
+        for entity in iter_entities(path):
+            yield os.path.basename(path), entity
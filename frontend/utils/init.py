@@ -64,4 +64,15 @@ def init_session_state():
         st.session_state.file_uploader_key = 0
     if "get_sources_for_sids" not in st.session_state:
         st.session_state.get_sources_for_sids = None
-    
+    if "lineage_warn_bytes" not in st.session_state:
+        st.session_state.lineage_warn_bytes = 1 * 1024**3  # 1 GiB
+    if "lineage_max_bytes" not in st.session_state:
+        st.session_state.lineage_max_bytes = 10 * 1024**3  # 10 GiB
+    if "lineage_warn_rows" not in st.session_state:
+        st.session_state.lineage_warn_rows = 100_000
+    if "lineage_max_rows" not in st.session_state:
+        st.session_state.lineage_max_rows = 1_000_000
+    if "lineage_estimate_depth" not in st.session_state:
+        st.session_state.lineage_estimate_depth = 5
+    if "lineage_fallback_depth" not in st.session_state:
+        st.session_state.lineage_fallback_depth = 3
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Streamlit puts only frontend/ on sys.path. The backend's agents/ package sits
+# next to it, both in the repo and in the frontend image (see frontend/Dockerfile),
+# so adding the repo root lets the frontend share agents.shared_libraries modules
+# instead of keeping copies of them.
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if REPO_ROOT not in sys.path:
+    sys.path.append(REPO_ROOT)
@@ -1,6 +1,10 @@
+import logging
 import streamlit as st
 import vertexai
+from concurrent.futures import ThreadPoolExecutor
 from vertexai.language_models import TextEmbeddingModel, TextEmbeddingInput
+import utils.repo_path  # noqa: F401
+from agents.shared_libraries.rate_limiter import get_limiter
 
 # Initialize Vertex AI (replace with your project and location)
 # try:
@@ -21,7 +25,7 @@ def generate_embedding(text: str, task_type: str = "RETRIEVAL_DOCUMENT") -> list
         text_input = TextEmbeddingInput(text=text, task_type=task_type)
 
         # gemini-embedding-001 processes one input at a time
-        embeddings = model.get_embeddings([text_input])
+        embeddings = get_limiter("text-embedding").call(model.get_embeddings, [text_input])
 
         if embeddings:
             return embeddings[0].values
@@ -30,5 +34,38 @@ def generate_embedding(text: str, task_type: str = "RETRIEVAL_DOCUMENT") -> list
         st.error(f"Could not generate embedding: {e}")
         return []
 
+def generate_embeddings_concurrently(texts: list[str], task_type: str = "RETRIEVAL_DOCUMENT", max_workers: int = 8) -> tuple[list[list[float]], dict[int, str]]:
+    """Generates embeddings for many texts, keeping up to `max_workers` requests in flight.
+
+    gemini-embedding-001 takes one input per request, so throughput comes from
+    concurrency. Requests go through the shared "text-embedding" limiter, which
+    backs off and lowers the concurrency on 429s and retries throttled calls.
+    Returns one embedding per text, in order (empty for a failed text), and the
+    error message of every failed text by index. Safe to call off the Streamlit
+    script thread.
+    """
+    model = TextEmbeddingModel.from_pretrained("gemini-embedding-001")
+    limiter = get_limiter("text-embedding")
+    errors: dict[int, str] = {}
+
+    def embed(index: int, text: str) -> list[float]:
+        if not text:
+            errors[index] = "empty text"
+            return []
+        try:
+            embeddings = limiter.call(model.get_embeddings, [TextEmbeddingInput(text=text, task_type=task_type)])
+        except Exception as e:
+            logging.error(f"Could not generate embedding: {e}")
+            errors[index] = str(e)
+            return []
+        if not embeddings:
+            errors[index] = "no embedding returned"
+            return []
+        return embeddings[0].values
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        embeddings = list(executor.map(embed, range(len(texts)), texts))
+    return embeddings, errors
+
 # Alias for backward compatibility if other files use `generate_embeddings`
 generate_embeddings = generate_embedding
\ No newline at end of file